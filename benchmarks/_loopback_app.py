@@ -0,0 +1,62 @@
+"""The app with the frontend status route as it was before it went in-process.
+
+Only used as the baseline of `bench_frontend_poll.py`.
+"""
+import json
+
+import httpx
+from fastapi import Request, Response
+
+from wqw_app import api
+from wqw_app.app import app
+from wqw_app.frontend import get_templates
+
+
+@app.get("/legacy/status/{task_id}", include_in_schema=False)
+async def legacy_get_progress(request: Request, task_id: str) -> Response:
+    """Get task status through an HTTP request back to the JSON API."""
+    async with httpx.AsyncClient() as client:
+        # Get result for task from server.
+        response = await client.get(
+            request.url_for(api.read_task.__name__, task_id=task_id)
+        )
+
+        data = {}
+        try:
+            data = response.json()
+        except json.JSONDecodeError:
+            print("JSON decoding failed")
+
+        assert data.get("function", None) == "async_fib"
+
+        status = data.get("status", "not_found")
+        progress = round(100 * float(data.get("progress", 0)))
+        number = data.get("args", [None])[0]
+        result = data.get("result")
+
+        responses = {
+            "in_progress": get_templates().TemplateResponse(
+                "partials/in_progress.html",
+                {
+                    "request": request,
+                    "task_id": task_id,
+                    "number": number,
+                    "progress": progress,
+                },
+            ),
+            "complete": get_templates().TemplateResponse(
+                "partials/complete.html",
+                {"request": request, "number": number, "result": result},
+            ),
+            "not_found": get_templates().TemplateResponse(
+                "partials/error.html",
+                {
+                    "request": request,
+                    "number": number,
+                    "task_id": task_id,
+                    "error": "not found",
+                },
+            ),
+        }
+
+    return responses.get(status, responses["not_found"])
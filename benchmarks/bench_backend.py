@@ -0,0 +1,166 @@
+"""Benchmark of the in-process backend against Redis and an arq worker.
+
+Times jobs from enqueueing to their result, one at a time and as a burst
+of jobs enqueued at once, through the Redis backend and a worker started
+for the benchmark, and through the in-process backend with a pool of as
+many processes. Every job computes a different number, so that none is
+answered from the result cache. The Redis path mostly waits for the polls
+of the dispatcher and the worker:
+
+    python benchmarks/bench_backend.py --jobs 50 --burst 100
+
+Needs a running Redis, of which it flushes and uses database 15 by default,
+and is run from the repository root.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+from typing import Any, Dict, List, Union
+
+# The Redis settings are read on import.
+os.environ.setdefault("REDIS_DATABASE", "15")
+
+# pylint: disable=wrong-import-position
+from wqw_app.backend import Backend
+from wqw_app.local import LocalBackend
+from wqw_app.settings import BackendSettings
+from wqw_app.worker import async_fib, Engine
+
+# A worker already running keeps the port of its metrics exporter.
+ENV = {**os.environ, "METRICS_WORKER_PORT": "0", "BACKEND_LOCAL": "false"}
+
+
+async def latencies(
+    backend: Union[Backend, LocalBackend], numbers: List[int], poll_delay: float
+) -> List[float]:
+    """Return the seconds from enqueueing to the result of every job, one at
+    a time."""
+    seconds = []
+    for number in numbers:
+        start = time.perf_counter()
+        job = await backend.enqueue_job(
+            async_fib, number, engine=Engine.fast_doubling.value
+        )
+        assert job is not None
+        await job.result(timeout=60, poll_delay=poll_delay)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+async def burst(
+    backend: Union[Backend, LocalBackend], numbers: List[int], poll_delay: float
+) -> float:
+    """Return the seconds from enqueueing all jobs at once to their last
+    result."""
+    start = time.perf_counter()
+    jobs = await backend.enqueue_jobs(
+        async_fib,
+        [((number,), {"engine": Engine.fast_doubling.value}) for number in numbers],
+    )
+    await asyncio.gather(
+        *[job.result(timeout=60, poll_delay=poll_delay) for job in jobs]
+    )
+    return time.perf_counter() - start
+
+
+def summary(seconds: List[float], total_s: float, jobs: int) -> Dict[str, float]:
+    """Return the latency percentiles and the burst throughput."""
+    quantiles = statistics.quantiles(seconds, n=100)
+    return {
+        "p50_s": statistics.median(seconds),
+        "p90_s": quantiles[89],
+        "max_s": max(seconds),
+        "burst_s": total_s,
+        "burst_jobs_per_s": jobs / total_s,
+    }
+
+
+async def bench_redis(args: argparse.Namespace, workdir: str) -> Dict[str, float]:
+    """Time jobs through Redis and a worker."""
+    backend = Backend()
+    await backend.init()
+    await backend.redis_arq.flushdb()
+    worker = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from arq.cli import cli; cli()",
+            "wqw_app.worker.WorkerSettings",
+        ],
+        cwd=workdir,
+        env=ENV,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        # Wait for the worker to take jobs.
+        await latencies(backend, [args.number - 1], args.poll_delay)
+        seconds = await latencies(
+            backend, [args.number + i for i in range(args.jobs)], args.poll_delay
+        )
+        total_s = await burst(
+            backend,
+            [args.number + args.jobs + i for i in range(args.burst)],
+            args.poll_delay,
+        )
+    finally:
+        worker.terminate()
+        worker.wait()
+        await backend.redis_arq.flushdb()
+        await backend.close()
+    return summary(seconds, total_s, args.burst)
+
+
+async def bench_local(args: argparse.Namespace, workdir: str) -> Dict[str, float]:
+    """Time jobs through the in-process backend."""
+    os.chdir(workdir)
+    backend = LocalBackend(BackendSettings(local=True, processes=args.processes))
+    await backend.init()
+    try:
+        seconds = await latencies(
+            backend, [args.number + i for i in range(args.jobs)], args.poll_delay
+        )
+        total_s = await burst(
+            backend,
+            [args.number + args.jobs + i for i in range(args.burst)],
+            args.poll_delay,
+        )
+    finally:
+        await backend.close()
+    return summary(seconds, total_s, args.burst)
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the benchmark on both backends."""
+    results: Dict[str, Any] = {
+        "meta": {
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "processes": args.processes,
+            "number": args.number,
+            "jobs": args.jobs,
+            "burst": args.burst,
+        }
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        results["redis"] = await bench_redis(args, workdir)
+        results["local"] = await bench_local(args, workdir)
+    results["speedup_p50"] = results["redis"]["p50_s"] / results["local"]["p50_s"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=100_000)
+    parser.add_argument("--jobs", type=int, default=30)
+    parser.add_argument("--burst", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--poll-delay", type=float, default=0.005)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,134 @@
+"""Benchmark the htmx status poll of the frontend.
+
+Simulates `--tabs` open browser tabs, each polling the status of a task once
+per second, against the in-process frontend route and against the former
+route that made an HTTP request back to the JSON API. Reports client-side
+latency percentiles and server CPU time per poll as JSON.
+
+Needs a running Redis and worker, and is run from the repository root:
+
+    python benchmarks/bench_frontend_poll.py --tabs 300 --duration 20
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+REPO = Path(__file__).resolve().parents[1]
+
+
+def server_cpu_seconds(pid: int) -> float:
+    """Return user + system CPU time of a process (Linux only)."""
+    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Return a percentile of `samples`."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def poll(client: httpx.AsyncClient, url: str, stop: float) -> List[float]:
+    """Poll `url` once per second until `stop`, returning latencies in ms."""
+    latencies = []
+    while (start := time.perf_counter()) < stop:
+        response = await client.get(url)
+        response.raise_for_status()
+        latencies.append(1000 * (time.perf_counter() - start))
+        await asyncio.sleep(max(0.0, 1.0 - (time.perf_counter() - start)))
+    return latencies
+
+
+async def run(url: str, tabs: int, duration: float, pid: int) -> Dict[str, float]:
+    """Run `tabs` concurrent pollers against `url`."""
+    limits = httpx.Limits(max_connections=tabs, max_keepalive_connections=tabs)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        await client.get(url)  # warm up
+        cpu_start = server_cpu_seconds(pid)
+        stop = time.perf_counter() + duration
+        results = await asyncio.gather(*[poll(client, url, stop) for _ in range(tabs)])
+        cpu = server_cpu_seconds(pid) - cpu_start
+
+    latencies = [latency for tab in results for latency in tab]
+    return {
+        "polls": len(latencies),
+        "mean_ms": statistics.mean(latencies),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "server_cpu_ms_per_poll": 1000 * cpu / len(latencies),
+    }
+
+
+async def main(args: argparse.Namespace) -> Dict[str, object]:
+    """Start a server, create a task and benchmark both status routes."""
+    base = f"http://127.0.0.1:{args.port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        (Path(workdir) / "static").mkdir()
+        (Path(workdir) / "templates").symlink_to(REPO / "templates")
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "--app-dir",
+                str(REPO / "benchmarks"),
+                "--port",
+                str(args.port),
+                "--log-level",
+                "warning",
+                "_loopback_app:app",
+            ],
+            cwd=workdir,
+        )
+        try:
+            async with httpx.AsyncClient() as client:
+                for _ in range(50):
+                    try:
+                        response = await client.post(
+                            f"{base}/api/compute/{args.number}"
+                        )
+                        break
+                    except httpx.TransportError:
+                        await asyncio.sleep(0.2)
+                task_id = response.json()["task_id"]
+                await asyncio.sleep(1)
+
+            return {
+                "tabs": args.tabs,
+                "duration_s": args.duration,
+                "in_process": await run(
+                    f"{base}/frontend/status/{task_id}",
+                    args.tabs,
+                    args.duration,
+                    server.pid,
+                ),
+                "loopback": await run(
+                    f"{base}/legacy/status/{task_id}",
+                    args.tabs,
+                    args.duration,
+                    server.pid,
+                ),
+            }
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tabs", type=int, default=300)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--number", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8765)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,287 @@
+"""Microbenchmarks of the compute engines and the backend hot paths.
+
+Times `fib` per engine, `binet` and `FibonacciTracker.countup` over ranges of
+n, the overhead of progress reporting, `Backend.info_many` / `info_all` over
+1k, 10k and 100k stored jobs, and building the JSON responses of the API.
+Results are written as JSON, keyed by benchmark name, and compared against
+an earlier run with `--compare`.
+
+The backend benchmarks fill and flush a Redis database of their own, by
+default database 15 of the local Redis, and are run from the repository
+root:
+
+    python benchmarks/bench_micro.py --output bench.json
+    python benchmarks/bench_micro.py --compare bench.json --skip backend
+"""
+import os
+import json
+import time
+import timeit
+import asyncio
+import argparse
+import platform
+import contextlib
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# The backend singleton reads the Redis settings on import.
+os.environ.setdefault("REDIS_DATABASE", "15")
+
+# pylint: disable=wrong-import-position
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from arq import constants
+from arq.jobs import JobStatus, serialize_result
+from arq.utils import timestamp_ms
+
+from wqw_app import api, progress
+from wqw_app.backend import backend
+from wqw_app.progress import ProgressRelay
+from wqw_app.worker import binet, fib, Engine, FibonacciTracker
+
+REPO = Path(__file__).resolve().parents[1]
+
+# Numbers timed per engine, up to about a second per call.
+FIB_NUMBERS = {
+    Engine.naive: [10, 20, 25],
+    Engine.iterative: [1_000, 10_000, 100_000],
+    Engine.fast_doubling: [1_000, 100_000, 1_000_000],
+    Engine.matrix: [1_000, 100_000, 1_000_000],
+}
+
+Results = Dict[str, Dict[str, float]]
+
+
+def measure(func: Callable[[], Any], repeat: int = 5) -> Dict[str, float]:
+    """Return the best and median seconds per call of `func`.
+
+    Calls are looped so that every repeat takes at least 0.2 s.
+    """
+    timer = timeit.Timer(func)
+    (loops, _) = timer.autorange()
+    times = [total / loops for total in timer.repeat(repeat=repeat, number=loops)]
+    return {"best_s": min(times), "median_s": statistics.median(times), "loops": loops}
+
+
+async def measure_async(func: Callable[[], Any], repeat: int = 3) -> Dict[str, float]:
+    """Return the best and median seconds per await of `func()`."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        times.append(time.perf_counter() - start)
+    return {"best_s": min(times), "median_s": statistics.median(times), "loops": 1}
+
+
+def bench_compute(results: Results) -> None:
+    """Time the engines, Binet's formula and the tracker."""
+    # Trackers print their progress.
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            for (engine, numbers) in FIB_NUMBERS.items():
+                for number in numbers:
+                    results[f"compute/fib[{engine.value},n={number}]"] = measure(
+                        lambda number=number, engine=engine: fib(number, engine=engine)
+                    )
+            for number in [10, 100, 1000]:
+                results[f"compute/binet[n={number}]"] = measure(
+                    lambda number=number: binet(number)
+                )
+
+            tracker = FibonacciTracker(10 ** 6, Engine.iterative)
+            results["compute/countup[x1000]"] = measure(
+                lambda: [tracker.countup() for _ in range(1000)]
+            )
+
+
+def bench_progress(results: Results) -> None:
+    """Time progress reporting, into a shared slot and to Redis."""
+    relay = ProgressRelay(1)
+    progress.init_process(relay.slots, relay.aborts)
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            for engine in (Engine.iterative, Engine.fast_doubling):
+                number = FIB_NUMBERS[engine][-1]
+                results[f"progress/fib[{engine.value},untracked]"] = measure(
+                    lambda number=number, engine=engine: fib(number, engine=engine)
+                )
+                results[f"progress/fib[{engine.value},slot]"] = measure(
+                    lambda number=number, engine=engine: fib(
+                        number, {"slot": 0}, engine=engine
+                    )
+                )
+    progress.init_process(None, None)
+    results["progress/report"] = measure(lambda: progress.report(0, 0.5))
+
+
+async def bench_relay(results: Results, jobs: int = 100) -> None:
+    """Time one flush of the progress of `jobs` running jobs to Redis."""
+    relay = ProgressRelay(jobs)
+    for job in range(jobs):
+        await relay.acquire(f"bench-{job}")
+
+    async def flush() -> None:
+        for slot in range(jobs):
+            relay.set(slot, relay.slots[slot] + 0.001)
+        await relay.flush(backend.redis_arq)
+
+    results[f"progress/relay_flush[jobs={jobs}]"] = await measure_async(
+        flush, repeat=10
+    )
+
+
+async def fill(count: int) -> List[str]:
+    """Store `count` completed jobs, as `Backend.complete_job` would."""
+    redis = backend.redis_arq
+    await redis.flushdb()
+    job_ids = [f"bench{i:06d}" for i in range(count)]
+    values = [fib(number) for number in range(1, 91)]
+    now_ms = timestamp_ms()
+    for start in range(0, count, 10_000):
+        batch = list(enumerate(job_ids[start : start + 10_000], start=start))
+        pipe = redis.pipeline()
+        for (i, job_id) in batch:
+            pipe.set(
+                constants.result_key_prefix + job_id,
+                serialize_result(
+                    "async_fib",
+                    (i + 1,),
+                    {"engine": Engine.fast_doubling.value},
+                    1,
+                    now_ms,
+                    True,
+                    values[i % 90],
+                    now_ms,
+                    now_ms,
+                    f"{job_id}:async_fib",
+                    constants.default_queue_name,
+                ),
+            )
+        await pipe.execute()
+        await backend.index.add_many(
+            [(job_id, now_ms + i) for (i, job_id) in batch], JobStatus.complete
+        )
+    return job_ids
+
+
+async def bench_backend(results: Results, job_counts: List[int]) -> None:
+    """Time job info lookups and the JSON responses built from them."""
+    app = FastAPI()
+    app.include_router(api.router, prefix="/api")
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        for count in job_counts:
+            with open(os.devnull, "w", encoding="utf-8") as devnull:
+                with contextlib.redirect_stdout(devnull):
+                    job_ids = await fill(count)
+            page = job_ids[: api.MAX_RESULTS]
+
+            results[f"backend/info_many[jobs={count}]"] = await measure_async(
+                lambda job_ids=job_ids: backend.info_many(job_ids)
+            )
+            results[f"backend/info_all[jobs={count}]"] = await measure_async(
+                backend.info_all
+            )
+            infos = await backend.info_many(page)
+            results[f"api/json_response[tasks={len(page)},jobs={count}]"] = measure(
+                lambda infos=infos: JSONResponse(content=infos)
+            )
+            results[
+                f"api/get_results[limit={len(page)},jobs={count}]"
+            ] = await measure_async(
+                lambda limit=len(page): client.get(
+                    "/api/results", params={"limit": limit}
+                )
+            )
+
+    await backend.redis_arq.flushdb()
+
+
+async def run_redis_benchmarks(
+    results: Results, skip: List[str], job_counts: List[int]
+) -> None:
+    """Run the benchmarks that need Redis."""
+    await backend.init()
+    try:
+        if "progress" not in skip:
+            await bench_relay(results)
+        if "backend" not in skip:
+            await bench_backend(results, job_counts)
+    finally:
+        await backend.redis_arq.flushdb()
+        await backend.close()
+
+
+def metadata() -> Dict[str, Any]:
+    """Return what a run is to be compared by."""
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=REPO,
+        capture_output=True,
+        text=True,
+        check=False,
+    ).stdout.strip()
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(results: Results, baseline: Results) -> Dict[str, Optional[float]]:
+    """Return the ratio of the best times to those of a baseline run."""
+    return {
+        name: (
+            result["best_s"] / baseline[name]["best_s"]
+            if name in baseline and baseline[name]["best_s"]
+            else None
+        )
+        for (name, result) in results.items()
+    }
+
+
+def main(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the benchmarks not skipped."""
+    results: Results = {}
+    if "compute" not in args.skip:
+        bench_compute(results)
+    if "progress" not in args.skip:
+        bench_progress(results)
+    if not {"progress", "backend"} <= set(args.skip):
+        asyncio.run(run_redis_benchmarks(results, args.skip, args.jobs))
+
+    run: Dict[str, Any] = {"meta": metadata(), "results": results}
+    if args.compare is not None:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        run["ratios"] = compare(results, baseline["results"])
+    return run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--skip",
+        nargs="*",
+        default=[],
+        choices=["compute", "progress", "backend"],
+        help="groups of benchmarks not to run",
+    )
+    parser.add_argument(
+        "--jobs",
+        nargs="*",
+        type=int,
+        default=[1_000, 10_000, 100_000],
+        help="numbers of stored jobs to look up",
+    )
+    parser.add_argument("--output", type=Path, help="also write the results here")
+    parser.add_argument("--compare", type=Path, help="results of an earlier run")
+    arguments = parser.parse_args()
+    output = json.dumps(main(arguments), indent=2)
+    print(output)
+    if arguments.output is not None:
+        arguments.output.write_text(output + "\n", encoding="utf-8")
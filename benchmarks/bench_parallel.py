@@ -0,0 +1,91 @@
+"""Benchmark of the parallel engine against single-process fast doubling.
+
+Times F(n) by fast doubling in one process and by the parallel engine over
+a process pool, for growing n, and reports the speedup. The speedup is
+bounded by the number of pool processes, and only shows once the
+multiplications are large enough to outweigh moving their numbers through
+shared memory:
+
+    python benchmarks/bench_parallel.py --numbers 1000000 10000000 100000000
+    python benchmarks/bench_parallel.py --processes 4 --output parallel.json
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import statistics
+from concurrent import futures
+from multiprocessing import resource_tracker
+from pathlib import Path
+from typing import Any, Dict, List
+
+from wqw_app import parallel
+from wqw_app.pairs import fib_pair
+from wqw_app.settings import ParallelSettings
+
+Results = Dict[str, Dict[str, float]]
+
+
+def bench(numbers: List[int], processes: int, min_bits: int, repeat: int) -> Results:
+    """Time both engines for every number."""
+    results: Results = {}
+    resource_tracker.ensure_running()
+    with futures.ProcessPoolExecutor(processes) as pool:
+        multiplier = parallel.Multiplier(
+            pool, processes, ParallelSettings(min_bits=min_bits)
+        )
+        # Start the pool processes before timing.
+        parallel.fib_pair(1 << 20, multiplier)
+        for number in numbers:
+            single, spread = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                expected = fib_pair(number)
+                single.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                result = parallel.fib_pair(number, multiplier)
+                spread.append(time.perf_counter() - start)
+                assert result == expected
+            results[str(number)] = {
+                "single_s": statistics.median(single),
+                "parallel_s": statistics.median(spread),
+                "speedup": statistics.median(single) / statistics.median(spread),
+            }
+            print(number, results[str(number)], flush=True)
+    return results
+
+
+def main(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the benchmark."""
+    results = bench(args.numbers, args.processes, args.min_bits, args.repeat)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "processes": args.processes,
+            "min_bits": args.min_bits,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--numbers",
+        nargs="*",
+        type=int,
+        default=[100_000, 1_000_000, 10_000_000, 30_000_000],
+        help="numbers to compute",
+    )
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--min-bits", type=int, default=ParallelSettings().min_bits)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="also write the results here")
+    arguments = parser.parse_args()
+    output = json.dumps(main(arguments), indent=2)
+    print(output)
+    if arguments.output is not None:
+        arguments.output.write_text(output + "\n", encoding="utf-8")
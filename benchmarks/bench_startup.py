@@ -0,0 +1,172 @@
+"""Benchmark of the cold start of the web app and the worker.
+
+Reports the seconds to import the app and the worker modules in a fresh
+interpreter, the time from starting the web app to its first answered
+request and its first and later OpenAPI specs, and the time from starting a
+worker, with a job already queued, to the result of that job. The next job
+is timed too, from its enqueueing, and mostly waits for the polls of the
+dispatcher and the worker.
+
+Needs a running Redis, of which it flushes and uses database 15 by default,
+and is run from the repository root:
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+from pathlib import Path
+from typing import Any, Dict, List
+
+# The backend singleton reads the Redis settings on import.
+os.environ.setdefault("REDIS_DATABASE", "15")
+
+# pylint: disable=wrong-import-position
+import httpx
+
+from wqw_app.backend import backend
+from wqw_app.worker import async_fib, Engine
+
+REPO = Path(__file__).resolve().parents[1]
+
+# A worker already running keeps the port of its metrics exporter.
+ENV = {**os.environ, "METRICS_WORKER_PORT": "0"}
+
+
+def import_seconds(workdir: str, module: str) -> float:
+    """Return the seconds a fresh interpreter takes to import `module`."""
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    return float(
+        subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=workdir,
+            env=ENV,
+        ).stdout
+    )
+
+
+async def first_request(workdir: str, port: int) -> Dict[str, float]:
+    """Start the web app and time its first requests."""
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+            "wqw_app.app:app",
+        ],
+        cwd=workdir,
+        env=ENV,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            while True:
+                try:
+                    response = await client.get("/api/results", params={"limit": 1})
+                    response.raise_for_status()
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.01)
+            ready = time.perf_counter() - start
+            timings = []
+            for _ in range(2):
+                request_start = time.perf_counter()
+                (await client.get("/openapi.json")).raise_for_status()
+                timings.append(time.perf_counter() - request_start)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "first_request_s": ready,
+        "first_openapi_s": timings[0],
+        "next_openapi_s": timings[1],
+    }
+
+
+async def first_job(workdir: str, number: int) -> Dict[str, float]:
+    """Queue a job, start a worker and time the job and the one after it."""
+    await backend.redis_arq.flushdb()
+    job = await backend.enqueue_job(async_fib, number, engine=Engine.iterative.value)
+    assert job is not None
+    start = time.perf_counter()
+    worker = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from arq.cli import cli; cli()",
+            "wqw_app.worker.WorkerSettings",
+        ],
+        cwd=workdir,
+        env=ENV,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        await job.result(timeout=60, poll_delay=0.005)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        job = await backend.enqueue_job(
+            async_fib, number + 1, engine=Engine.iterative.value
+        )
+        assert job is not None
+        await job.result(timeout=60, poll_delay=0.005)
+        warm = time.perf_counter() - start
+    finally:
+        worker.terminate()
+        worker.wait()
+        await backend.redis_arq.flushdb()
+
+    return {"first_job_s": cold, "next_job_s": warm}
+
+
+def summary(runs: List[Dict[str, float]]) -> Dict[str, float]:
+    """Return the median of every timing over the runs."""
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run every benchmark `repeat` times."""
+    results: Dict[str, Any] = {}
+    await backend.init()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            (Path(workdir) / "static").mkdir()
+            (Path(workdir) / "templates").symlink_to(REPO / "templates")
+            for module in ("wqw_app.app", "wqw_app.worker"):
+                results[f"import_{module}_s"] = statistics.median(
+                    import_seconds(workdir, module) for _ in range(args.repeat)
+                )
+            results["web"] = summary(
+                [await first_request(workdir, args.port) for _ in range(args.repeat)]
+            )
+            results["worker"] = summary(
+                [await first_job(workdir, args.number) for _ in range(args.repeat)]
+            )
+    finally:
+        await backend.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--number", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8766)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
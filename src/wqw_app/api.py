@@ -1,15 +1,116 @@
 """Module for Fibonacci computations."""
-from typing import List, Optional
+import time
+import zlib
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from uuid import uuid4
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from pydantic import BaseModel
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from arq.jobs import Job, JobStatus
+from fastapi import APIRouter, Path, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from wqw_app.backend import backend, JobResultDict
-from wqw_app.worker import async_fib
+from wqw_app import bigint, metrics, modular
+from wqw_app.backend import backend, AdmissionRejected, JobResultDict
+from wqw_app.pairs import fib_pair
+from wqw_app.profiling import FunctionStats
+from wqw_app.settings import (
+    ApiSettings,
+    get_admission_settings,
+    get_api_settings,
+    get_stream_settings,
+)
+from wqw_app.stream import broker, FINAL_STATUSES
+from wqw_app.utils import client_id, removeprefix
+from wqw_app.worker import (
+    async_fib,
+    async_fib_mod,
+    async_fib_range,
+    estimate_compute_cost,
+    estimate_cost,
+    estimate_range_cost,
+    Engine,
+)
 
 router = APIRouter()
 
+# Upper bound on the number of tasks in one results response.
+MAX_RESULTS = 1000
+
+# Size of the compressed pieces of a range chunk decompressed at a time.
+RANGE_READ_SIZE = 64 * 1024
+
+# Encodes like JSONResponse, without building an encoder per response.
+_encode_json = json.JSONEncoder(
+    ensure_ascii=False, allow_nan=False, separators=(",", ":")
+).encode
+
+
+def _etag(body: bytes) -> str:
+    """Return the entity tag of a response body."""
+    return f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+
+def _json_or_not_modified(
+    request: Request, body: bytes, etag: str, headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """Return a JSON response, or 304 without a body if the client has it."""
+    headers = {"ETag": etag, **(headers or {})}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and (
+        if_none_match.strip() == "*"
+        or etag in (removeprefix(tag.strip(), "W/") for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+class _FinishedResponses:
+    """Encoded responses of complete tasks, with their entity tags.
+
+    A complete task does not change until its result is deleted, so its
+    response is encoded once and kept for `finished_cache_ttl` seconds, or
+    until it is found deleted.
+    """
+
+    def __init__(self, settings: Optional[ApiSettings] = None):
+        self._settings = get_api_settings() if settings is None else settings
+        self._responses: "OrderedDict[str, Tuple[float, bytes, str]]" = OrderedDict()
+
+    def get(self, task_id: str) -> Optional[Tuple[bytes, str]]:
+        """Return the body and entity tag of a complete task, if kept."""
+        if (entry := self._responses.get(task_id)) is None:
+            return None
+        (expires, body, etag) = entry
+        if expires < time.monotonic():
+            del self._responses[task_id]
+            return None
+        self._responses.move_to_end(task_id)
+        return body, etag
+
+    def discard(self, task_id: str) -> None:
+        """Forget the response of a task."""
+        self._responses.pop(task_id, None)
+
+    def put(self, task_id: str, body: bytes, etag: str) -> None:
+        """Keep the response of a complete task, evicting the oldest."""
+        if self._settings.finished_cache_size <= 0:
+            return
+        self._responses[task_id] = (
+            time.monotonic() + self._settings.finished_cache_ttl,
+            body,
+            etag,
+        )
+        self._responses.move_to_end(task_id)
+        while len(self._responses) > self._settings.finished_cache_size:
+            self._responses.popitem(last=False)
+
+
+finished_responses = _FinishedResponses()
+
 
 class RequestAccepted(BaseModel):
     """Request was accepted."""
@@ -24,17 +125,244 @@ class RequestNotAccepted(BaseModel):
     error: str
 
 
+class BatchRequest(BaseModel):
+    """Numbers to compute, with optional task ids."""
+
+    numbers: List[int]
+    task_ids: Optional[List[Optional[str]]] = None
+    engine: Engine = Engine.fast_doubling
+
+
+class BatchItem(BaseModel):
+    """Outcome of one number of a batch."""
+
+    number: int
+    task_id: Optional[str] = None
+    submitted_at: Optional[str] = None
+    error: Optional[str] = None
+    retry_after: Optional[int] = None
+
+
+class BatchAccepted(BaseModel):
+    """Batch was accepted, possibly with errors for some numbers."""
+
+    tasks: List[BatchItem]
+
+
+class CacheStats(BaseModel):
+    """Result cache counters."""
+
+    hits: int
+    misses: int
+    entries: int
+
+
+class AbortStats(BaseModel):
+    """Cancel-to-free latency of aborted computations."""
+
+    count: int
+    mean_s: float
+    max_s: float
+
+
+def _too_many_requests(error: AdmissionRejected) -> JSONResponse:
+    """Return the response to a task over an admission limit."""
+    if error.retry_after is None:
+        return JSONResponse(content={"error": str(error)}, status_code=400)
+    return JSONResponse(
+        content={"error": str(error)},
+        status_code=429,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+class QueueStats(BaseModel):
+    """Jobs in a size class queue and how long started ones waited."""
+
+    queued: int
+    wait_count: int
+    wait_mean_s: float
+    wait_max_s: float
+
+
+class ProfileStats(BaseModel):
+    """Where the time and memory of a profiled task went."""
+
+    wall_s: float
+    cpu_s: float
+    peak_bytes: int
+    net_bytes: int
+    functions: List[FunctionStats]
+    wait_s: float
+    transfer_s: float
+    store_s: float
+
+
+class RetentionStats(BaseModel):
+    """What the compactor deleted and reclaimed, and what it kept."""
+
+    runs: int
+    deleted: int
+    expired: int
+    reclaimed_bytes: int
+    kept: int
+    kept_bytes: int
+
+
 class CancelRequestAccepted(BaseModel):
     """Cancel request was accepted."""
 
     cancelled: bool
 
 
+@router.post(
+    "/compute/batch",
+    summary="Compute several Fibonacci numbers.",
+    responses={
+        202: {"description": "Batch was accepted.", "model": BatchAccepted},
+        400: {"description": "Batch was not accepted.", "model": RequestNotAccepted},
+    },
+    tags=["Computations"],
+)
+async def post_batch(request: Request, batch: BatchRequest) -> JSONResponse:
+    """Post a batch of computation tasks.
+
+    All tasks are enqueued together in a few pipelined round trips. Numbers
+    that cannot be enqueued are reported with an error, in the order given,
+    including those over an admission limit.
+    """
+    max_batch_size = get_api_settings().max_batch_size
+    if len(batch.numbers) > max_batch_size:
+        return JSONResponse(
+            content={"error": f"At most {max_batch_size} numbers per batch."},
+            status_code=400,
+        )
+    task_ids = batch.task_ids or [None] * len(batch.numbers)
+    if len(task_ids) != len(batch.numbers):
+        return JSONResponse(
+            content={"error": "Expected one task id per number."}, status_code=400
+        )
+
+    items: List[Dict[str, Any]] = []
+    valid, seen = [], set()
+    for (number, task_id) in zip(batch.numbers, task_ids):
+        item: Dict[str, Any] = {"number": number, "task_id": task_id}
+        if number < 1:
+            item["error"] = "Number must be positive."
+        elif task_id is not None and task_id in seen:
+            item["error"] = "Duplicate task id."
+        else:
+            valid.append(len(items))
+            seen.add(task_id)
+        items.append(item)
+
+    jobs = await backend.enqueue_jobs(
+        async_fib,
+        [((batch.numbers[i],), {"engine": batch.engine.value}) for i in valid],
+        [task_ids[i] for i in valid],
+        [estimate_cost(batch.numbers[i], batch.engine) for i in valid],
+        client_id(request, get_admission_settings().client_header),
+    )
+    infos = {
+        info["job_id"]: info
+        for info in await backend.info_many(
+            [job.job_id for job in jobs if isinstance(job, Job)]
+        )
+    }
+    for (i, job) in zip(valid, jobs):
+        if job is None:
+            items[i]["error"] = "Task id already exists."
+        elif isinstance(job, AdmissionRejected):
+            items[i]["error"] = str(job)
+            items[i]["retry_after"] = job.retry_after
+        elif (info := infos[job.job_id])["status"] == JobStatus.not_found:
+            items[i]["error"] = "Failed to enqueue task."
+        else:
+            items[i]["task_id"] = job.job_id
+            items[i]["submitted_at"] = info["enqueue_time"]
+
+    return JSONResponse(
+        content={
+            "tasks": [
+                {key: val for (key, val) in item.items() if val is not None}
+                for item in items
+            ]
+        },
+        status_code=202,
+    )
+
+
+@router.post(
+    "/compute/range",
+    summary="Compute a range of Fibonacci numbers.",
+    responses={
+        202: {"description": "Request was accepted.", "model": RequestAccepted},
+        400: {
+            "description": "Invalid range, or too costly to compute.",
+            "model": RequestNotAccepted,
+        },
+        429: {"description": "Queue is full.", "model": RequestNotAccepted},
+        500: {
+            "description": "Request was not accepted.",
+            "model": RequestNotAccepted,
+        },
+    },
+    tags=["Computations"],
+)
+async def post_range_task(
+    request: Request, start: int, stop: int, task_id: Optional[str] = None
+) -> JSONResponse:
+    """Post a task computing F(start), ..., F(stop).
+
+    The values are downloaded from `/results/{task_id}/values`.
+    """
+    settings = get_api_settings()
+    if not 0 < start <= stop:
+        return JSONResponse(
+            content={"error": "Expected 0 < start <= stop."}, status_code=400
+        )
+    if stop - start + 1 > settings.max_range_size:
+        return JSONResponse(
+            content={"error": f"At most {settings.max_range_size} numbers per range."},
+            status_code=400,
+        )
+
+    try:
+        job = await backend.enqueue_job(
+            async_fib_range,
+            start,
+            stop,
+            chunk_size=settings.range_chunk_size,
+            _job_id=task_id,
+            _cost=estimate_range_cost(start, stop),
+            _client=client_id(request, get_admission_settings().client_header),
+        )
+    except AdmissionRejected as error:
+        return _too_many_requests(error)
+
+    if job and (job_info := await job.info()):
+        return JSONResponse(
+            content={
+                "task_id": job.job_id,
+                "submitted_at": job_info.enqueue_time.isoformat(),
+            },
+            status_code=202,
+        )
+
+    return JSONResponse(content={"error": "Failed to enqueue task."}, status_code=500)
+
+
 @router.post(
     "/compute/{number}",
     summary="Compute a Fibonacci number.",
     responses={
+        200: {"description": "Task was computed right away.", "model": JobResultDict},
         202: {"description": "Request was accepted.", "model": RequestAccepted},
+        400: {
+            "description": "Number too long, or too costly to compute.",
+            "model": RequestNotAccepted,
+        },
+        429: {"description": "Queue is full.", "model": RequestNotAccepted},
         500: {
             "description": "Request was not accepted.",
             "model": RequestNotAccepted,
@@ -42,16 +370,78 @@ class CancelRequestAccepted(BaseModel):
     },
     tags=["Computations"],
 )
-async def post_task(number: int, task_id: Optional[str] = None) -> JSONResponse:
-    """Post a computation task."""
+async def post_task(
+    request: Request,
+    number: str = Path(..., regex="^[0-9]+$"),
+    task_id: Optional[str] = None,
+    engine: Engine = Engine.fast_doubling,
+    profile: bool = False,
+    mod: Optional[int] = Query(None, ge=1, le=modular.PISANO_MAX_MODULUS),
+) -> Response:
+    """Post a computation task.
+
+    The task is refused with 429 and a Retry-After header if the queue, or
+    the tasks queued by the client, would exceed the admission limits, and
+    with 400 if its estimated cost alone exceeds a cost limit. A task to
+    `profile` is always computed, under the profilers, and its result links
+    to the profile summary.
+
+    Tasks that cost less to compute than to queue, by their estimated cost,
+    are computed right away and answered with 200 and the complete task, as
+    `/results/{task_id}` would. So are tasks with `mod`, since F(number) mod
+    `mod` takes milliseconds for numbers of any size, with `mod` at most
+    10^10, whose Pisano period is found to reduce the number by.
+    """
+    max_digits = get_api_settings().max_number_digits
+    if len(number) > max_digits:
+        return JSONResponse(
+            content={"error": f"At most {max_digits} digits per number."},
+            status_code=400,
+        )
+    if mod is not None:
+        return await _post_inline_task(
+            async_fib_mod.__name__,
+            (number,),
+            {"modulus": mod},
+            modular.fib_mod(number, mod),
+            task_id,
+        )
 
-    if (job := await backend.enqueue_job(async_fib, number, _job_id=task_id)) and (
-        job_info := await job.info()
+    value = modular.reduce_decimal(number)
+    inline_max_cost = get_api_settings().inline_max_cost
+    if (
+        not profile
+        and value > 0
+        and estimate_compute_cost(value, engine) <= inline_max_cost
     ):
+        # Every engine gives the same number. Large results are stored apart,
+        # by the worker.
+        if not bigint.is_large(result := fib_pair(value)[0]):
+            return await _post_inline_task(
+                async_fib.__name__, (value,), {"engine": engine.value}, result, task_id
+            )
+
+    metrics.COMPUTE_REQUESTS.labels("queued").inc()
+    # Unprofiled tasks keep the call, and the cache entry, they always had.
+    options = {"profile": True} if profile else {}
+    try:
+        job = await backend.enqueue_job(
+            async_fib,
+            value,
+            engine=engine.value,
+            **options,
+            _job_id=task_id,
+            _cost=estimate_cost(value, engine),
+            _client=client_id(request, get_admission_settings().client_header),
+        )
+    except AdmissionRejected as error:
+        return _too_many_requests(error)
+
+    if job and (job_info := await job.info()):
         return JSONResponse(
             content={
                 "task_id": job.job_id,
-                "submitted_at": job_info.enqueue_time.strftime("%c"),
+                "submitted_at": job_info.enqueue_time.isoformat(),
             },
             status_code=202,
         )
@@ -59,20 +449,92 @@ async def post_task(number: int, task_id: Optional[str] = None) -> JSONResponse:
     return JSONResponse(content={"error": "Failed to enqueue task."}, status_code=500)
 
 
+async def _post_inline_task(
+    function: str,
+    args: Tuple[Any, ...],
+    kwargs: Dict[str, Any],
+    result: Any,
+    task_id: Optional[str],
+) -> Response:
+    """Record a task computed right away as complete, and answer with it."""
+    metrics.COMPUTE_REQUESTS.labels("inline").inc()
+    if (
+        info := await backend.record_job(
+            task_id or uuid4().hex, function, args, kwargs, result
+        )
+    ) is None:
+        return JSONResponse(
+            content={"error": "Failed to record task."}, status_code=500
+        )
+
+    body = _encode_json(info).encode()
+    etag = _etag(body)
+    finished_responses.put(info["job_id"], body, etag)
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+@router.get(
+    "/cache",
+    summary="Result cache statistics.",
+    responses={200: {"description": "Cache counters.", "model": CacheStats}},
+    tags=["Results"],
+)
+async def read_cache_stats() -> JSONResponse:
+    """Get result cache hit/miss counters."""
+    return JSONResponse(content=await backend.cache_stats(), status_code=200)
+
+
 @router.get(
     "/results",
-    summary="Results from all Fibonacci computation.",
+    summary="Results from Fibonacci computations.",
     responses={
         200: {
-            "description": "All Fibonacci computation tasks.",
+            "description": "A page of Fibonacci computation tasks.",
             "model": List[JobResultDict],
-        }
+        },
+        400: {
+            "description": "Invalid cursor or too many ids.",
+            "model": RequestNotAccepted,
+        },
     },
     tags=["Results"],
 )
-async def read_task_list() -> JSONResponse:
-    """Get list of calculation tasks."""
-    return JSONResponse(content=await backend.info_all(), status_code=200)
+async def read_task_list(
+    request: Request,
+    status: Optional[JobStatus] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_RESULTS),
+    ids: Optional[List[str]] = Query(None),
+) -> Response:
+    """Get a page of calculation tasks, newest first.
+
+    The next page, if any, is linked in the `Link` header. Given `ids`,
+    return exactly those tasks instead, in the order asked for. Pollers
+    sending the `ETag` back in `If-None-Match` get 304 until a task changes.
+    """
+    if ids is not None:
+        if len(ids) > MAX_RESULTS:
+            return JSONResponse(
+                content={"error": f"At most {MAX_RESULTS} ids per request."},
+                status_code=400,
+            )
+        body = _encode_json(await backend.info_many(ids)).encode()
+        return _json_or_not_modified(request, body, _etag(body))
+
+    try:
+        results, next_cursor = await backend.info_page(
+            status=status, cursor=cursor, limit=limit
+        )
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid cursor."}, status_code=400)
+
+    headers = {}
+    if next_cursor is not None:
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    body = _encode_json(results).encode()
+    return _json_or_not_modified(request, body, _etag(body), headers)
 
 
 @router.get(
@@ -83,9 +545,196 @@ async def read_task_list() -> JSONResponse:
     },
     tags=["Results"],
 )
-async def read_task(task_id: str) -> JSONResponse:
-    """Get status for a calculation task."""
-    return JSONResponse(content=await backend.info(job_id=task_id), status_code=200)
+async def read_task(request: Request, task_id: str) -> Response:
+    """Get status for a calculation task.
+
+    Pollers sending the `ETag` back in `If-None-Match` get 304 until the
+    status or progress of the task changes.
+    """
+    if (finished := finished_responses.get(task_id)) is not None:
+        # The compactor may have deleted the task since.
+        if await backend.result_exists(task_id):
+            return _json_or_not_modified(request, *finished)
+        finished_responses.discard(task_id)
+
+    info = await backend.info(job_id=task_id)
+    if info.get("kwargs", {}).get("profile"):
+        info["profile_url"] = request.app.url_path_for(
+            "read_task_profile", task_id=task_id
+        )
+    body = _encode_json(info).encode()
+    etag = _etag(body)
+    if info["status"] == JobStatus.complete:
+        finished_responses.put(task_id, body, etag)
+    return _json_or_not_modified(request, body, etag)
+
+
+@router.get(
+    "/results/{task_id}/profile",
+    summary="Profile of a profiled Fibonacci computation.",
+    responses={
+        200: {"description": "Profile summary.", "model": ProfileStats},
+        404: {"description": "No profile (yet).", "model": RequestNotAccepted},
+    },
+    tags=["Results"],
+)
+async def read_task_profile(task_id: str) -> JSONResponse:
+    """Get where the time and memory of a profiled task went.
+
+    The profile is there once the task is complete.
+    """
+    if (summary := await backend.profile(task_id)) is None:
+        return JSONResponse(content={"error": "No such profile."}, status_code=404)
+    return JSONResponse(content=summary, status_code=200)
+
+
+async def _range_values(task_id: str, chunks: int) -> AsyncIterator[bytes]:
+    """NDJSON lines of a range computation, chunk by chunk as they are done.
+
+    Stops early if the task finishes without storing all chunks.
+    """
+    updates = broker.subscribe([task_id])
+    try:
+        for index in range(chunks):
+            while (blob := await backend.range_chunk(task_id, index)) is None:
+                if (await backend.info(task_id))["status"] in FINAL_STATUSES:
+                    return
+                try:
+                    await asyncio.wait_for(
+                        updates.get(), get_stream_settings().keepalive
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            decompressor = zlib.decompressobj()
+            for offset in range(0, len(blob), RANGE_READ_SIZE):
+                yield decompressor.decompress(blob[offset : offset + RANGE_READ_SIZE])
+            yield decompressor.flush()
+    finally:
+        broker.unsubscribe(updates, [task_id])
+
+
+@router.get(
+    "/results/{task_id}/values",
+    summary="Download the values of a range computation.",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": 'One `{"n": ..., "value": ...}` object per line.',
+            "content": {"application/x-ndjson": {}},
+        },
+        404: {"description": "No such range task.", "model": RequestNotAccepted},
+    },
+    tags=["Results"],
+)
+async def read_range_values(task_id: str) -> Response:
+    """Stream the values of a range computation as NDJSON.
+
+    Values are sent as soon as their chunk is computed, in order.
+    """
+    info = await backend.info(task_id)
+    if info.get("function") != async_fib_range.__name__:
+        return JSONResponse(content={"error": "No such range task."}, status_code=404)
+    (start, stop) = info["args"]
+    chunk_size = info["kwargs"]["chunk_size"]
+    chunks = -(-(stop - start + 1) // chunk_size)
+    return StreamingResponse(
+        _range_values(task_id, chunks), media_type="application/x-ndjson"
+    )
+
+
+@router.get(
+    "/results/{task_id}/digits",
+    summary="Download the digits of a Fibonacci number.",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "The digits in base 10 or 16, without prefix.",
+            "content": {"text/plain": {}},
+        },
+        400: {"description": "Unsupported base.", "model": RequestNotAccepted},
+        404: {"description": "No such result.", "model": RequestNotAccepted},
+    },
+    tags=["Results"],
+)
+async def read_task_digits(task_id: str, base: int = 10) -> Response:
+    """Stream all digits of a computed Fibonacci number.
+
+    Large results are only summarized in `/results`; their digits are
+    converted and sent in chunks, without building the whole string.
+    """
+    if base not in (10, 16):
+        return JSONResponse(
+            content={"error": "Base must be 10 or 16."}, status_code=400
+        )
+    info = await backend.info(task_id)
+    if info.get("function") != async_fib.__name__ or not info.get("success"):
+        return JSONResponse(content={"error": "No such result."}, status_code=404)
+
+    result = info["result"]
+    if not bigint.is_packed(result):
+        digits = bigint.iter_decimal(result) if base == 10 else iter([f"{result:x}"])
+        return StreamingResponse(digits, media_type="text/plain")
+
+    if (blob := await backend.bigint_blob(result["ref"])) is None:
+        return JSONResponse(content={"error": "No such result."}, status_code=404)
+    if base == 16:
+        return StreamingResponse(bigint.iter_hex(result, blob), media_type="text/plain")
+    # Iterated in a thread, so the conversion does not stall other requests.
+    return StreamingResponse(
+        bigint.iter_decimal(bigint.unpack(result, blob)), media_type="text/plain"
+    )
+
+
+async def _events(task_ids: List[str]) -> AsyncIterator[str]:
+    """Server-sent events for the progress of tasks.
+
+    The event type is the task status, the data the JSON encoded task info.
+    """
+    async for info in broker.watch(task_ids):
+        if info is None:
+            yield ": keepalive\n\n"
+        else:
+            yield f"event: {info['status']}\ndata: {json.dumps(info)}\n\n"
+
+
+@router.get(
+    "/stream",
+    summary="Stream progress of several Fibonacci computations.",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Server-sent events until all tasks are finished.",
+            "content": {"text/event-stream": {}},
+        },
+        400: {"description": "Too many ids.", "model": RequestNotAccepted},
+    },
+    tags=["Results"],
+)
+async def stream_tasks(ids: List[str] = Query(...)) -> Response:
+    """Stream status and progress changes of tasks over one connection."""
+    if len(ids) > MAX_RESULTS:
+        return JSONResponse(
+            content={"error": f"At most {MAX_RESULTS} ids per request."},
+            status_code=400,
+        )
+    return StreamingResponse(_events(ids), media_type="text/event-stream")
+
+
+@router.get(
+    "/stream/{task_id}",
+    summary="Stream progress of a Fibonacci computation.",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Server-sent events until the task is finished.",
+            "content": {"text/event-stream": {}},
+        }
+    },
+    tags=["Results"],
+)
+async def stream_task(task_id: str) -> StreamingResponse:
+    """Stream status and progress changes of a task."""
+    return StreamingResponse(_events([task_id]), media_type="text/event-stream")
 
 
 @router.post(
@@ -108,3 +757,44 @@ async def cancel_task(
         },
         status_code=202,
     )
+
+
+@router.get(
+    "/aborts",
+    summary="Aborted computation statistics.",
+    responses={200: {"description": "Abort counters.", "model": AbortStats}},
+    tags=["Computations"],
+)
+async def read_abort_stats() -> JSONResponse:
+    """Get the number of aborted computations and how long it took from the
+    abort until their pool processes were free."""
+    return JSONResponse(content=await backend.abort_stats(), status_code=200)
+
+
+@router.get(
+    "/queues",
+    summary="Size class queue statistics.",
+    responses={
+        200: {
+            "description": "Queue counters per size class.",
+            "model": Dict[str, QueueStats],
+        }
+    },
+    tags=["Computations"],
+)
+async def read_queue_stats() -> JSONResponse:
+    """Get the number of jobs in each size class queue and how long the
+    jobs of each size class waited before they started."""
+    return JSONResponse(content=await backend.queue_stats(), status_code=200)
+
+
+@router.get(
+    "/retention",
+    summary="Result retention statistics.",
+    responses={200: {"description": "Compactor counters.", "model": RetentionStats}},
+    tags=["Results"],
+)
+async def read_retention_stats() -> JSONResponse:
+    """Get the number of complete tasks the compactor deleted, the bytes it
+    reclaimed, and the tasks and bytes kept on its last run."""
+    return JSONResponse(content=await backend.retention_stats(), status_code=200)
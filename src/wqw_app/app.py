@@ -2,15 +2,19 @@
 
 Welcome to the world's greatest.
 """
+import json
+from functools import lru_cache
+
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.openapi.utils import get_openapi
 from fastapi.openapi.docs import get_swagger_ui_html
-from fastapi.templating import Jinja2Templates
 
-from wqw_app import api, __version__ as version, frontend
+from wqw_app import api, __version__ as version, frontend, metrics
 from wqw_app.backend import backend
+from wqw_app.settings import get_metrics_settings
+from wqw_app.stream import broker
 
 
 app = FastAPI(
@@ -20,20 +24,22 @@ app = FastAPI(
     redoc_url=None,
 )
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.add_middleware(metrics.MetricsMiddleware)
 
-templates = Jinja2Templates(directory="templates")
+app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
 @app.on_event("startup")
 async def startup():
     """Startup logic goes here."""
     await backend.init()
+    await broker.init()
 
 
 @app.on_event("shutdown")
 async def shutdown():
     """Shutdown logic goes here."""
+    await broker.close()
     await backend.close()
 
 
@@ -42,7 +48,16 @@ async def shutdown():
 )
 def fibonacci_calculator(request: Request) -> Response:
     """Landing page"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return frontend.get_templates().TemplateResponse("index.html", {"request": request})
+
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics() -> Response:
+    """Endpoint for metrics in the Prometheus text format."""
+    if not get_metrics_settings().enabled:
+        return Response(status_code=404)
+    await backend.collect_metrics()
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get(
@@ -57,12 +72,9 @@ def get_documentation():
     )
 
 
-@app.get(
-    "/openapi.json",
-    include_in_schema=False,
-)
-def openapi():
-    """Endpoint for OpenAPI specs."""
+@lru_cache
+def _openapi_body() -> bytes:
+    """Build and encode the OpenAPI specs, once."""
     openapi_schema = get_openapi(
         title=__doc__.splitlines()[0] if __doc__ else "",
         description="\n".join(__doc__.splitlines()[1:]) if __doc__ else "",
@@ -70,9 +82,6 @@ def openapi():
         routes=app.routes,
     )
 
-    openapi_schema["paths"]["/api/compute/{number}"]["post"]["responses"].pop(
-        "200", None
-    )
     openapi_schema["paths"]["/api/compute/{number}"]["post"]["responses"].pop(
         "422", None
     )
@@ -87,7 +96,16 @@ def openapi():
         "422", None
     )
 
-    return openapi_schema
+    return json.dumps(openapi_schema).encode()
+
+
+@app.get(
+    "/openapi.json",
+    include_in_schema=False,
+)
+def openapi() -> Response:
+    """Endpoint for OpenAPI specs."""
+    return Response(_openapi_body(), media_type="application/json")
 
 
 # Add fibonacci endpoints
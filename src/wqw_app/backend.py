@@ -1,18 +1,67 @@
 """arq backend module."""
+import os
+import json
+import math
+import time
 import asyncio
 import pickle
-from typing import Union, Callable, Optional, Any, Iterable, Tuple, Dict
+from uuid import uuid4
+from typing import (
+    TYPE_CHECKING,
+    Union,
+    Callable,
+    Optional,
+    Any,
+    Iterable,
+    Tuple,
+    Dict,
+    List,
+    Sequence,
+    Awaitable,
+)
 from datetime import datetime, timedelta
-from collections import ChainMap
-from dataclasses import asdict
 
 from typing_extensions import TypedDict
-from arq.jobs import Job, JobStatus
-from arq.connections import create_pool, ArqRedis, RedisSettings
+from arq.jobs import (
+    Job,
+    JobDef,
+    JobStatus,
+    serialize_job,
+    serialize_result,
+    deserialize_job,
+    deserialize_result,
+)
+from arq.connections import create_pool, expires_extra_ms, ArqRedis, RedisSettings
+from arq.utils import timestamp_ms, to_ms, to_unix_ms
 from arq import constants
 
-from wqw_app.settings import get_redis_settings
-from wqw_app.utils import removeprefix, track_progress_key_prefix
+from wqw_app.cache import ResultCache
+from wqw_app import metrics, scheduler
+from wqw_app.index import JobIndex
+from wqw_app.scheduler import QUEUE_NAMES, SizeClass
+from wqw_app.settings import (
+    AdmissionSettings,
+    get_admission_settings,
+    get_backend_settings,
+    get_redis_settings,
+)
+from wqw_app.utils import (
+    track_progress_key_prefix,
+    range_key_prefix,
+    bigint_key_prefix,
+    abort_stats_key,
+    admission_key,
+    admission_clients_key,
+    admission_totals_key,
+    admission_pruned_key,
+    queue_wait_key_prefix,
+    profile_key_prefix,
+    retention_sizes_key,
+    retention_stats_key,
+)
+
+if TYPE_CHECKING:
+    from wqw_app.local import LocalBackend  # pylint: disable=cyclic-import
 
 
 class _JobResultDictBase(TypedDict):
@@ -36,26 +85,211 @@ class JobResultDict(_JobResultDictBase, total=False):
     start_time: str
     finish_time: str
     queue_name: str
+    profile_url: str
+
+
+def _job_result_dict(
+    job_id: str,
+    result_raw: Optional[bytes],
+    job_raw: Optional[bytes],
+    in_progress: Optional[str],
+    progress_raw: Optional[bytes],
+    score: Optional[float],
+) -> JobResultDict:
+    """Build the result dict of a job from its raw redis values."""
+    job_info: Optional[JobDef] = None
+    job_status = JobStatus.not_found
+    if result_raw:
+        job_info = deserialize_result(result_raw)
+        job_status = JobStatus.complete
+    elif job_raw:
+        job_info = deserialize_job(job_raw)
+        if in_progress:
+            job_status = JobStatus.in_progress
+        elif score:
+            job_status = (
+                JobStatus.deferred if score > timestamp_ms() else JobStatus.queued
+            )
+
+    if job_info is None or job_status is JobStatus.not_found:
+        return JobResultDict(job_id=job_id, status=JobStatus.not_found)
+    job_info.score = score
+
+    progress = {}
+    if job_status is JobStatus.in_progress and progress_raw:
+        progress = pickle.loads(progress_raw)
+
+    return job_info_dict(job_id, job_info, job_status, progress)
+
+
+def job_info_dict(
+    job_id: str, job_info: JobDef, job_status: JobStatus, progress: Dict[str, Any]
+) -> JobResultDict:
+    """Build the result dict of a job from its definition or result."""
+    # A shallow copy, since the values are only read; `asdict` would deep
+    # copy every value, result and arguments included.
+    job_data = {**progress, **vars(job_info)}
+    job_data["job_id"] = job_id
+    job_data["status"] = job_status.value
+
+    job_result = {}
+    for (key, val) in job_data.items():
+        if isinstance(val, datetime):
+            job_result[key] = val.isoformat()
+        elif isinstance(val, asyncio.CancelledError):
+            job_result[key] = None
+        else:
+            job_result[key] = val
+
+    return JobResultDict(**job_result)
+
+
+# arq keeps results for an hour unless the worker says otherwise.
+KEEP_RESULT_S = 3600
+
+# Queue a job unless its job or result key exists, like arq's enqueue_job.
+# A job with a cost (ARGV[5] >= 0) is only queued if the depth of all queues
+# (KEYS[8:]), the estimated cost of all queued jobs and, for a client
+# (ARGV[6]), the number and cost of its queued jobs stay within the limits
+# (ARGV[7:11], negative for none). A job is always admitted if nothing is
+# queued yet. The cost of every queued job is kept in a sorted set, and the
+# totals in a hash, until its job key is gone. Returns {1} if queued, {0} if
+# the job exists, and {-1, limit, excess, mean cost, used} if over a limit.
+_ENQUEUE_SCRIPT = """
+if redis.call("EXISTS", KEYS[1], KEYS[2]) > 0 then
+    return {0}
+end
+local cost = tonumber(ARGV[5])
+local client = ARGV[6]
+if cost >= 0 then
+    -- Forget jobs that are finished or expired, at most once a second.
+    if redis.call("SET", KEYS[7], 1, "NX", "PX", 1000) then
+        local entries = redis.call("ZRANGE", KEYS[4], 0, -1, "WITHSCORES")
+        for i = 1, #entries, 2 do
+            if redis.call("EXISTS", ARGV[11] .. entries[i]) == 0 then
+                local owner = redis.call("HGET", KEYS[5], entries[i])
+                redis.call("ZREM", KEYS[4], entries[i])
+                redis.call("HINCRBYFLOAT", KEYS[6], "cost", -entries[i + 1])
+                if owner then
+                    redis.call("HDEL", KEYS[5], entries[i])
+                    if redis.call("HINCRBY", KEYS[6], "jobs:" .. owner, -1) > 0 then
+                        redis.call(
+                            "HINCRBYFLOAT", KEYS[6], "cost:" .. owner, -entries[i + 1]
+                        )
+                    else
+                        redis.call("HDEL", KEYS[6], "jobs:" .. owner, "cost:" .. owner)
+                    end
+                end
+            end
+        end
+        if redis.call("ZCARD", KEYS[4]) == 0 then
+            redis.call("DEL", KEYS[6])
+        end
+    end
+
+    local depth = 0
+    for i = 8, #KEYS do
+        depth = depth + redis.call("ZCARD", KEYS[i])
+    end
+    local queued = tonumber(redis.call("HGET", KEYS[6], "cost") or 0)
+    local mean = queued / math.max(1, redis.call("ZCARD", KEYS[4]))
+    local limits = {
+        {"queue_depth", depth, 1, ARGV[7], mean},
+        {"queued_cost", queued, cost, ARGV[8], mean},
+    }
+    if client ~= "" then
+        local jobs = tonumber(redis.call("HGET", KEYS[6], "jobs:" .. client) or 0)
+        local spent = tonumber(redis.call("HGET", KEYS[6], "cost:" .. client) or 0)
+        mean = spent / math.max(1, jobs)
+        table.insert(limits, {"client_jobs", jobs, 1, ARGV[9], mean})
+        table.insert(limits, {"client_cost", spent, cost, ARGV[10], mean})
+    end
+    for _, limit in ipairs(limits) do
+        local used, max = limit[2] + limit[3], tonumber(limit[4])
+        if max >= 0 and limit[2] > 0 and used > max then
+            return {
+                -1, limit[1], tostring(used - max), tostring(limit[5]),
+                tostring(limit[2]),
+            }
+        end
+    end
+end
+
+redis.call("PSETEX", KEYS[1], ARGV[3], ARGV[2])
+redis.call("ZADD", KEYS[3], ARGV[4], ARGV[1])
+if cost >= 0 then
+    redis.call("ZADD", KEYS[4], ARGV[5], ARGV[1])
+    redis.call("HINCRBYFLOAT", KEYS[6], "cost", ARGV[5])
+    if client ~= "" then
+        redis.call("HSET", KEYS[5], ARGV[1], client)
+        redis.call("HINCRBY", KEYS[6], "jobs:" .. client, 1)
+        redis.call("HINCRBYFLOAT", KEYS[6], "cost:" .. client, ARGV[5])
+    end
+end
+return {1}
+"""
+
+
+# Costs are recorded in the admission totals at most this many seconds, so
+# that the totals keep their precision when no cost limit is enforced.
+_MAX_RECORDED_COST = 1e9
+
+
+class AdmissionRejected(Exception):
+    """A job was not queued since the queue or its client is over a limit.
+
+    `retry_after` is None for a job over a limit on its own, which waiting
+    does not help.
+    """
+
+    def __init__(self, limit: str, retry_after: Optional[int]):
+        super().__init__(f"Over the {limit.replace('_', ' ')} limit.")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+def duration_stats(stats: Dict[str, Any]) -> Dict[str, float]:
+    """Return count, mean and maximum of durations counted in a hash."""
+    count = int(stats.get("count", 0))
+    return {
+        "count": count,
+        "mean_s": float(stats.get("total_s", 0)) / count if count else 0.0,
+        "max_s": float(stats.get("max_s", 0)),
+    }
 
 
 class Backend:
     """arq backend."""
 
-    def __init__(self, redis_settings: RedisSettings = None):
+    def __init__(
+        self,
+        redis_settings: RedisSettings = None,
+        admission_settings: Optional[AdmissionSettings] = None,
+    ):
         self._redis_settings: RedisSettings = (
             get_redis_settings() if redis_settings is None else redis_settings
         )
+        self._admission_settings = (
+            get_admission_settings()
+            if admission_settings is None
+            else admission_settings
+        )
         self._redis_arq: Optional[ArqRedis] = None
+        self._cache: Optional[ResultCache] = None
+        self._index: Optional[JobIndex] = None
 
     async def init(self):
         """Initialize connection pools to the backend."""
         self._redis_arq = await create_pool(self._redis_settings)
+        self._cache = ResultCache(self._redis_arq)
+        self._index = JobIndex(self._redis_arq)
 
     async def close(self):
         """Close the connection pools to the backend."""
         self.redis_arq.close()
         await self.redis_arq.wait_closed()
 
+    @metrics.timed(metrics.BACKEND_LATENCY)
     async def enqueue_job(
         self,
         function: Union[str, Callable],
@@ -66,25 +300,377 @@ class Backend:
         _defer_by: Union[None, int, float, timedelta] = None,
         _expires: Union[None, int, float, timedelta] = None,
         _job_try: Optional[int] = None,
+        _cost: Optional[float] = None,
+        _client: Optional[str] = None,
         **kwargs: Any,
     ) -> Optional[Job]:
-        """Enqueue a job"""
+        """Enqueue a job
+
+        A call that has been computed before is answered from the result cache
+        with an already completed job. A call that is currently computing is
+        attached to the job in flight, unless an explicit `_job_id` is given.
+
+        A job with an estimated `_cost` in seconds is subject to admission
+        control: AdmissionRejected is raised if the queue, or the queued jobs
+        of `_client`, would go over a limit.
+        """
         assert isinstance(function, (str, Callable))
         if isinstance(function, Callable):
             function = function.__name__
+        assert not (
+            _defer_until and _defer_by
+        ), "use either 'defer_until' or 'defer_by' or neither, not both"
+
+        job_id = _job_id or uuid4().hex
+        cache_key = self.cache.key(function, args, kwargs)
+        if self.cache.enabled and (
+            job := await self._cached_job(
+                cache_key, job_id, function, args, kwargs, attach=_job_id is None
+            )
+        ):
+            return job
+
+        enqueue_time_ms = timestamp_ms()
+        if _defer_until is not None:
+            score = to_unix_ms(_defer_until)
+        elif _defer_by:
+            score = enqueue_time_ms + to_ms(_defer_by)
+        else:
+            score = scheduler.score(enqueue_time_ms, _cost)
+        queue_name = _queue_name or scheduler.queue_for(_cost)
+        outcome = self._over_job_limit(_cost, _client) or self._admitted(
+            await self._queue_job(
+                self.redis_arq,
+                job_id,
+                function,
+                args,
+                kwargs,
+                queue_name=queue_name,
+                score=score,
+                enqueue_time_ms=enqueue_time_ms,
+                expires_ms=to_ms(_expires)
+                or score - enqueue_time_ms + expires_extra_ms,
+                job_try=_job_try,
+                cost=_cost,
+                client=_client,
+            ),
+            job_id,
+            queue_name,
+        )
+        if isinstance(outcome, Job):
+            await self.index.add(job_id, enqueue_time_ms, JobStatus.queued)
+            return outcome
+
+        if self.cache.enabled:
+            await self.cache.release(cache_key, job_id)
+        if outcome is not None:
+            raise outcome
+        return None
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def enqueue_jobs(
+        self,
+        function: Union[str, Callable],
+        calls: Sequence[Tuple[Tuple[Any, ...], Dict[str, Any]]],
+        job_ids: Optional[Sequence[Optional[str]]] = None,
+        costs: Optional[Sequence[float]] = None,
+        client: Optional[str] = None,
+    ) -> List[Union[Job, None, AdmissionRejected]]:
+        """Enqueue several (args, kwargs) calls of a function.
+
+        Each call is treated like `enqueue_job` would, but the cache lookups,
+        the in-flight claims and the enqueueing are each done for all calls
+        in a single pipeline. The job of a call is None if its job id exists,
+        and the AdmissionRejected error if it is over a limit.
+        """
+        assert isinstance(function, (str, Callable))
+        if isinstance(function, Callable):
+            function = function.__name__
+        if job_ids is None:
+            job_ids = [None] * len(calls)
+        if costs is None:
+            costs = [None] * len(calls)
+        assert len(job_ids) == len(calls) == len(costs)
+
+        ids = [job_id or uuid4().hex for job_id in job_ids]
+        jobs: List[Union[Job, None, AdmissionRejected]] = [None] * len(calls)
+        keys = [self.cache.key(function, args, kwargs) for (args, kwargs) in calls]
+        pending = list(range(len(calls)))
+
+        if self.cache.enabled:
+            found = await self.cache.get_many(keys)
+            hits = [i for i in pending if found[i][0]]
+            completed = await asyncio.gather(
+                *[
+                    self.complete_job(ids[i], function, *calls[i], found[i][1])
+                    for i in hits
+                ]
+            )
+            for (i, job) in zip(hits, completed):
+                jobs[i] = job
+
+            misses = [i for i in pending if not found[i][0]]
+            holders = await self.cache.claim_many(
+                [keys[i] for i in misses], [ids[i] for i in misses]
+            )
+            attached = {
+                i: holder
+                for (i, holder) in zip(misses, holders)
+                if holder is not None and job_ids[i] is None
+            }
+            # Jobs in flight from before this batch may be gone, e.g. lost
+            # with a worker, and are taken over as in `enqueue_job`.
+            batch_ids = set(ids)
+            earlier = list({holder for holder in attached.values()} - batch_ids)
+            alive = dict(zip(earlier, await self._job_exists(earlier)))
+            for (i, holder) in attached.items():
+                if alive.get(holder, True):
+                    jobs[i] = Job(job_id=holder, redis=self.redis_arq)
+                elif (
+                    holder := await self._cached_job(
+                        keys[i], ids[i], function, *calls[i], attach=True
+                    )
+                ) is not None:
+                    jobs[i] = holder
+                    attached[i] = holder.job_id
+                else:
+                    del attached[i]
+            pending = [i for i in misses if i not in attached]
+
+        rejected = []
+        for i in pending:
+            if (error := self._over_job_limit(costs[i], client)) is not None:
+                jobs[i] = error
+                rejected.append(i)
+        pending = [i for i in pending if i not in rejected]
+
+        enqueue_time_ms = timestamp_ms()
+        pipe = self.redis_arq.pipeline()
+        queued = [
+            self._queue_job(
+                pipe,
+                ids[i],
+                function,
+                *calls[i],
+                queue_name=scheduler.queue_for(costs[i]),
+                score=scheduler.score(enqueue_time_ms, costs[i]),
+                enqueue_time_ms=enqueue_time_ms,
+                expires_ms=expires_extra_ms,
+                job_try=None,
+                cost=costs[i],
+                client=client,
+            )
+            for i in pending
+        ]
+        await pipe.execute()
+
+        for (i, reply) in zip(pending, await asyncio.gather(*queued)):
+            jobs[i] = self._admitted(reply, ids[i], scheduler.queue_for(costs[i]))
+            if not isinstance(jobs[i], Job):
+                rejected.append(i)
+        await self.index.add_many(
+            [(ids[i], enqueue_time_ms) for i in pending if i not in rejected],
+            JobStatus.queued,
+        )
+        if self.cache.enabled:
+            await asyncio.gather(
+                *[self.cache.release(keys[i], ids[i]) for i in rejected]
+            )
+
+        return jobs
+
+    def _queue_job(
+        self,
+        redis: Any,
+        job_id: str,
+        function: str,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        *,
+        queue_name: str,
+        score: int,
+        enqueue_time_ms: int,
+        expires_ms: int,
+        job_try: Optional[int],
+        cost: Optional[float],
+        client: Optional[str],
+    ) -> Awaitable[List[Any]]:
+        """Run the enqueue script for a job on a connection or pipeline."""
+        settings = self._admission_settings
+        return redis.eval(
+            _ENQUEUE_SCRIPT,
+            keys=[
+                constants.job_key_prefix + job_id,
+                constants.result_key_prefix + job_id,
+                queue_name,
+                admission_key,
+                admission_clients_key,
+                admission_totals_key,
+                admission_pruned_key,
+                *QUEUE_NAMES,
+            ],
+            args=[
+                job_id,
+                serialize_job(function, args, kwargs, job_try, enqueue_time_ms),
+                expires_ms,
+                score,
+                repr(min(cost, _MAX_RECORDED_COST))
+                if settings.enabled and cost is not None
+                else -1,
+                client or "",
+                settings.max_queue_depth,
+                settings.max_queued_cost,
+                settings.client_max_jobs,
+                settings.client_max_cost,
+                constants.job_key_prefix,
+            ],
+        )
+
+    def _over_job_limit(
+        self, cost: Optional[float], client: Optional[str]
+    ) -> Optional[AdmissionRejected]:
+        """Return the rejection of a job whose estimated cost alone is over
+        the queued cost limit, or that of its client."""
+        settings = self._admission_settings
+        if not settings.enabled or cost is None:
+            return None
+        limits = [settings.max_queued_cost]
+        if client:
+            limits.append(settings.client_max_cost)
+        if any(0 <= limit < cost for limit in limits):
+            return AdmissionRejected("job_cost", None)
+        return None
 
-        return await self.redis_arq.enqueue_job(
+    def _admitted(
+        self,
+        reply: List[Any],
+        job_id: str,
+        queue_name: str = constants.default_queue_name,
+    ) -> Union[Job, None, AdmissionRejected]:
+        """Return the outcome of the enqueue script for a job.
+
+        The time to retry after a rejection is how long the workers take to
+        compute the excess cost, or the excess jobs at their mean cost, but
+        no longer than the queued work takes, nor `max_retry_after`.
+        """
+        if reply[0] == 1:
+            return Job(job_id=job_id, redis=self.redis_arq, _queue_name=queue_name)
+        if reply[0] == 0:
+            return None
+
+        (_, limit, excess, mean_cost, used) = reply
+        (excess_cost, queued_cost) = (float(excess), float(used))
+        if not limit.endswith("cost"):
+            excess_cost *= float(mean_cost)
+            queued_cost *= float(mean_cost)
+        workers = self._admission_settings.workers or os.cpu_count() or 1
+        seconds = math.ceil(min(excess_cost, queued_cost) / workers)
+        return AdmissionRejected(
+            limit, min(max(1, seconds), self._admission_settings.max_retry_after)
+        )
+
+    async def _job_exists(self, job_ids: Sequence[str]) -> List[bool]:
+        """Return whether each job is queued, running or has a result."""
+        pipe = self.redis_arq.pipeline()
+        exists = [
+            pipe.exists(
+                constants.job_key_prefix + job_id,
+                constants.result_key_prefix + job_id,
+            )
+            for job_id in job_ids
+        ]
+        await pipe.execute()
+        return [bool(await count) for count in exists]
+
+    async def _cached_job(
+        self,
+        cache_key: str,
+        job_id: str,
+        function: str,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        attach: bool,
+    ) -> Optional[Job]:
+        """Return a completed or in-flight job for a call, if there is one.
+
+        Otherwise `job_id` is marked as in flight for the call.
+        """
+        found, result = await self.cache.get(cache_key)
+        if found:
+            return await self.complete_job(job_id, function, args, kwargs, result)
+
+        if (in_flight_id := await self.cache.claim(cache_key, job_id)) is None:
+            return None
+
+        if not attach:
+            return None
+        in_flight_job = Job(job_id=in_flight_id, redis=self.redis_arq)
+        if await in_flight_job.info() is not None:
+            return in_flight_job
+
+        # The job in flight is gone, e.g. lost with a worker, so take over.
+        await self.cache.release(cache_key, in_flight_id)
+        if (in_flight_id := await self.cache.claim(cache_key, job_id)) is not None:
+            return Job(job_id=in_flight_id, redis=self.redis_arq)
+        return None
+
+    async def complete_job(
+        self,
+        job_id: str,
+        function: str,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        result: Any,
+    ) -> Optional[Job]:
+        """Record a job that is already complete, without queueing it."""
+        if await self.record_job(job_id, function, args, kwargs, result) is None:
+            return None
+
+        return Job(job_id=job_id, redis=self.redis_arq)
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def record_job(
+        self,
+        job_id: str,
+        function: str,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        result: Any,
+    ) -> Optional[JobResultDict]:
+        """Record a job that is already complete, without queueing it.
+
+        Return its info, as `info` would, or None if the job exists.
+        """
+        now_ms = timestamp_ms()
+        result_data = serialize_result(
             function,
-            *args,
-            _job_id=_job_id,
-            _queue_name=_queue_name,
-            _defer_until=_defer_until,
-            _defer_by=_defer_by,
-            _expires=_expires,
-            _job_try=_job_try,
-            **kwargs,
+            args,
+            kwargs,
+            1,
+            now_ms,
+            True,
+            result,
+            now_ms,
+            now_ms,
+            f"{job_id}:{function}",
+            constants.default_queue_name,
         )
+        if not await self.redis_arq.set(
+            constants.result_key_prefix + job_id,
+            result_data,
+            expire=KEEP_RESULT_S,
+            exist=self.redis_arq.SET_IF_NOT_EXIST,
+        ):
+            return None
+        await self.index.add(job_id, now_ms, JobStatus.complete)
+
+        return _job_result_dict(job_id, result_data, None, None, None, None)
+
+    async def cache_stats(self) -> Dict[str, int]:
+        """Return result cache counters."""
+        return await self.cache.stats()
 
+    @metrics.timed(metrics.BACKEND_LATENCY)
     async def abort(
         self, job_id: str, timeout: Optional[float] = None, poll_delay: float = 0.5
     ) -> bool:
@@ -93,60 +679,186 @@ class Backend:
 
         return await job.abort(timeout=timeout, poll_delay=poll_delay)
 
+    async def abort_stats(self) -> Dict[str, float]:
+        """Return the number of aborted computations and the time it took
+        their pool processes to stop."""
+        return duration_stats(await self.redis_arq.hgetall(abort_stats_key))
+
+    async def retention_stats(self) -> Dict[str, int]:
+        """Return what the compactor deleted and reclaimed so far, and the
+        complete jobs it kept on its last run."""
+        stats = await self.redis_arq.hgetall(retention_stats_key)
+        return {
+            key: int(stats.get(key, 0))
+            for key in (
+                "runs",
+                "deleted",
+                "expired",
+                "reclaimed_bytes",
+                "kept",
+                "kept_bytes",
+            )
+        }
+
+    async def queue_stats(self) -> Dict[str, Dict[str, float]]:
+        """Return the number of jobs waiting in each size class queue, and
+        the time the jobs started so far waited."""
+        pipe = self.redis_arq.pipeline()
+        queued = [pipe.zcard(scheduler.class_queue_name(cls)) for cls in SizeClass]
+        waits = [pipe.hgetall(queue_wait_key_prefix + cls.value) for cls in SizeClass]
+        await pipe.execute()
+
+        stats = {}
+        for (cls, count, wait) in zip(SizeClass, queued, waits):
+            stats[cls.value] = {
+                "queued": await count,
+                **{
+                    f"wait_{key}": val
+                    for (key, val) in duration_stats(await wait).items()
+                },
+            }
+        return stats
+
+    async def collect_metrics(self) -> None:
+        """Update the queue depth and Redis round trip metrics."""
+        start = time.perf_counter()
+        pipe = self.redis_arq.pipeline()
+        depths = [pipe.zcard(queue_name) for queue_name in QUEUE_NAMES]
+        await pipe.execute()
+        metrics.REDIS_ROUND_TRIP.set(time.perf_counter() - start)
+
+        for (queue_name, depth) in zip(QUEUE_NAMES, depths):
+            metrics.QUEUE_JOBS.labels(queue_name).set(await depth)
+
     async def info(self, job_id: str) -> JobResultDict:
         """Return info on `job_id`."""
-        job = Job(job_id=job_id, redis=self.redis_arq)
+        (job_result,) = await self.info_many([job_id])
+        return job_result
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def info_many(self, job_ids: Sequence[str]) -> List[JobResultDict]:
+        """Return info on several jobs.
 
-        if (job_info := await job.info()) and (job_status := await job.status()):
-            progress = {}
-            if (job_status is JobStatus.in_progress) and (
-                progress_data := await self.redis_arq.get(
-                    track_progress_key_prefix + job_id, encoding=None
-                )
-            ):
-                progress = pickle.loads(progress_data)
-
-            job_data = dict(
-                ChainMap(asdict(job_info), progress),
-                job_id=job_id,
-                status=job_status.value,
+        The result, job, in-progress and progress keys of all jobs are fetched
+        in a single pipeline, so the cost is one round trip regardless of the
+        number of jobs.
+        """
+        if not job_ids:
+            return []
+
+        pipe = self.redis_arq.pipeline()
+        results_raw = pipe.mget(
+            *[constants.result_key_prefix + job_id for job_id in job_ids],
+            encoding=None,
+        )
+        jobs_raw = pipe.mget(
+            *[constants.job_key_prefix + job_id for job_id in job_ids],
+            encoding=None,
+        )
+        in_progress = pipe.mget(
+            *[constants.in_progress_key_prefix + job_id for job_id in job_ids]
+        )
+        progress_raw = pipe.mget(
+            *[track_progress_key_prefix + job_id for job_id in job_ids],
+            encoding=None,
+        )
+        # A job waits in its size class queue or in the default queue.
+        scores = [
+            asyncio.gather(
+                *[pipe.zscore(queue_name, job_id) for queue_name in QUEUE_NAMES]
             )
+            for job_id in job_ids
+        ]
+        await pipe.execute()
 
-            job_result = {}
-            for (key, val) in job_data.items():
-                if isinstance(val, datetime):
-                    job_result[key] = val.strftime("%c")
-                elif isinstance(val, asyncio.CancelledError):
-                    job_result[key] = None
-                else:
-                    job_result[key] = val
-            job_result = JobResultDict(**job_result)
+        return [
+            _job_result_dict(job_id, *raw)
+            for (job_id, *raw) in zip(
+                job_ids,
+                await results_raw,
+                await jobs_raw,
+                await in_progress,
+                await progress_raw,
+                [
+                    next((score for score in queue_scores if score is not None), None)
+                    for queue_scores in await asyncio.gather(*scores)
+                ],
+            )
+        ]
 
-            return job_result
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def result_exists(self, job_id: str) -> bool:
+        """Return whether the result of a job is still kept."""
+        return bool(await self.redis_arq.exists(constants.result_key_prefix + job_id))
 
-        return JobResultDict(job_id=job_id, status=JobStatus.not_found)
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def range_chunk(self, job_id: str, index: int) -> Optional[bytes]:
+        """Return a stored chunk of a range computation, if it is done."""
+        return await self.redis_arq.get(
+            f"{range_key_prefix}{job_id}:{index}", encoding=None
+        )
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def profile(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the profile summary of a profiled job, once it is done."""
+        summary = await self.redis_arq.get(profile_key_prefix + job_id)
+        return None if summary is None else json.loads(summary)
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def bigint_blob(self, ref: str) -> Optional[bytes]:
+        """Return the binary form of a large result stored apart."""
+        return await self.redis_arq.get(bigint_key_prefix + ref, encoding=None)
 
     async def info_all(self) -> Iterable[JobResultDict]:
         """Return info for all jobs."""
-        job_ids = set()
-        for prefix in (
-            constants.result_key_prefix,
-            constants.job_key_prefix,
-            constants.in_progress_key_prefix,
-            constants.retry_key_prefix,
-        ):
-            job_ids.update(
-                {
-                    removeprefix(key, prefix)
-                    for key in await self.redis_arq.keys(f"{prefix}*")
-                }
-            )
+        results, cursor = await self.info_page()
+        while cursor is not None:
+            page, cursor = await self.info_page(cursor=cursor)
+            results.extend(page)
 
-        results = await asyncio.gather(
-            *[self.info(job_id=job_id) for job_id in job_ids]
+        return results
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def info_page(
+        self,
+        status: Optional[JobStatus] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[JobResultDict], Optional[str]]:
+        """Return info for a page of jobs, newest first, and the next cursor.
+
+        Jobs whose keys have expired are dropped from the index, along with
+        their measured size, and jobs whose status moved without the index
+        noticing (e.g. aborted before they started) are re-indexed.
+        """
+        job_ids, next_cursor = await self.index.page(
+            status=status, cursor=cursor, limit=limit
         )
+        results = await self.info_many(job_ids)
 
-        return results
+        expired = [
+            result["job_id"]
+            for result in results
+            if result["status"] == JobStatus.not_found
+        ]
+        await self.index.remove(*expired)
+        if expired:
+            await self.redis_arq.hdel(retention_sizes_key, *expired)
+        if status is not None:
+            await asyncio.gather(
+                *[
+                    self.index.move(result["job_id"], JobStatus(result["status"]))
+                    for result in results
+                    if result["status"] not in (status, JobStatus.not_found)
+                ]
+            )
+
+        return [
+            result
+            for result in results
+            if result["status"] != JobStatus.not_found
+            and (status is None or result["status"] == status)
+        ], next_cursor
 
     @property
     def redis_arq(self):
@@ -155,6 +867,20 @@ class Backend:
             raise RuntimeError("Fatal: No async redis connection.")
         return self._redis_arq
 
+    @property
+    def cache(self) -> ResultCache:
+        """Return the result cache."""
+        if self._cache is None:
+            raise RuntimeError("Fatal: No result cache.")
+        return self._cache
+
+    @property
+    def index(self) -> JobIndex:
+        """Return the job index."""
+        if self._index is None:
+            raise RuntimeError("Fatal: No job index.")
+        return self._index
+
     @property
     def redis_settings(self):
         """Return the redis settings."""
@@ -163,4 +889,14 @@ class Backend:
         return self._redis_settings
 
 
-backend = Backend()
+def _create_backend() -> Union[Backend, "LocalBackend"]:
+    """Return the backend chosen by the settings."""
+    if get_backend_settings().local:
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from wqw_app.local import LocalBackend
+
+        return LocalBackend()
+    return Backend()
+
+
+backend = _create_backend()
@@ -0,0 +1,154 @@
+"""Big integer helpers."""
+import math
+import zlib
+from functools import lru_cache
+from typing import Any, Iterator, Optional, Tuple
+
+from typing_extensions import TypedDict
+
+from wqw_app.settings import BigIntSettings, get_bigint_settings
+
+# Integers up to this many bits are converted by `str` directly, well below
+# the default int to str conversion limit of Python 3.11.
+_DIRECT_BITS = 8192
+
+# Size of the pieces a digits stream is cut into.
+CHUNK_SIZE = 64 * 1024
+
+
+class BigIntInfo(TypedDict):
+    """Metadata of a large integer stored on its own."""
+
+    ref: str
+    digits: int
+    leading: str
+    trailing: str
+    bytes: int
+    compressed: bool
+
+
+@lru_cache(maxsize=64)
+def _power_of_ten(exponent: int) -> int:
+    """Return 10**exponent, cached since the same splits recur."""
+    return 10 ** exponent
+
+
+def _decimal_pieces(value: int, width: int = 0) -> Iterator[str]:
+    """Yield the decimal digits of `value`, zero padded to `width`, in pieces.
+
+    Large integers are split in halves by a power of ten and converted
+    recursively, which is both faster than `str` and not limited in size.
+    """
+    if value.bit_length() <= _DIRECT_BITS:
+        yield str(value).zfill(width)
+        return
+
+    half = int(value.bit_length() * math.log10(2)) // 2
+    high, low = divmod(value, _power_of_ten(half))
+    if high or width:
+        yield from _decimal_pieces(high, max(0, width - half))
+        yield from _decimal_pieces(low, half)
+    else:
+        yield from _decimal_pieces(low)
+
+
+def to_decimal(value: int) -> str:
+    """Return the decimal digits of an integer of any size."""
+    if value < 0:
+        return "-" + to_decimal(-value)
+    return "".join(_decimal_pieces(value))
+
+
+def iter_decimal(value: int) -> Iterator[str]:
+    """Yield the decimal digits of a non-negative integer in chunks.
+
+    The full string is never built; the integer halves waiting to be
+    converted take about as much memory as the integer itself.
+    """
+    assert value >= 0
+    buffer, size = [], 0
+    for piece in _decimal_pieces(value):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def iter_hex(info: BigIntInfo, blob: bytes) -> Iterator[str]:
+    """Yield the hexadecimal digits of a stored integer in chunks."""
+    decompressor = zlib.decompressobj() if info["compressed"] else None
+    leading = True
+    for offset in range(0, len(blob), CHUNK_SIZE // 2):
+        data = blob[offset : offset + CHUNK_SIZE // 2]
+        if decompressor is not None:
+            data = decompressor.decompress(data)
+        chunk = data.hex()
+        if leading:
+            chunk = chunk.lstrip("0")
+            leading = not chunk
+        if chunk:
+            yield chunk
+
+    chunk = decompressor.flush().hex() if decompressor is not None else ""
+    if leading:
+        chunk = chunk.lstrip("0") or "0"
+    if chunk:
+        yield chunk
+
+
+def decimal_digits(value: int) -> int:
+    """Return the number of decimal digits of a non-negative integer."""
+    if value.bit_length() <= _DIRECT_BITS:
+        return len(str(value))
+    digits = int(value.bit_length() * math.log10(2)) + 1
+    return digits if value >= _power_of_ten(digits - 1) else digits - 1
+
+
+def is_large(value: Any, settings: Optional[BigIntSettings] = None) -> bool:
+    """Return True if `value` is an integer to be stored on its own."""
+    settings = get_bigint_settings() if settings is None else settings
+    return (
+        isinstance(value, int)
+        and value >= 0
+        and value.bit_length() * math.log10(2) > settings.threshold_digits
+    )
+
+
+def is_packed(result: Any) -> bool:
+    """Return True if a job result is the metadata of a stored integer."""
+    return isinstance(result, dict) and set(result) == set(BigIntInfo.__annotations__)
+
+
+def pack(
+    value: int, ref: str, settings: Optional[BigIntSettings] = None
+) -> Tuple[BigIntInfo, bytes]:
+    """Return metadata and the big-endian binary form of `value`."""
+    assert value >= 0
+    settings = get_bigint_settings() if settings is None else settings
+
+    blob = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    if settings.compress:
+        blob = zlib.compress(blob, settings.compress_level)
+
+    digits = decimal_digits(value)
+    preview = min(settings.preview_digits, digits)
+    info = BigIntInfo(
+        ref=ref,
+        digits=digits,
+        leading=str(value // _power_of_ten(digits - preview)),
+        trailing=str(value % _power_of_ten(preview)).zfill(preview),
+        bytes=len(blob),
+        compressed=settings.compress,
+    )
+
+    return info, blob
+
+
+def unpack(info: BigIntInfo, blob: bytes) -> int:
+    """Return the integer stored in `blob`."""
+    if info["compressed"]:
+        blob = zlib.decompress(blob)
+    return int.from_bytes(blob, "big")
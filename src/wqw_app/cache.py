@@ -0,0 +1,147 @@
+"""Result cache module."""
+import time
+import pickle
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from aioredis import Redis
+
+from wqw_app.settings import CacheSettings, get_cache_settings
+from wqw_app.utils import (
+    cache_key_prefix,
+    cache_index_key,
+    cache_stats_key,
+    in_flight_key_prefix,
+)
+
+# Delete the in-flight marker only if it still belongs to the releasing job.
+_RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class ResultCache:
+    """Redis-backed memoization of job results.
+
+    Results are stored under a digest of (function, args, kwargs) and evicted
+    by TTL and, oldest first, once the cache holds more than `max_entries`.
+    Jobs that are still running are tracked in a separate in-flight key so
+    identical submissions can share a single job.
+    """
+
+    def __init__(self, redis: Redis, settings: Optional[CacheSettings] = None):
+        self._redis = redis
+        self._settings = get_cache_settings() if settings is None else settings
+
+    @staticmethod
+    def key(function: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> str:
+        """Return the cache key for a function call."""
+        call = repr((function, tuple(args), sorted(kwargs.items())))
+        return hashlib.sha1(call.encode()).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        """Return True if the cache is switched on."""
+        return self._settings.enabled
+
+    async def get(self, key: str) -> Tuple[bool, Any]:
+        """Look up a result, counting the hit or miss.
+
+        Return a (found, result) pair since a result can itself be falsy.
+        """
+        data = await self._redis.get(cache_key_prefix + key, encoding=None)
+        await self._redis.hincrby(cache_stats_key, "hits" if data else "misses")
+        if data is None:
+            return False, None
+        return True, pickle.loads(data)
+
+    async def get_many(self, keys: Sequence[str]) -> List[Tuple[bool, Any]]:
+        """Look up several results at once, like `get`."""
+        if not keys:
+            return []
+        values = await self._redis.mget(
+            *[cache_key_prefix + key for key in keys], encoding=None
+        )
+        hits = sum(value is not None for value in values)
+        pipe = self._redis.pipeline()
+        pipe.hincrby(cache_stats_key, "hits", hits)
+        pipe.hincrby(cache_stats_key, "misses", len(keys) - hits)
+        await pipe.execute()
+        return [
+            (False, None) if value is None else (True, pickle.loads(value))
+            for value in values
+        ]
+
+    async def set(self, key: str, result: Any) -> None:
+        """Store a result and evict the oldest entries beyond the size limit."""
+        pipe = self._redis.pipeline()
+        pipe.set(
+            cache_key_prefix + key, pickle.dumps(result), expire=self._settings.ttl
+        )
+        pipe.zadd(cache_index_key, time.time(), key)
+        pipe.zcard(cache_index_key)
+        *_, size = await pipe.execute()
+
+        if (excess := size - self._settings.max_entries) > 0:
+            evicted = await self._redis.zpopmin(cache_index_key, excess)
+            # zpopmin returns a flat [member, score, member, score, ...] list.
+            await self._redis.delete(
+                *[cache_key_prefix + member for member in evicted[::2]]
+            )
+
+    async def claim(self, key: str, job_id: str) -> Optional[str]:
+        """Mark `job_id` as computing `key`.
+
+        Return the id of the job already in flight for `key`, or None if the
+        claim succeeded.
+        """
+        if await self._redis.set(
+            in_flight_key_prefix + key,
+            job_id,
+            expire=self._settings.in_flight_ttl,
+            exist=self._redis.SET_IF_NOT_EXIST,
+        ):
+            return None
+        return await self._redis.get(in_flight_key_prefix + key)
+
+    async def claim_many(
+        self, keys: Sequence[str], job_ids: Sequence[str]
+    ) -> List[Optional[str]]:
+        """Mark several jobs as computing their keys at once, like `claim`.
+
+        Claims are made in order, so a key repeated in `keys` is claimed by
+        its first job.
+        """
+        pipe = self._redis.pipeline()
+        holders = []
+        for (key, job_id) in zip(keys, job_ids):
+            pipe.set(
+                in_flight_key_prefix + key,
+                job_id,
+                expire=self._settings.in_flight_ttl,
+                exist=self._redis.SET_IF_NOT_EXIST,
+            )
+            holders.append(pipe.get(in_flight_key_prefix + key))
+        await pipe.execute()
+        return [
+            None if holder == job_id else holder
+            for (holder, job_id) in zip([await holder for holder in holders], job_ids)
+        ]
+
+    async def release(self, key: str, job_id: str) -> None:
+        """Remove the in-flight marker for `key` if it is held by `job_id`."""
+        await self._redis.eval(
+            _RELEASE_SCRIPT, keys=[in_flight_key_prefix + key], args=[job_id]
+        )
+
+    async def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the number of cached entries."""
+        counters = await self._redis.hgetall(cache_stats_key)
+        return {
+            "hits": int(counters.get("hits", 0)),
+            "misses": int(counters.get("misses", 0)),
+            "entries": await self._redis.zcard(cache_index_key),
+        }
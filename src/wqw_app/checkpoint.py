@@ -0,0 +1,60 @@
+"""Checkpoint module."""
+import os
+import time
+import pickle
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from wqw_app.settings import CheckpointSettings, get_checkpoint_settings
+
+
+class Checkpoint:
+    """Resumable state of a computation on local disk.
+
+    A checkpoint holds the pickled state of the tracker together with the
+    engine state at that point, e.g. the pair (F(k), F(k+1)). It is keyed by
+    engine and number, so a retried job as well as a new job for the same
+    number resumes from it. Saves are rate limited to one per `interval`
+    seconds of wall time.
+    """
+
+    def __init__(
+        self, number: int, engine: str, settings: Optional[CheckpointSettings] = None
+    ):
+        self._settings = get_checkpoint_settings() if settings is None else settings
+        self.path = Path(self._settings.directory) / f"{engine}-{number}.ckpt"
+        self._last_save = time.monotonic()
+
+    @property
+    def due(self) -> bool:
+        """Return True if the last save is at least `interval` seconds old."""
+        return time.monotonic() - self._last_save >= self._settings.interval
+
+    def save(self, tracker_state: Dict[str, Any], state: Tuple[int, ...]) -> None:
+        """Atomically replace the checkpoint."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(partial, "wb") as file:
+            pickle.dump(
+                {"tracker": tracker_state, "state": state},
+                file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(partial, self.path)
+        self._last_save = time.monotonic()
+
+    def load(self) -> Optional[Tuple[Dict[str, Any], Tuple[int, ...]]]:
+        """Return the saved (tracker state, engine state), if any."""
+        try:
+            with open(self.path, "rb") as file:
+                saved = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError):
+            self.clear()
+            return None
+        return saved["tracker"], saved["state"]
+
+    def clear(self) -> None:
+        """Remove the checkpoint."""
+        self.path.unlink(missing_ok=True)
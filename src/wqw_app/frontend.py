@@ -1,41 +1,73 @@
 """Module for Fibonacci computations."""
-import json
-from typing import Optional
-
-import httpx
+from functools import lru_cache
+from typing import TYPE_CHECKING, AsyncIterator, Optional
 
 from fastapi import APIRouter, Request, Response, Form
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, StreamingResponse
+
+from wqw_app import bigint
+from wqw_app.backend import backend, AdmissionRejected
+from wqw_app.settings import get_admission_settings
+from wqw_app.stream import broker, FINAL_STATUSES
+from wqw_app.utils import client_id
+from wqw_app.worker import async_fib, estimate_cost, Engine
+
+if TYPE_CHECKING:
+    from fastapi.templating import Jinja2Templates
 
-from wqw_app import api
 
-templates = Jinja2Templates(directory="templates")
+@lru_cache
+def get_templates() -> "Jinja2Templates":
+    """Return the templates, importing Jinja on first use.
+
+    An app only serving the JSON API never loads it.
+    """
+    # pylint: disable=import-outside-toplevel
+    from fastapi.templating import Jinja2Templates
+
+    return Jinja2Templates(directory="templates")
+
 
 router = APIRouter()
 
 
+def _add_error(request: Request, number: int, error: str) -> Response:
+    """Return the error component of a task that was not added."""
+    return get_templates().TemplateResponse(
+        "partials/error.html",
+        {"request": request, "task_id": None, "number": number, "error": error},
+    )
+
+
 @router.post("/add", summary="New Fibonacci computation.")
 async def add_task(request: Request, number: int = Form(...)) -> Response:
     """Compute a new Fibonacci number.
 
-    Return one in-progress component and one waiting component.
+    Return one in-progress component and one waiting component, or an error
+    component if the number is not positive or the task is over an
+    admission limit.
     """
-    async with httpx.AsyncClient() as client:
-        # Post computation to server.
-        response = await client.post(
-            request.url_for(api.post_task.__name__, number=number)
+    if number < 1:
+        return _add_error(request, number, "number must be positive")
+    try:
+        job = await backend.enqueue_job(
+            async_fib,
+            number,
+            engine=Engine.fast_doubling.value,
+            _cost=estimate_cost(number, Engine.fast_doubling),
+            _client=client_id(request, get_admission_settings().client_header),
         )
+    except AdmissionRejected as error:
+        return _add_error(
+            request,
+            number,
+            "too costly to compute"
+            if error.retry_after is None
+            else f"queue is full, retry in {error.retry_after} s",
+        )
+    task_id = job.job_id if job else None
 
-        data = {}
-        try:
-            data = response.json()
-        except json.JSONDecodeError:
-            print("JSON decoding failed")
-
-        task_id = data.get("task_id")
-
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "partials/add.html",
         {
             "request": request,
@@ -50,53 +82,81 @@ async def add_task(request: Request, number: int = Form(...)) -> Response:
 async def get_progress(request: Request, task_id: str) -> Response:
     """Get task status.
 
-    Return in_progress, completed, or error="not found" component.
+    Return in_progress (also for queued tasks), completed, or
+    error="not found" component.
     """
-    async with httpx.AsyncClient() as client:
-        # Get result for task from server.
-        response = await client.get(
-            request.url_for(api.read_task.__name__, task_id=task_id)
+    data = await backend.info(job_id=task_id)
+
+    status = data.get("status", "not_found")
+    if data.get("function") != async_fib.__name__:
+        status = "not_found"
+    progress = round(100 * float(data.get("progress", 0)))
+    number = data.get("args", [None])[0]
+    result = data.get("result")
+
+    def in_progress() -> Response:
+        return get_templates().TemplateResponse(
+            "partials/in_progress.html",
+            {
+                "request": request,
+                "task_id": task_id,
+                "number": number,
+                "progress": progress,
+            },
         )
 
-        data = {}
-        try:
-            data = response.json()
-        except json.JSONDecodeError:
-            print("JSON decoding failed")
-
-        assert data.get("function", None) == "async_fib"
-
-        status = data.get("status", "not_found")
-        progress = round(100 * float(data.get("progress", 0)))
-        number = data.get("args", [None])[0]
-        result = data.get("result")
-
-        responses = {
-            "in_progress": templates.TemplateResponse(
-                "partials/in_progress.html",
-                {
-                    "request": request,
-                    "task_id": task_id,
-                    "number": number,
-                    "progress": progress,
-                },
-            ),
-            "complete": templates.TemplateResponse(
-                "partials/complete.html",
-                {"request": request, "number": number, "result": result},
-            ),
-            "not_found": templates.TemplateResponse(
-                "partials/error.html",
-                {
-                    "request": request,
-                    "number": number,
-                    "task_id": task_id,
-                    "error": "not found",
-                },
-            ),
-        }
-
-    return responses.get(status, responses["not_found"])
+    # Only the component that is returned gets rendered.
+    responses = {
+        "queued": in_progress,
+        "deferred": in_progress,
+        "in_progress": in_progress,
+        "complete": lambda: get_templates().TemplateResponse(
+            "partials/complete.html",
+            {
+                "request": request,
+                "task_id": task_id,
+                "number": number,
+                "result": result,
+                "packed": bigint.is_packed(result),
+            },
+        ),
+        "not_found": lambda: get_templates().TemplateResponse(
+            "partials/error.html",
+            {
+                "request": request,
+                "number": number,
+                "task_id": task_id,
+                "error": "not found",
+            },
+        ),
+    }
+
+    return responses.get(status, responses["not_found"])()
+
+
+async def _progress_events(task_id: str) -> AsyncIterator[str]:
+    """Server-sent events with the rendered progress bar of a task.
+
+    A `done` event tells the page to fetch the final component.
+    """
+    progress_bar = get_templates().get_template("partials/progress_bar.html")
+    async for info in broker.watch([task_id]):
+        if info is None:
+            yield ": keepalive\n\n"
+        elif info["status"] in FINAL_STATUSES:
+            yield "event: done\ndata: \n\n"
+        else:
+            html = progress_bar.render(
+                progress=round(100 * float(info.get("progress", 0)))
+            )
+            data = "".join(f"data: {line}\n" for line in html.splitlines())
+            yield f"event: progress\n{data}\n"
+
+
+@router.get("/stream/{task_id}", summary="Stream computation progress.")
+async def stream_progress(task_id: str) -> Response:
+    """Stream progress bar updates of a task."""
+    return StreamingResponse(_progress_events(task_id), media_type="text/event-stream")
 
 
 @router.post("/cancel/{task_id}", summary="Get computation status.")
@@ -110,37 +170,14 @@ async def cancel(
 
     Return error="cancelled" component.
     """
-    async with httpx.AsyncClient() as client:
-        # Get result for task from server.
-        response = await client.get(
-            request.url_for(api.read_task.__name__, task_id=task_id)
-        )
-
-        data = {}
-        try:
-            data = response.json()
-        except json.JSONDecodeError:
-            print("JSON decoding failed")
+    data = await backend.info(job_id=task_id)
+    number = data.get("args", [None])[0]
 
-        number = data.get("args", [None])[0]
-
-        # Post cancel task to server.
-        params = {"poll_delay": poll_delay}
-        if timeout:
-            params["timeout"] = timeout
-        response = await client.post(
-            request.url_for(api.cancel_task.__name__, task_id=task_id), params=params
-        )
-
-        data = {}
-        try:
-            data = response.json()
-        except json.JSONDecodeError:
-            print("JSON decoding failed")
-
-        success = data.get("cancelled", False)
+    success = await backend.abort(
+        job_id=task_id, timeout=timeout, poll_delay=poll_delay
+    )
 
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "partials/error.html",
         {
             "request": request,
@@ -0,0 +1,135 @@
+"""Job index module."""
+from typing import Iterable, List, Optional, Tuple
+
+from aioredis import Redis
+from arq.jobs import JobStatus
+
+from wqw_app.utils import job_index_key, job_index_status_key_prefix
+
+# Statuses with their own index. Deferred jobs are indexed as queued.
+INDEXED_STATUSES = (JobStatus.queued, JobStatus.in_progress, JobStatus.complete)
+
+# Move a job to the index of one status, keeping its enqueue time as score.
+_MOVE_SCRIPT = """
+local score = redis.call("ZSCORE", KEYS[1], ARGV[1])
+if not score then
+    return 0
+end
+for i = 3, #KEYS do
+    redis.call("ZREM", KEYS[i], ARGV[1])
+end
+return redis.call("ZADD", KEYS[2], score, ARGV[1])
+"""
+
+# Page through an index newest first, including all entries tied with the
+# cursor score so the caller can skip past the cursor job.
+_PAGE_SCRIPT = """
+local ties = redis.call("ZCOUNT", KEYS[1], ARGV[1], ARGV[1])
+return redis.call(
+    "ZREVRANGEBYSCORE", KEYS[1], ARGV[1], "-inf",
+    "WITHSCORES", "LIMIT", 0, tonumber(ARGV[2]) + ties
+)
+"""
+
+
+def _status_key(status: JobStatus) -> str:
+    """Return the index key for a status."""
+    if status is JobStatus.deferred:
+        status = JobStatus.queued
+    return job_index_status_key_prefix + status.value
+
+
+class JobIndex:
+    """Sorted sets of job ids by enqueue time, overall and per status.
+
+    Listing jobs from the index costs O(log N + page size) instead of a KEYS
+    scan over the whole keyspace. Cursors have the form `<score>:<job_id>`
+    of the last job on the previous page.
+    """
+
+    def __init__(self, redis: Redis):
+        self._redis = redis
+
+    async def add(self, job_id: str, enqueue_time_ms: int, status: JobStatus) -> None:
+        """Add a job to the index."""
+        pipe = self._redis.pipeline()
+        pipe.zadd(job_index_key, enqueue_time_ms, job_id)
+        pipe.zadd(_status_key(status), enqueue_time_ms, job_id)
+        await pipe.execute()
+
+    async def add_many(
+        self, entries: Iterable[Tuple[str, int]], status: JobStatus
+    ) -> None:
+        """Add (job_id, enqueue_time_ms) entries with the same status."""
+        pairs = [value for (job_id, score) in entries for value in (score, job_id)]
+        if not pairs:
+            return
+        pipe = self._redis.pipeline()
+        pipe.zadd(job_index_key, *pairs)
+        pipe.zadd(_status_key(status), *pairs)
+        await pipe.execute()
+
+    async def move(self, job_id: str, status: JobStatus) -> None:
+        """Move an indexed job to the index of `status`."""
+        target = _status_key(status)
+        await self._redis.eval(
+            _MOVE_SCRIPT,
+            keys=[
+                job_index_key,
+                target,
+                *[key for key in map(_status_key, INDEXED_STATUSES) if key != target],
+            ],
+            args=[job_id],
+        )
+
+    async def remove(self, *job_ids: str) -> None:
+        """Remove jobs from the index."""
+        if not job_ids:
+            return
+        pipe = self._redis.pipeline()
+        for key in (job_index_key, *map(_status_key, INDEXED_STATUSES)):
+            pipe.zrem(key, *job_ids)
+        await pipe.execute()
+
+    async def oldest(
+        self, status: JobStatus, start: int = 0, count: Optional[int] = None
+    ) -> List[Tuple[str, int]]:
+        """Return (job_id, enqueue_time_ms) entries of `status`, oldest first,
+        from the `start`:th on, all or `count` of them."""
+        stop = -1 if count is None else start + count - 1
+        entries = await self._redis.zrange(
+            _status_key(status), start, stop, withscores=True
+        )
+        return [(job_id, int(score)) for (job_id, score) in entries]
+
+    async def page(
+        self,
+        status: Optional[JobStatus] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[str], Optional[str]]:
+        """Return up to `limit` job ids, newest first, and the next cursor."""
+        key = job_index_key if status is None else _status_key(status)
+
+        if cursor is None:
+            entries = await self._redis.zrevrangebyscore(
+                key, withscores=True, offset=0, count=limit
+            )
+        else:
+            score, _, after = cursor.partition(":")
+            flat = await self._redis.eval(
+                _PAGE_SCRIPT, keys=[key], args=[int(score), limit]
+            )
+            entries = [
+                (member, int(member_score))
+                for (member, member_score) in zip(flat[::2], flat[1::2])
+                if not (int(member_score) == int(score) and member >= after)
+            ][:limit]
+
+        job_ids = [member for (member, _) in entries]
+        next_cursor = None
+        if len(entries) == limit:
+            member, member_score = entries[-1]
+            next_cursor = f"{int(member_score)}:{member}"
+
+        return job_ids, next_cursor
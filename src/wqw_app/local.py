@@ -0,0 +1,685 @@
+"""In-process backend module.
+
+On a single node, the web app can run the jobs itself, without Redis or a
+worker. Jobs wait in an in-process priority queue, in the order of their
+queue score, and run in a process pool of the web app, reporting progress
+through the shared slots of a ProgressRelay like in a worker. They run the
+job bodies of the worker, which store through a worker.JobContext. Jobs,
+their results, large integers, range chunks and profiles are kept in memory
+within the retention limits, and are lost with the process.
+
+The result cache and admission control live in Redis and do not apply: every
+call is computed, and `_client` and `_expires` are ignored.
+"""
+import os
+import json
+import time
+import asyncio
+import itertools
+import logging
+from collections import Counter
+from uuid import uuid4
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from arq import constants
+from arq.jobs import Job, JobDef, JobResult, JobStatus
+from arq.utils import ms_to_datetime, timestamp_ms, to_ms, to_unix_ms
+
+from wqw_app import bigint, metrics, progress, scheduler, worker
+from wqw_app.backend import (
+    AdmissionRejected,
+    JobResultDict,
+    duration_stats,
+    job_info_dict,
+)
+from wqw_app.progress import ProgressRelay
+from wqw_app.scheduler import SizeClass
+from wqw_app.settings import (
+    BackendSettings,
+    get_backend_settings,
+    get_progress_settings,
+    get_retention_settings,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    """A job of the in-process backend."""
+
+    def __init__(
+        self,
+        job_id: str,
+        seq: int,
+        definition: JobDef,
+        cost: Optional[float],
+        queue_name: str,
+    ):
+        self.job_id = job_id
+        self.seq = seq
+        # The result, once the job is complete.
+        self.definition = definition
+        self.cost = cost
+        self.queue_name = queue_name
+        self.slot: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.done = asyncio.Event()
+        self.ref: Optional[str] = None
+        self.bytes = 0
+
+    @property
+    def status(self) -> JobStatus:
+        """Return the status of the job."""
+        if self.done.is_set():
+            return JobStatus.complete
+        if self.slot is not None:
+            return JobStatus.in_progress
+        if (self.definition.score or 0) > timestamp_ms():
+            return JobStatus.deferred
+        return JobStatus.queued
+
+
+class LocalJob(Job):
+    """A job of the in-process backend, with the interface of an arq job."""
+
+    def __init__(self, job_id: str, local: "LocalBackend"):
+        super().__init__(job_id, redis=None)  # type: ignore[arg-type]
+        self._local = local
+
+    async def info(self) -> Optional[JobDef]:
+        """Return the definition of the job, or its result once complete."""
+        entry = self._local.entry(self.job_id)
+        return None if entry is None else entry.definition
+
+    async def result_info(self) -> Optional[JobResult]:
+        """Return the result of the job, if it is complete."""
+        entry = self._local.entry(self.job_id)
+        if entry is None or not entry.done.is_set():
+            return None
+        return entry.definition
+
+    async def status(self) -> JobStatus:
+        """Return the status of the job."""
+        entry = self._local.entry(self.job_id)
+        return JobStatus.not_found if entry is None else entry.status
+
+    async def result(
+        self,
+        timeout: Optional[float] = None,
+        *,
+        poll_delay: float = 0.5,
+        pole_delay: Optional[float] = None,
+    ) -> Any:
+        """Wait for the result of the job, raising its error if it failed.
+
+        The result is waited for, not polled.
+        """
+        if (entry := self._local.entry(self.job_id)) is None:
+            return await super().result(timeout, poll_delay=poll_delay)
+        await asyncio.wait_for(entry.done.wait(), timeout)
+        if entry.definition.success:
+            return entry.definition.result
+        raise entry.definition.result
+
+    async def abort(
+        self, *, timeout: Optional[float] = None, poll_delay: float = 0.5
+    ) -> bool:
+        """Abort the job."""
+        return await self._local.abort(self.job_id, timeout, poll_delay)
+
+
+class _LocalJobContext(worker.JobContext):
+    """A job run by the in-process backend, storing in memory."""
+
+    # pylint: disable=protected-access
+
+    def __init__(self, local: "LocalBackend", entry: _Entry):
+        assert entry.slot is not None
+        super().__init__(
+            entry.job_id,
+            entry.slot,
+            local._pool,
+            local._processes,
+            local.relay,
+            entry.definition.enqueue_time,
+        )
+        self._local = local
+
+    async def store_blob(self, ref: str, blob: bytes) -> None:
+        self._local._blobs[ref] = blob
+
+    async def store_chunk(self, index: int, blob: bytes) -> None:
+        self._local._chunks.setdefault(self.job_id, {})[index] = blob
+
+    async def store_profile(self, summary: str) -> None:
+        self._local._profiles[self.job_id] = summary
+
+    async def count_abort(self, latency: float) -> None:
+        _count(self._local._abort_stats, latency)
+
+
+class LocalBackend:
+    """In-process backend, with the interface of Backend."""
+
+    def __init__(self, settings: Optional[BackendSettings] = None):
+        self._settings = get_backend_settings() if settings is None else settings
+        self._processes = self._settings.processes or os.cpu_count() or 1
+        self._pool: Optional[Any] = None
+        self._relay: Optional[ProgressRelay] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._seq = itertools.count()
+        # All jobs in the order they came, those not complete, and those
+        # complete in the order they finished.
+        self._jobs: Dict[str, _Entry] = {}
+        self._pending: Dict[str, _Entry] = {}
+        self._complete: Dict[str, _Entry] = {}
+        self._kept_bytes = 0
+        self._blobs: Dict[str, bytes] = {}
+        self._blob_refs: Counter = Counter()
+        self._chunks: Dict[str, Dict[int, bytes]] = {}
+        self._profiles: Dict[str, str] = {}
+        self._abort_stats: Dict[str, float] = {}
+        self._waits: Dict[str, Dict[str, float]] = {cls.value: {} for cls in SizeClass}
+        self._retention = dict.fromkeys(
+            ("runs", "deleted", "expired", "reclaimed_bytes"), 0
+        )
+        self._functions: Dict[str, Callable[..., Awaitable[Any]]] = {}
+
+    async def init(self):
+        """Start the process pool and the tasks running the jobs."""
+        # pylint: disable=import-outside-toplevel
+        from concurrent import futures
+        from multiprocessing import resource_tracker
+
+        # The worker may still be importing when the backend is created.
+        self._functions = {
+            worker.async_fib.__name__: worker.compute_fib,
+            worker.async_fib_mod.__name__: worker.async_fib_mod,
+            worker.async_fib_range.__name__: worker.compute_fib_range,
+        }
+        self._queue = asyncio.PriorityQueue()
+        # One progress slot per job run at a time, one job per pool process.
+        self._relay = ProgressRelay(self._processes)
+        # Pool processes share the tracker of the shared memory blocks of the
+        # parallel engine only if forked after it started.
+        resource_tracker.ensure_running()
+        self._pool = futures.ProcessPoolExecutor(
+            max_workers=self._processes,
+            initializer=progress.init_process,
+            initargs=(self._relay.slots, self._relay.aborts),
+        )
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *[
+                loop.run_in_executor(self._pool, worker.warm_up)
+                for _ in range(self._processes)
+            ]
+        )
+        self._tasks = [
+            asyncio.create_task(self._consume()) for _ in range(self._processes)
+        ]
+        self._tasks.append(asyncio.create_task(self._relay_progress()))
+
+        metrics.POOL_PROCESSES.set(self._processes)
+        metrics.JOBS_RUNNING.set_function(
+            lambda: {(): self._processes - self.relay.free}
+        )
+
+    async def close(self):
+        """Stop running jobs and the process pool."""
+        for task in self._tasks:
+            task.cancel()
+        running = [entry.task for entry in self._pending.values() if entry.task]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *running, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """Call `listener` with every status and progress update of a job, as
+        workers publish them on the progress channel."""
+        self._listeners.append(listener)
+
+    def entry(self, job_id: str) -> Optional[_Entry]:
+        """Return a job, if it is kept."""
+        return self._jobs.get(job_id)
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def enqueue_job(
+        self,
+        function: Union[str, Callable],
+        *args: Any,
+        _job_id: Optional[str] = None,
+        _queue_name: Optional[str] = None,
+        _defer_until: Optional[datetime] = None,
+        _defer_by: Union[None, int, float, timedelta] = None,
+        _expires: Union[None, int, float, timedelta] = None,
+        _job_try: Optional[int] = None,
+        _cost: Optional[float] = None,
+        _client: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Optional[Job]:
+        """Enqueue a job, or return None if its job id exists."""
+        # pylint: disable=unused-argument
+        assert isinstance(function, (str, Callable))
+        if isinstance(function, Callable):
+            function = function.__name__
+        assert not (
+            _defer_until and _defer_by
+        ), "use either 'defer_until' or 'defer_by' or neither, not both"
+
+        job_id = _job_id or uuid4().hex
+        if job_id in self._jobs:
+            return None
+        enqueue_time_ms = timestamp_ms()
+        if _defer_until is not None:
+            score = to_unix_ms(_defer_until)
+        elif _defer_by:
+            score = enqueue_time_ms + to_ms(_defer_by)
+        else:
+            score = scheduler.score(enqueue_time_ms, _cost)
+        self._queue_job(
+            job_id,
+            JobDef(
+                function, args, kwargs, _job_try, ms_to_datetime(enqueue_time_ms), score
+            ),
+            _cost,
+            _queue_name or scheduler.queue_for(_cost),
+        )
+        return LocalJob(job_id, self)
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def enqueue_jobs(
+        self,
+        function: Union[str, Callable],
+        calls: Sequence[Tuple[Tuple[Any, ...], Dict[str, Any]]],
+        job_ids: Optional[Sequence[Optional[str]]] = None,
+        costs: Optional[Sequence[float]] = None,
+        client: Optional[str] = None,
+    ) -> List[Union[Job, None, AdmissionRejected]]:
+        """Enqueue several (args, kwargs) calls of a function."""
+        job_ids = [None] * len(calls) if job_ids is None else job_ids
+        costs = [None] * len(calls) if costs is None else costs
+        assert len(job_ids) == len(calls) == len(costs)
+
+        return [
+            await self.enqueue_job(
+                function, *args, _job_id=job_id, _cost=cost, _client=client, **kwargs
+            )
+            for ((args, kwargs), job_id, cost) in zip(calls, job_ids, costs)
+        ]
+
+    def _queue_job(
+        self,
+        job_id: str,
+        definition: JobDef,
+        cost: Optional[float],
+        queue_name: str,
+    ) -> None:
+        """Add a job and queue it, once due if deferred."""
+        entry = _Entry(job_id, next(self._seq), definition, cost, queue_name)
+        self._jobs[job_id] = self._pending[job_id] = entry
+        item = (definition.score, entry.seq, job_id)
+        if (delay_ms := definition.score - timestamp_ms()) > 0:
+            asyncio.get_running_loop().call_later(
+                delay_ms / 1000, self.queue.put_nowait, item
+            )
+        else:
+            self.queue.put_nowait(item)
+
+    async def complete_job(
+        self,
+        job_id: str,
+        function: str,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        result: Any,
+    ) -> Optional[Job]:
+        """Record a job that is already complete, without queueing it."""
+        if await self.record_job(job_id, function, args, kwargs, result) is None:
+            return None
+
+        return LocalJob(job_id, self)
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def record_job(
+        self,
+        job_id: str,
+        function: str,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        result: Any,
+    ) -> Optional[JobResultDict]:
+        """Record a job that is already complete, without queueing it.
+
+        Return its info, as `info` would, or None if the job exists.
+        """
+        if job_id in self._jobs:
+            return None
+        now = ms_to_datetime(timestamp_ms())
+        entry = _Entry(
+            job_id,
+            next(self._seq),
+            JobDef(function, args, kwargs, 1, now, None),
+            None,
+            constants.default_queue_name,
+        )
+        self._jobs[job_id] = entry
+        self._finish(entry, True, result, now)
+
+        return self._info(job_id)
+
+    async def cache_stats(self) -> Dict[str, int]:
+        """Return result cache counters, all zero since there is no cache."""
+        return {"hits": 0, "misses": 0, "entries": 0}
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def abort(
+        self, job_id: str, timeout: Optional[float] = None, poll_delay: float = 0.5
+    ) -> bool:
+        """Abort a job.
+
+        A running job is cancelled, and a queued job completes as cancelled
+        right away. Return True if the job ended aborted within `timeout`.
+        """
+        if (entry := self._jobs.get(job_id)) is None:
+            return False
+        if entry.task is not None:
+            entry.task.cancel()
+        elif not entry.done.is_set():
+            now = ms_to_datetime(timestamp_ms())
+            self._finish(entry, False, asyncio.CancelledError(), now)
+        try:
+            await LocalJob(job_id, self).result(timeout=timeout, poll_delay=poll_delay)
+        except asyncio.CancelledError:
+            return True
+        except Exception:  # pylint: disable=broad-except
+            return False
+        return False
+
+    async def abort_stats(self) -> Dict[str, float]:
+        """Return the number of aborted computations and the time it took
+        their pool processes to stop."""
+        return duration_stats(self._abort_stats)
+
+    async def retention_stats(self) -> Dict[str, int]:
+        """Return the complete jobs deleted and the bytes reclaimed so far,
+        and the complete jobs kept."""
+        return {
+            **self._retention,
+            "kept": len(self._complete),
+            "kept_bytes": self._kept_bytes,
+        }
+
+    async def queue_stats(self) -> Dict[str, Dict[str, float]]:
+        """Return the number of jobs waiting in each size class, and the time
+        the jobs started so far waited."""
+        queued = Counter(
+            scheduler.size_class(entry.cost or 0.0).value
+            for entry in self._pending.values()
+            if entry.slot is None
+        )
+        return {
+            cls.value: {
+                "queued": queued[cls.value],
+                **{
+                    f"wait_{key}": val
+                    for (key, val) in duration_stats(self._waits[cls.value]).items()
+                },
+            }
+            for cls in SizeClass
+        }
+
+    async def collect_metrics(self) -> None:
+        """Update the queue depth metrics."""
+        depths = Counter(entry.queue_name for entry in self._pending.values())
+        for queue_name in scheduler.QUEUE_NAMES:
+            metrics.QUEUE_JOBS.labels(queue_name).set(depths[queue_name])
+
+    async def info(self, job_id: str) -> JobResultDict:
+        """Return info on `job_id`."""
+        return self._info(job_id)
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def info_many(self, job_ids: Sequence[str]) -> List[JobResultDict]:
+        """Return info on several jobs."""
+        return [self._info(job_id) for job_id in job_ids]
+
+    def _info(self, job_id: str) -> JobResultDict:
+        """Return info on a job, with its current progress if running."""
+        if (entry := self._jobs.get(job_id)) is None:
+            return JobResultDict(job_id=job_id, status=JobStatus.not_found)
+
+        status = entry.status
+        job_progress = {}
+        if status is JobStatus.in_progress:
+            job_progress = {
+                "job_id": job_id,
+                "timestamp": datetime.now().astimezone().isoformat(),
+                "progress": round(self.relay.slots[entry.slot], ndigits=3),
+            }
+        return job_info_dict(job_id, entry.definition, status, job_progress)
+
+    async def result_exists(self, job_id: str) -> bool:
+        """Return whether the result of a job is still kept."""
+        return job_id in self._complete
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def range_chunk(self, job_id: str, index: int) -> Optional[bytes]:
+        """Return a stored chunk of a range computation, if it is done."""
+        return self._chunks.get(job_id, {}).get(index)
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def profile(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the profile summary of a profiled job, once it is done."""
+        summary = self._profiles.get(job_id)
+        return None if summary is None else json.loads(summary)
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def bigint_blob(self, ref: str) -> Optional[bytes]:
+        """Return the binary form of a large result stored apart."""
+        return self._blobs.get(ref)
+
+    async def info_all(self) -> Iterable[JobResultDict]:
+        """Return info for all jobs."""
+        return [self._info(job_id) for job_id in reversed(self._jobs)]
+
+    @metrics.timed(metrics.BACKEND_LATENCY)
+    async def info_page(
+        self,
+        status: Optional[JobStatus] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[JobResultDict], Optional[str]]:
+        """Return info for a page of jobs, newest first, and the next cursor.
+
+        The cursor is the sequence number of the last job of the page.
+        """
+        before = None if cursor is None else int(cursor)
+        results, last = [], None
+        for entry in reversed(self._jobs.values()):
+            if before is not None and entry.seq >= before:
+                continue
+            if status is None or entry.status is status:
+                results.append(self._info(entry.job_id))
+                last = entry.seq
+                if len(results) == limit:
+                    break
+
+        return results, None if len(results) < limit else str(last)
+
+    async def _consume(self) -> None:
+        """Run queued jobs one at a time, until cancelled."""
+        while True:
+            (_, _, job_id) = await self.queue.get()
+            # Aborted jobs are complete and deleted jobs are gone.
+            if (entry := self._pending.get(job_id)) is None:
+                continue
+            entry.task = asyncio.create_task(self._run(entry))
+            # Waited for without taking on its cancellation by an abort.
+            await asyncio.wait([entry.task])
+
+    async def _run(self, entry: _Entry) -> None:
+        """Run a job in the slot of its pool process.
+
+        The time the job waited is counted for its size class, and the time
+        it ran by function, engine and magnitude of n and how it ended.
+        """
+        job = entry.definition
+        start_time = ms_to_datetime(timestamp_ms())
+        wait = max(0.0, time.time() - job.enqueue_time.timestamp())
+        cls = scheduler.size_class(entry.cost or 0.0).value
+        _count(self._waits[cls], wait)
+        metrics.JOB_WAIT.labels(cls).observe(wait)
+        entry.slot = await self.relay.acquire(entry.job_id)
+        self._publish(entry.job_id, JobStatus.in_progress, 0.0)
+
+        labels = (
+            job.function,
+            job.kwargs.get("engine", ""),
+            metrics.magnitude(job.args[-1]) if isinstance(job.args[-1], int) else "",
+        )
+        start = time.perf_counter()
+        status = "failed"
+        try:
+            result = await self._functions[job.function](
+                _LocalJobContext(self, entry), *job.args, **job.kwargs
+            )
+            status = "complete"
+        except asyncio.CancelledError as error:
+            status = "cancelled"
+            result = error
+        except Exception as error:  # pylint: disable=broad-except
+            logger.exception("%s failed", entry.job_id)
+            result = error
+        finally:
+            metrics.JOB_DURATION.labels(*labels, status).observe(
+                time.perf_counter() - start
+            )
+            self.relay.release(entry.slot)
+        self._finish(entry, status == "complete", result, start_time)
+
+    def _finish(
+        self, entry: _Entry, success: bool, result: Any, start_time: datetime
+    ) -> None:
+        """Complete a job with its result, and keep it within the retention
+        limits."""
+        job = entry.definition
+        entry.definition = JobResult(
+            function=job.function,
+            args=job.args,
+            kwargs=job.kwargs,
+            job_try=job.job_try or 1,
+            enqueue_time=job.enqueue_time,
+            score=None,
+            success=success,
+            result=result,
+            start_time=start_time,
+            finish_time=ms_to_datetime(timestamp_ms()),
+            queue_name=entry.queue_name,
+            job_id=entry.job_id,
+        )
+        entry.done.set()
+        self._pending.pop(entry.job_id, None)
+        if bigint.is_packed(result):
+            entry.ref = result["ref"]
+            self._blob_refs[entry.ref] += 1
+            entry.bytes += result["bytes"]
+        entry.bytes += sum(map(len, self._chunks.get(entry.job_id, {}).values()))
+        entry.bytes += len(self._profiles.get(entry.job_id, ""))
+        self._complete[entry.job_id] = entry
+        self._kept_bytes += entry.bytes
+        if self._listeners:
+            self._publish(entry.job_id, JobStatus.complete)
+        self._retain()
+
+    def _retain(self) -> None:
+        """Delete complete jobs, oldest first, while they exceed the age,
+        count or byte limits."""
+        settings = get_retention_settings()
+        if not settings.enabled:
+            return
+        self._retention["runs"] += 1
+        cutoff = time.time() - settings.max_age
+        while self._complete:
+            entry = next(iter(self._complete.values()))
+            if not (
+                (
+                    settings.max_age >= 0
+                    and entry.definition.enqueue_time.timestamp() < cutoff
+                )
+                or 0 <= settings.max_results < len(self._complete)
+                or 0 <= settings.max_bytes < self._kept_bytes
+            ):
+                break
+            self._delete(entry)
+
+    def _delete(self, entry: _Entry) -> None:
+        """Delete a complete job and what it holds."""
+        del self._jobs[entry.job_id]
+        del self._complete[entry.job_id]
+        self._chunks.pop(entry.job_id, None)
+        self._profiles.pop(entry.job_id, None)
+        # Jobs of the same call share the digits of their large integer.
+        if entry.ref is not None:
+            self._blob_refs[entry.ref] -= 1
+            if not self._blob_refs[entry.ref]:
+                del self._blob_refs[entry.ref]
+                del self._blobs[entry.ref]
+        self._kept_bytes -= entry.bytes
+        self._retention["deleted"] += 1
+        self._retention["reclaimed_bytes"] += entry.bytes
+
+    def _publish(
+        self, job_id: str, status: JobStatus, job_progress: Optional[float] = None
+    ) -> None:
+        """Tell the listeners that the status of a job changed."""
+        update: Dict[str, Any] = {"job_id": job_id, "status": status.value}
+        if job_progress is not None:
+            update["progress"] = job_progress
+        for listener in self._listeners:
+            listener(update)
+
+    async def _relay_progress(self) -> None:
+        """Tell the listeners the progress that changed every `interval`
+        seconds, until cancelled."""
+        while True:
+            await asyncio.sleep(get_progress_settings().interval)
+            for (job_id, job_progress) in self.relay.changed().items():
+                self._publish(job_id, JobStatus.in_progress, job_progress)
+
+    @property
+    def queue(self) -> asyncio.PriorityQueue:
+        """Return the job queue."""
+        if self._queue is None:
+            raise RuntimeError("Fatal: No job queue.")
+        return self._queue
+
+    @property
+    def relay(self) -> ProgressRelay:
+        """Return the progress relay."""
+        if self._relay is None:
+            raise RuntimeError("Fatal: No progress relay.")
+        return self._relay
+
+
+def _count(stats: Dict[str, float], seconds: float) -> None:
+    """Count a duration into the count, total and maximum of `stats`."""
+    stats["count"] = stats.get("count", 0) + 1
+    stats["total_s"] = stats.get("total_s", 0.0) + seconds
+    stats["max_s"] = max(stats.get("max_s", 0.0), seconds)
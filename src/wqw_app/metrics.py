@@ -0,0 +1,383 @@
+"""Metrics module.
+
+Counters, gauges and histograms kept in process memory and rendered in the
+Prometheus text format, by the `/metrics` route of the web app and by an
+exporter in the worker. Updating a metric costs a dict lookup and a few
+additions, so instrumentation stays on in the hot path.
+"""
+import time
+import asyncio
+import logging
+import functools
+from bisect import bisect_left
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from wqw_app.settings import MetricsSettings, get_metrics_settings
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets in seconds of fast operations, e.g. requests and Redis calls.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+# Buckets in seconds of jobs, waiting or running.
+JOB_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+_Func = TypeVar("_Func", bound=Callable[..., Awaitable[Any]])
+
+
+def _escape(value: str) -> str:
+    """Escape a label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Return the label set of a sample, e.g. `{engine="naive"}`."""
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(val)}"' for (name, val) in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+class _Metric:
+    """A named metric with one child per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _child(self) -> Any:
+        """Return a new child."""
+        raise NotImplementedError
+
+    def labels(self, *values: Any) -> Any:
+        """Return the child for the label values, in the order of the names."""
+        key = tuple(str(val) for val in values)
+        child = self._children.get(key)
+        if child is None:
+            assert len(key) == len(self.labelnames)
+            child = self._children[key] = self._child()
+        return child
+
+    def samples(self) -> Iterator[str]:
+        """Yield the sample lines of all children."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Return the metric in the text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    """Value of a counter or gauge."""
+
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Add `amount` to the value."""
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        """Set the value."""
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def _child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Add `amount` to the count of an unlabelled counter."""
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterator[str]:
+        for (values, child) in list(self._children.items()):
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_total{labels} {child.value}"
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, set directly or read on collection."""
+
+    kind = "gauge"
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def _child(self) -> _Value:
+        return _Value()
+
+    def set(self, value: float) -> None:
+        """Set the value of an unlabelled gauge."""
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]):
+        """Read the values by label values from `function` on collection."""
+        self._function = function
+
+    def samples(self) -> Iterator[str]:
+        if self._function is not None:
+            for (values, value) in self._function().items():
+                self.labels(*values).set(value)
+        for (values, child) in list(self._children.items()):
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}{labels} {child.value}"
+
+
+class _Buckets:
+    """Bucket counts and sum of a histogram."""
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Count an observation."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """Distribution of observations, e.g. durations in seconds."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: Optional["Registry"] = None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float) -> None:
+        """Count an observation of an unlabelled histogram."""
+        self.labels().observe(value)
+
+    def samples(self) -> Iterator[str]:
+        for (values, child) in list(self._children.items()):
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames + ("le",),
+                    values + ("+Inf" if bound == float("inf") else repr(bound),),
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {child.sum}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """Metrics of a process."""
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        """Add a metric."""
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Return all metrics in the text format."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# Web app.
+REQUEST_LATENCY = Histogram(
+    "wqw_http_request_duration_seconds",
+    "Seconds until the response starts, by route handler.",
+    ["method", "handler", "status"],
+)
+BACKEND_LATENCY = Histogram(
+    "wqw_backend_call_duration_seconds",
+    "Seconds a Backend call takes.",
+    ["call"],
+)
+COMPUTE_REQUESTS = Counter(
+    "wqw_compute_requests",
+    "Computation requests answered right away (inline) or queued.",
+    ["decision"],
+)
+QUEUE_JOBS = Gauge(
+    "wqw_queue_jobs",
+    "Jobs in a queue, waiting or running.",
+    ["queue"],
+)
+REDIS_ROUND_TRIP = Gauge(
+    "wqw_redis_round_trip_seconds",
+    "Seconds of the last Redis round trip of a metrics collection.",
+)
+
+# Worker.
+JOB_WAIT = Histogram(
+    "wqw_job_wait_seconds",
+    "Seconds from enqueue to start of a job, by size class.",
+    ["size_class"],
+    buckets=JOB_BUCKETS,
+)
+JOB_DURATION = Histogram(
+    "wqw_job_duration_seconds",
+    "Seconds a job runs, by function, engine and order of magnitude of n.",
+    ["function", "engine", "n", "status"],
+    buckets=JOB_BUCKETS,
+)
+JOBS_RUNNING = Gauge("wqw_worker_jobs_running", "Jobs the worker is running.")
+POOL_PROCESSES = Gauge("wqw_worker_pool_processes", "Processes of the worker pool.")
+PROGRESS_WRITES = Counter("wqw_progress_writes", "Progress updates written to Redis.")
+PROGRESS_FLUSH = Histogram(
+    "wqw_progress_flush_duration_seconds",
+    "Seconds a flush of progress updates to Redis takes.",
+)
+ABORT_LATENCY = Histogram(
+    "wqw_abort_latency_seconds",
+    "Seconds from abort of a job until its pool process is free.",
+    buckets=JOB_BUCKETS,
+)
+RETENTION_DELETED = Counter(
+    "wqw_retention_deleted_jobs", "Complete jobs deleted by the compactor."
+)
+RETENTION_RECLAIMED = Counter(
+    "wqw_retention_reclaimed_bytes", "Bytes of Redis values deleted by the compactor."
+)
+
+
+def magnitude(number: int) -> str:
+    """Return the order of magnitude of `number` as a label, e.g. `1e3`."""
+    return f"1e{len(str(abs(number))) - 1}" if number < 10 ** 18 else "1e18+"
+
+
+def timed(histogram: Histogram) -> Callable[[_Func], _Func]:
+    """Observe the seconds of every call of a coroutine function, labelled
+    by its name."""
+
+    def decorator(func: _Func) -> _Func:
+        child = histogram.labels(func.__name__)
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+class MetricsMiddleware:
+    """Observe the latency of every HTTP request, by route handler.
+
+    Latency is the time until the response starts, so that streams count by
+    how fast they start rather than how long they stay open.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def send_timed(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                endpoint = scope.get("endpoint")
+                REQUEST_LATENCY.labels(
+                    scope["method"],
+                    getattr(endpoint, "__name__", "none"),
+                    message["status"],
+                ).observe(time.perf_counter() - start)
+            await send(message)
+
+        await self.app(scope, receive, send_timed)
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer one scrape of the worker exporter."""
+    try:
+        request = await reader.readuntil(b"\r\n\r\n")
+        if request.startswith(b"GET /metrics "):
+            body = REGISTRY.render().encode()
+            head = f"HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\n"
+        else:
+            body = b"Not found\n"
+            head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+        writer.write(
+            f"{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_exporter(
+    settings: Optional[MetricsSettings] = None,
+) -> Optional[asyncio.AbstractServer]:
+    """Serve the metrics of the process on `worker_port`, if enabled."""
+    settings = get_metrics_settings() if settings is None else settings
+    if not settings.enabled or settings.worker_port is None:
+        return None
+    try:
+        return await asyncio.start_server(
+            _serve, host=settings.worker_host, port=settings.worker_port
+        )
+    except OSError:
+        logger.warning("Metrics exporter could not bind to %s", settings.worker_port)
+        return None
@@ -0,0 +1,128 @@
+"""Modular Fibonacci module.
+
+F(n) mod m by fast doubling, reducing every step mod m, so intermediate
+values never exceed m^2 and the cost is O(log n) small multiplications
+whatever the size of F(n). F(n) mod m repeats with the Pisano period
+pi(m), so n is first reduced mod pi(m) where it is cheap to find: then n
+may be given as a decimal string of any length, reduced digit chunk by
+digit chunk without ever building n.
+
+    python -m wqw_app.modular 1000000000000000000000 1000000007
+"""
+import sys
+import math
+import argparse
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Largest modulus whose Pisano period is found, by trial division.
+PISANO_MAX_MODULUS = 10 ** 10
+
+# Decimal digits converted to an integer at a time.
+_DIGITS_CHUNK = 1000
+
+
+def fib_mod_pair(number: int, modulus: int) -> Tuple[int, int]:
+    """Return (F(number), F(number+1)) mod `modulus`, for number >= 0."""
+    f_k, f_k1 = 0, 1 % modulus
+    for shift in reversed(range(number.bit_length())):
+        f_2k = f_k * ((f_k1 << 1) - f_k) % modulus
+        f_2k1 = (f_k * f_k + f_k1 * f_k1) % modulus
+        if (number >> shift) & 1:
+            f_k, f_k1 = f_2k1, (f_2k + f_2k1) % modulus
+        else:
+            f_k, f_k1 = f_2k, f_2k1
+
+    return f_k, f_k1
+
+
+def _factorize(number: int) -> Dict[int, int]:
+    """Return the prime factors of `number` and their multiplicities."""
+    factors: Dict[int, int] = {}
+    for prime in (2, 3):
+        while number % prime == 0:
+            factors[prime] = factors.get(prime, 0) + 1
+            number //= prime
+    divisor = 5
+    while divisor * divisor <= number:
+        for prime in (divisor, divisor + 2):
+            while number % prime == 0:
+                factors[prime] = factors.get(prime, 0) + 1
+                number //= prime
+        divisor += 6
+    if number > 1:
+        factors[number] = factors.get(number, 0) + 1
+    return factors
+
+
+def _prime_period(prime: int) -> int:
+    """Return the Pisano period of a prime.
+
+    It divides prime - 1 if prime is +-1 mod 5, and 2 (prime + 1) if it is
+    +-2 mod 5, so it is that bound with every prime factor divided out that
+    the period allows.
+    """
+    if prime == 2:
+        return 3
+    if prime == 5:
+        return 20
+    period = prime - 1 if prime % 5 in (1, 4) else 2 * (prime + 1)
+    for factor in _factorize(period):
+        while period % factor == 0 and fib_mod_pair(period // factor, prime) == (0, 1):
+            period //= factor
+    return period
+
+
+@lru_cache(maxsize=1024)
+def pisano_period(modulus: int) -> Optional[int]:
+    """Return the Pisano period of `modulus`, or None if it is too large to
+    factorize.
+
+    The period of a prime power p^k is p^(k-1) pi(p), true for every prime
+    this checks, and that of a product is the lcm of those of its factors.
+    """
+    if modulus > PISANO_MAX_MODULUS:
+        return None
+    period = 1
+    for (prime, power) in _factorize(modulus).items():
+        prime_power_period = _prime_period(prime) * prime ** (power - 1)
+        period *= prime_power_period // math.gcd(period, prime_power_period)
+    return period
+
+
+def reduce_decimal(digits: str, modulus: Optional[int] = None) -> int:
+    """Return the integer of a decimal string, mod `modulus` if given.
+
+    The string is read a chunk at a time, so its length is not bound by the
+    limit of `int` on decimal strings.
+    """
+    value = 0
+    for start in range(0, len(digits), _DIGITS_CHUNK):
+        chunk = digits[start : start + _DIGITS_CHUNK]
+        value = value * 10 ** len(chunk) + int(chunk)
+        if modulus is not None:
+            value %= modulus
+    return value
+
+
+def fib_mod(number: str, modulus: int) -> int:
+    """Return F(number) mod `modulus`, for a decimal string `number` >= 0.
+
+    The number is reduced mod the Pisano period of the modulus, if known.
+    """
+    assert modulus > 0 and number.isdigit()
+    return fib_mod_pair(reduce_decimal(number, pisano_period(modulus)), modulus)[0]
+
+
+def main(args: List[str]) -> None:
+    """Print F(n) mod m, e.g. `python -m wqw_app.modular 1000000 1000`."""
+    parser = argparse.ArgumentParser(description="Compute F(n) mod m.")
+    parser.add_argument("number", help="n, as decimal digits")
+    parser.add_argument("modulus", type=int, help="m")
+    parsed = parser.parse_args(args)
+
+    print(fib_mod(parsed.number, parsed.modulus))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,280 @@
+"""Fibonacci pair table module.
+
+A persistent table of pairs (F(k), F(k+1)) at multiples k of a stride, so
+that computations start from the nearest pair instead of from F(1). The
+table is two append-only files in a directory: the pairs, as little-endian
+bytes, and an index of fixed-size records. Pool processes map both files
+read-only, so the pages are shared between them, and append to them under a
+file lock.
+
+Pairs combine by the addition formulas, valid for negative indices too,
+
+    F(a+b) = F(a) * F(b+1) + (F(a+1) - F(a)) * F(b)
+    F(a+b+1) = F(a+1) * F(b+1) + F(a) * F(b)
+
+so F(n) follows from the pair at k and the small pair at n - k.
+
+Inspect or rebuild the table with
+
+    python -m wqw_app.pairs info
+    python -m wqw_app.pairs build 1000000
+"""
+import sys
+import mmap
+import fcntl
+import struct
+import argparse
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from wqw_app.settings import PairSettings, get_pair_settings
+
+Pair = Tuple[int, int]
+
+_MAGIC = b"FIBPAIRS"
+_HEADER = struct.Struct("<8sQ")
+# Index record: k, offset of F(k) in the data file, bytes of F(k) and F(k+1).
+_RECORD = struct.Struct("<QQQQ")
+
+
+def fib_pair(number: int) -> Pair:
+    """Return (F(number), F(number+1)) by fast doubling, for number >= 0."""
+    f_k, f_k1 = 0, 1
+    for shift in reversed(range(number.bit_length())):
+        f_2k = f_k * ((f_k1 << 1) - f_k)
+        f_2k1 = f_k * f_k + f_k1 * f_k1
+        if (number >> shift) & 1:
+            f_k, f_k1 = f_2k1, f_2k + f_2k1
+        else:
+            f_k, f_k1 = f_2k, f_2k1
+
+    return f_k, f_k1
+
+
+def offset_pair(number: int) -> Pair:
+    """Return (F(number), F(number+1)) for any integer, negative included.
+
+    F(-d) = (-1)^(d+1) F(d).
+    """
+    if number >= 0:
+        return fib_pair(number)
+    (f_d, f_d1) = fib_pair(-number)
+    sign = 1 if number % 2 else -1
+    return sign * f_d, -sign * (f_d1 - f_d)
+
+
+def add_pairs(pair_a: Pair, pair_b: Pair) -> Pair:
+    """Return the pair at a + b from the pairs at a and b."""
+    (f_a, f_a1), (f_b, f_b1) = pair_a, pair_b
+    return f_a * f_b1 + (f_a1 - f_a) * f_b, f_a1 * f_b1 + f_a * f_b
+
+
+class PairTable:
+    """Pairs (F(k), F(k+1)) at multiples k of `stride`, kept on disk.
+
+    The table takes at most `max_bytes` of pairs. A table built with another
+    stride is ignored until it is rebuilt.
+    """
+
+    def __init__(self, settings: Optional[PairSettings] = None):
+        self._settings = get_pair_settings() if settings is None else settings
+        self.stride = self._settings.stride
+        directory = Path(self._settings.directory)
+        self.index_path = directory / "pairs.idx"
+        self.data_path = directory / "pairs.dat"
+        self._index_size = -1
+        self._entries: Dict[int, Tuple[int, int, int]] = {}
+        self._keys: List[int] = []
+        self._data: Optional[mmap.mmap] = None
+        # Whether the files, if any, were built with the same stride.
+        self.compatible = True
+
+    def _refresh(self) -> None:
+        """Map the files again if pairs were added since the last look."""
+        try:
+            index_size = self.index_path.stat().st_size
+        except FileNotFoundError:
+            index_size = 0
+        if index_size == self._index_size:
+            return
+
+        entries: Dict[int, Tuple[int, int, int]] = {}
+        data = None
+        self.compatible = True
+        if index_size >= _HEADER.size:
+            with open(self.index_path, "rb") as file:
+                index = file.read(index_size)
+            self.compatible = _HEADER.unpack_from(index) == (_MAGIC, self.stride)
+            count = (index_size - _HEADER.size) // _RECORD.size
+            if self.compatible and count:
+                for (k, offset, size, size1) in _RECORD.iter_unpack(
+                    index[_HEADER.size : _HEADER.size + count * _RECORD.size]
+                ):
+                    entries[k] = (offset, size, size1)
+                with open(self.data_path, "rb") as file:
+                    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._data is not None:
+            self._data.close()
+        self._index_size = index_size
+        self._entries = entries
+        self._keys = sorted(entries)
+        self._data = data
+
+    def __contains__(self, k: int) -> bool:
+        self._refresh()
+        return k in self._entries
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._keys)
+
+    @property
+    def keys(self) -> List[int]:
+        """Return the k of all pairs, in order."""
+        self._refresh()
+        return list(self._keys)
+
+    @property
+    def nbytes(self) -> int:
+        """Return the bytes of all pairs."""
+        self._refresh()
+        return sum(size + size1 for (_, size, size1) in self._entries.values())
+
+    def get(self, k: int) -> Optional[Pair]:
+        """Return the pair at k, if there is one."""
+        self._refresh()
+        if (entry := self._entries.get(k)) is None or self._data is None:
+            return None
+        (offset, size, size1) = entry
+        return (
+            int.from_bytes(self._data[offset : offset + size], "little"),
+            int.from_bytes(self._data[offset + size : offset + size + size1], "little"),
+        )
+
+    def floor(self, number: int) -> Optional[int]:
+        """Return the largest k <= number with a pair."""
+        self._refresh()
+        i = bisect_right(self._keys, number)
+        return self._keys[i - 1] if i else None
+
+    def nearest_key(self, number: int) -> int:
+        """Return the multiple of the stride nearest to `number`, at least one
+        stride."""
+        return max(1, (number + self.stride // 2) // self.stride) * self.stride
+
+    def pair(self, number: int) -> Pair:
+        """Return (F(number), F(number+1)), from the nearest pair if there is
+        one within half a stride, or else by fast doubling."""
+        nearest = self.nearest_key(number)
+        if (
+            abs(number - nearest) <= self.stride // 2
+            and (stored := self.get(nearest)) is not None
+        ):
+            return add_pairs(stored, offset_pair(number - nearest))
+        return fib_pair(number)
+
+    def add(self, k: int, pair: Pair) -> bool:
+        """Append the pair at k, unless it is there or over the size limit.
+
+        Return True if it was added.
+        """
+        assert k > 0 and k % self.stride == 0
+        (f_k, f_k1) = pair
+        blob = f_k.to_bytes((f_k.bit_length() + 7) // 8, "little")
+        blob1 = f_k1.to_bytes((f_k1.bit_length() + 7) // 8, "little")
+
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.index_path, "ab+") as index:
+            fcntl.flock(index, fcntl.LOCK_EX)
+            try:
+                if index.tell() == 0:
+                    index.write(_HEADER.pack(_MAGIC, self.stride))
+                    index.flush()
+                self._refresh()
+                if (
+                    k in self._entries
+                    or not self.compatible
+                    or self.nbytes + len(blob) + len(blob1) > self._settings.max_bytes
+                ):
+                    return False
+                with open(self.data_path, "ab") as data:
+                    offset = data.tell()
+                    data.write(blob + blob1)
+                # Readers only see the pair once its record is complete.
+                index.write(_RECORD.pack(k, offset, len(blob), len(blob1)))
+                index.flush()
+                return True
+            finally:
+                fcntl.flock(index, fcntl.LOCK_UN)
+
+    def clear(self) -> None:
+        """Remove the table."""
+        self.index_path.unlink(missing_ok=True)
+        self.data_path.unlink(missing_ok=True)
+        self._refresh()
+
+
+_table: Optional[PairTable] = None
+
+
+def get_table() -> PairTable:
+    """Return the pair table of the process."""
+    global _table  # pylint: disable=global-statement
+    if _table is None:
+        _table = PairTable()
+    return _table
+
+
+def main(args: List[str]) -> None:
+    """Inspect, build or clear the pair table."""
+    parser = argparse.ArgumentParser(description="Fibonacci pair table.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("info", help="show the size and range of the table")
+    commands.add_parser("verify", help="check every pair by Cassini's identity")
+    build = commands.add_parser("build", help="add all pairs up to a number")
+    build.add_argument("number", type=int)
+    commands.add_parser("clear", help="remove the table")
+    options = parser.parse_args(args)
+
+    table = PairTable()
+    if options.command == "info":
+        keys = table.keys
+        print(f"directory: {table.index_path.parent}")
+        print(f"stride: {table.stride}")
+        print(f"pairs: {len(keys)}")
+        print(f"bytes: {table.nbytes}")
+        if keys:
+            print(f"range: {keys[0]}..{keys[-1]}")
+    elif options.command == "verify":
+        bad = []
+        for k in table.keys:
+            (f_k, f_k1) = table.get(k) or (0, 0)
+            # F(k+1)^2 - F(k+1) F(k) - F(k)^2 = (-1)^k
+            if f_k1 * f_k1 - f_k1 * f_k - f_k * f_k != (-1) ** k:
+                bad.append(k)
+        print(f"{len(table) - len(bad)} good, {len(bad)} bad {bad[:10]}")
+        if bad:
+            sys.exit(1)
+    elif options.command == "build":
+        if not table.compatible:
+            print("Rebuilding a table of another stride")
+            table.clear()
+        step = fib_pair(table.stride)
+        pair = None
+        for k in range(table.stride, options.number + 1, table.stride):
+            if (stored := table.get(k)) is not None:
+                pair = stored
+                continue
+            pair = fib_pair(k) if pair is None else add_pairs(pair, step)
+            if not table.add(k, pair):
+                print(f"Size limit reached at {k}")
+                break
+        print(f"pairs: {len(table)}, bytes: {table.nbytes}")
+    elif options.command == "clear":
+        table.clear()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,230 @@
+"""Parallel big integer multiplication module.
+
+A single huge F(n) by fast doubling is bound by the multiplications of its
+last few doubling steps, each of numbers of millions of digits, on a single
+core. The parallel engine runs the doubling steps in a thread of the
+worker, off its event loop, and spreads their three products over the
+process pool, each split further by one Karatsuba step,
+
+    a * b = z2 * 2^2h + (z1 - z2 - z0) * 2^h + z0
+
+with z0 = a0 * b0, z2 = a1 * b1 and z1 = (a0 + a1) * (b0 + b1) for the
+halves a = a1 * 2^h + a0 and b = b1 * 2^h + b0, until there is a product
+for every process. Three half-size products take as long as the whole one,
+so the work is the same, only spread out. Operands and products pass
+through shared memory as little-endian bytes, instead of being pickled
+through the pipes of the pool. The engine neither saves checkpoints nor
+starts from the pair table, so an interrupted computation starts over.
+
+Every block is unlinked by the worker. Pool processes must share the
+resource tracker of the worker, by being forked after it is started, or
+their own trackers would unlink the blocks they touched again when they
+exit.
+"""
+from concurrent import futures
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, List, Optional, Tuple
+
+from wqw_app.settings import ParallelSettings, get_parallel_settings
+
+
+def multiply_shared(name: str, size_a: int, size_b: int) -> Tuple[str, int]:
+    """Multiply the two numbers in a shared memory block, in a pool process.
+
+    The block holds `size_a` bytes of one and `size_b` bytes of the other,
+    or none for a square. Return the name and size of a new block holding
+    the product, to be unlinked by the caller.
+    """
+    operands = SharedMemory(name)
+    try:
+        a = int.from_bytes(operands.buf[:size_a], "little")
+        b = int.from_bytes(operands.buf[size_a : size_a + size_b], "little")
+    finally:
+        operands.close()
+    product = a * a if size_b == 0 else a * b
+
+    size = (product.bit_length() + 7) // 8
+    result = SharedMemory(create=True, size=size)
+    result.buf[:size] = product.to_bytes(size, "little")
+    result.close()
+    return result.name, size
+
+
+def _read_product(name: str, size: int) -> int:
+    """Read and unlink a block holding a product."""
+    result = SharedMemory(name)
+    try:
+        return int.from_bytes(result.buf[:size], "little")
+    finally:
+        result.close()
+        result.unlink()
+
+
+def _discard_product(future: "futures.Future[Tuple[str, int]]") -> None:
+    """Unlink the product of a multiplication nobody waits for any more."""
+    if not future.cancelled() and future.exception() is None:
+        (name, size) = future.result()
+        _read_product(name, size)
+
+
+class _Product:
+    """A product being computed."""
+
+    def result(self) -> int:
+        """Wait for the product."""
+        raise NotImplementedError
+
+    def discard(self) -> None:
+        """Give up on the product."""
+
+
+class _LocalProduct(_Product):
+    """A product of numbers too small to move to the pool, computed when
+    waited for."""
+
+    def __init__(self, a: int, b: int):
+        (self._a, self._b) = (a, b)
+
+    def result(self) -> int:
+        return self._a * self._b
+
+
+class _PoolProduct(_Product):
+    """A product computed in a pool process, through shared memory."""
+
+    def __init__(self, pool: futures.Executor, a: int, b: int):
+        size_a = (a.bit_length() + 7) // 8
+        size_b = 0 if a is b else (b.bit_length() + 7) // 8
+        self._operands: Optional[SharedMemory] = SharedMemory(
+            create=True, size=size_a + size_b
+        )
+        try:
+            self._operands.buf[:size_a] = a.to_bytes(size_a, "little")
+            if size_b:
+                self._operands.buf[size_a : size_a + size_b] = b.to_bytes(
+                    size_b, "little"
+                )
+            self._future = pool.submit(
+                multiply_shared, self._operands.name, size_a, size_b
+            )
+        except BaseException:
+            self._release()
+            raise
+
+    def _release(self) -> None:
+        """Unlink the block of the operands."""
+        if self._operands is not None:
+            self._operands.close()
+            self._operands.unlink()
+            self._operands = None
+
+    def result(self) -> int:
+        try:
+            (name, size) = self._future.result()
+        finally:
+            self._release()
+        return _read_product(name, size)
+
+    def discard(self) -> None:
+        if self._operands is not None:
+            self._future.add_done_callback(_discard_product)
+            self._release()
+
+
+class _SplitProduct(_Product):
+    """A product recombined from three products of halves, by Karatsuba."""
+
+    def __init__(self, half: int, parts: List[_Product]):
+        self._half = half
+        self._parts = parts
+
+    def result(self) -> int:
+        (z_0, z_1, z_2) = [part.result() for part in self._parts]
+        return (z_2 << (2 * self._half)) + ((z_1 - z_2 - z_0) << self._half) + z_0
+
+    def discard(self) -> None:
+        for part in self._parts:
+            part.discard()
+
+
+class Multiplier:
+    """Multiply non-negative integers across a process pool.
+
+    It blocks while waiting for the pool, so it is meant for a thread.
+    """
+
+    def __init__(
+        self,
+        pool: futures.Executor,
+        processes: int,
+        settings: Optional[ParallelSettings] = None,
+    ):
+        self._pool = pool
+        self._settings = get_parallel_settings() if settings is None else settings
+        # Karatsuba steps until the three products of a doubling step make
+        # one product per process.
+        self.depth = 0
+        while 3 ** (self.depth + 1) < processes:
+            self.depth += 1
+
+    def multiply(self, *pairs: Tuple[int, int]) -> List[int]:
+        """Return the products of pairs of numbers, computed at once, in the
+        pool for those that are large."""
+        products = [self._start(a, b, self.depth) for (a, b) in pairs]
+        try:
+            return [product.result() for product in products]
+        except BaseException:
+            for product in products:
+                product.discard()
+            raise
+
+    def _start(self, a: int, b: int, depth: int) -> _Product:
+        """Start computing a * b."""
+        if min(a.bit_length(), b.bit_length()) < self._settings.min_bits:
+            return _LocalProduct(a, b)
+        if depth == 0:
+            return _PoolProduct(self._pool, a, b)
+
+        square = a is b
+        half = max(a.bit_length(), b.bit_length()) // 2
+        (a_1, a_0) = (a >> half, a & ((1 << half) - 1))
+        (b_1, b_0) = (a_1, a_0) if square else (b >> half, b & ((1 << half) - 1))
+        sum_a = a_0 + a_1
+        sum_b = sum_a if square else b_0 + b_1
+        parts: List[_Product] = []
+        try:
+            for (x, y) in ((a_0, b_0), (sum_a, sum_b), (a_1, b_1)):
+                parts.append(self._start(x, y, depth - 1))
+        except BaseException:
+            for part in parts:
+                part.discard()
+            raise
+        return _SplitProduct(half, parts)
+
+
+def fib_pair(
+    number: int,
+    multiplier: Multiplier,
+    report: Optional[Callable[[float], None]] = None,
+) -> Tuple[int, int]:
+    """Return (F(number), F(number+1)) by fast doubling, with the products of
+    every step computed at once by `multiplier`.
+
+    `report` is called with the progress after every step, and may raise to
+    stop the computation.
+    """
+    f_k, f_k1 = 0, 1
+    bits = number.bit_length()
+    for (step, shift) in enumerate(reversed(range(bits)), start=1):
+        (f_2k, f_k_squared, f_k1_squared) = multiplier.multiply(
+            (f_k, (f_k1 << 1) - f_k), (f_k, f_k), (f_k1, f_k1)
+        )
+        f_2k1 = f_k_squared + f_k1_squared
+        if (number >> shift) & 1:
+            f_k, f_k1 = f_2k1, f_2k + f_2k1
+        else:
+            f_k, f_k1 = f_2k, f_2k1
+        if report is not None:
+            report(step / bits)
+
+    return f_k, f_k1
@@ -0,0 +1,99 @@
+"""Profiling of single jobs.
+
+A profiled computation runs under cProfile and tracemalloc in its pool
+process, and returns a summary of where its time and memory went along with
+its result. Unprofiled computations never touch this module, and the
+profilers are only loaded by the first profiled one.
+"""
+import os
+import time
+from typing import Any, Callable, List, Tuple
+
+from typing_extensions import TypedDict
+
+# Number of functions listed in a summary, by time spent in them.
+TOP_FUNCTIONS = 20
+
+
+class FunctionStats(TypedDict):
+    """Time spent in a function, excluding and including its callees."""
+
+    function: str
+    calls: int
+    self_s: float
+    cumulative_s: float
+
+
+class ProfileSummary(TypedDict, total=False):
+    """Where the time and memory of a profiled job went.
+
+    `wall_s`, `cpu_s` and the memory figures are measured in the pool
+    process. The job adds the seconds it waited in the queue, the seconds
+    lost to pickling and passing the call and its result between processes,
+    and the seconds storing the result took.
+    """
+
+    wall_s: float
+    cpu_s: float
+    peak_bytes: int
+    net_bytes: int
+    functions: List[FunctionStats]
+    wait_s: float
+    transfer_s: float
+    store_s: float
+
+
+def _function_name(key: Tuple[str, int, str]) -> str:
+    """Return a readable name of a profiled function."""
+    (filename, line, name) = key
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def profile_call(
+    func: Callable[..., Any], *args: Any, **kwargs: Any
+) -> Tuple[Any, ProfileSummary]:
+    """Call `func` under the profilers, returning its result and a summary."""
+    # pylint: disable=import-outside-toplevel
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if tracing and hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        # Python 3.8 cannot reset the peak, but a trace started anew has none.
+        tracemalloc.stop()
+        tracemalloc.start()
+    (start_bytes, _) = tracemalloc.get_traced_memory()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+        (end_bytes, peak_bytes) = tracemalloc.get_traced_memory()
+        if not tracing:
+            tracemalloc.stop()
+
+    stats = pstats.Stats(profiler).stats  # type: ignore[attr-defined]
+    top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+    summary = ProfileSummary(
+        wall_s=wall,
+        cpu_s=cpu,
+        peak_bytes=peak_bytes - start_bytes,
+        net_bytes=end_bytes - start_bytes,
+        functions=[
+            FunctionStats(
+                function=_function_name(key),
+                calls=calls,
+                self_s=self_s,
+                cumulative_s=cumulative_s,
+            )
+            for (key, (_, calls, self_s, cumulative_s, _)) in top[:TOP_FUNCTIONS]
+        ],
+    )
+
+    return result, summary
@@ -0,0 +1,164 @@
+"""Progress relay module.
+
+Pool processes write the progress of their computation into a slot of a
+shared array. The worker reads all slots in use on a fixed cadence and
+publishes the changes to Redis in a single pipeline, so the compute path
+does no network I/O. A second shared array holds a flag per slot telling
+the computation to stop.
+"""
+import json
+import time
+import pickle
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from aioredis import Redis
+from arq.jobs import JobStatus
+
+from wqw_app import metrics
+from wqw_app.settings import ProgressSettings, get_progress_settings
+from wqw_app.utils import (
+    track_progress_key_prefix,
+    track_progress_jobs_key,
+    progress_channel,
+)
+
+logger = logging.getLogger(__name__)
+
+# Shared progress slots and abort flags of a pool process, set by
+# `init_process`.
+_slots: Optional[Any] = None
+_aborts: Optional[Any] = None
+
+
+def init_process(slots: Any, aborts: Any) -> None:
+    """Initializer of pool processes, attaching the shared slots."""
+    global _slots, _aborts  # pylint: disable=global-statement
+    _slots = slots
+    _aborts = aborts
+
+
+def report(slot: int, progress: float) -> None:
+    """Write the progress of a computation to its slot."""
+    if _slots is not None:
+        _slots[slot] = progress
+
+
+def aborted(slot: int) -> bool:
+    """Return True if the computation in `slot` is to stop."""
+    return _aborts is not None and _aborts[slot]
+
+
+class ProgressRelay:
+    """Batch-publish progress written to shared memory by pool processes.
+
+    Every running job holds one slot. Each tick, the progress of all jobs
+    that changed since the previous tick is written to their track keys and
+    published on the progress channel in one pipeline. The jobs with a track
+    key are kept in a set, for the compactor to find the keys left behind.
+    """
+
+    def __init__(self, slots: int, settings: Optional[ProgressSettings] = None):
+        # Imported here, so that importing the web app does not load them.
+        # pylint: disable=import-outside-toplevel
+        import ctypes
+        import multiprocessing
+
+        self._settings = get_progress_settings() if settings is None else settings
+        # A lock is not needed since every slot has a single writer.
+        self.slots = multiprocessing.Array(ctypes.c_double, slots, lock=False)
+        self.aborts = multiprocessing.Array(ctypes.c_bool, slots, lock=False)
+        self._free: asyncio.Queue = asyncio.Queue()
+        for slot in range(slots):
+            self._free.put_nowait(slot)
+        self._jobs: Dict[int, str] = {}
+        self._published: Dict[int, float] = {}
+
+    @property
+    def free(self) -> int:
+        """Return the number of free slots."""
+        return self._free.qsize()
+
+    async def acquire(self, job_id: str) -> int:
+        """Return a free slot for the progress of `job_id`."""
+        slot = await self._free.get()
+        self.slots[slot] = 0.0
+        self.aborts[slot] = False
+        self._jobs[slot] = job_id
+        self._published[slot] = 0.0
+        return slot
+
+    def set(self, slot: int, progress: float) -> None:
+        """Set the progress in `slot` from the worker process itself."""
+        self.slots[slot] = progress
+
+    def abort(self, slot: int) -> None:
+        """Tell the computation in `slot` to stop."""
+        self.aborts[slot] = True
+
+    def abort_all(self) -> None:
+        """Tell the computations in all slots to stop."""
+        for slot in range(len(self.aborts)):
+            self.aborts[slot] = True
+
+    def release(self, slot: int) -> None:
+        """Stop relaying the progress in `slot` and free it."""
+        self._jobs.pop(slot, None)
+        self._published.pop(slot, None)
+        self._free.put_nowait(slot)
+
+    def changed(self) -> Dict[str, float]:
+        """Return the progress of the jobs that changed since the last call,
+        by job id, and take it as published."""
+        changed = {}
+        for (slot, job_id) in self._jobs.items():
+            progress = round(self.slots[slot], ndigits=3)
+            if progress != self._published[slot]:
+                self._published[slot] = progress
+                changed[job_id] = progress
+        return changed
+
+    async def flush(self, redis: Redis) -> int:
+        """Publish the progress that changed since the last flush.
+
+        Return the number of jobs updated.
+        """
+        if not (changed := self.changed()):
+            return 0
+
+        start = time.perf_counter()
+        timestamp = datetime.now().astimezone().isoformat()
+        pipe = redis.pipeline()
+        pipe.sadd(track_progress_jobs_key, *changed)
+        for (job_id, progress) in changed.items():
+            pipe.set(
+                f"{track_progress_key_prefix}{job_id}",
+                pickle.dumps(
+                    {"job_id": job_id, "timestamp": timestamp, "progress": progress}
+                ),
+            )
+            pipe.publish(
+                progress_channel,
+                json.dumps(
+                    {
+                        "job_id": job_id,
+                        "status": JobStatus.in_progress.value,
+                        "progress": progress,
+                    }
+                ),
+            )
+        await pipe.execute()
+        metrics.PROGRESS_FLUSH.observe(time.perf_counter() - start)
+        metrics.PROGRESS_WRITES.inc(len(changed))
+        return len(changed)
+
+    async def run(self, redis: Redis) -> None:
+        """Flush progress every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self._settings.interval)
+            try:
+                await self.flush(redis)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to publish job progress")
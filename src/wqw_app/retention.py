@@ -0,0 +1,275 @@
+"""Result retention module.
+
+Complete jobs leave their result, and possibly the digits of a large
+integer, range chunks and a profile, in Redis. The compactor measures every
+complete job once, keeping the sizes in a hash, and deletes complete jobs
+oldest first while they exceed the age, count or byte limits. The index of
+complete jobs is read a batch at a time. The compactor also deletes
+progress keys left behind by jobs that are no longer running.
+"""
+import json
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from typing_extensions import TypedDict
+from aioredis import Redis
+from arq import constants
+from arq.jobs import JobStatus, deserialize_result
+from arq.utils import timestamp_ms
+
+from wqw_app import bigint, metrics
+from wqw_app.index import JobIndex
+from wqw_app.settings import RetentionSettings, get_retention_settings
+from wqw_app.utils import (
+    bigint_key_prefix,
+    cache_key_prefix,
+    profile_key_prefix,
+    range_key_prefix,
+    retention_sizes_key,
+    retention_stats_key,
+    track_progress_key_prefix,
+    track_progress_jobs_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# Delete the digits of a large integer (KEYS[2]) unless the result cache
+# still refers to them (KEYS[1]).
+_DELETE_BLOB_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    return 0
+end
+return redis.call("DEL", KEYS[2])
+"""
+
+
+class RetainedJob(TypedDict):
+    """Keys and bytes a complete job holds."""
+
+    keys: List[str]
+    bytes: int
+    ref: Optional[str]
+    blob_bytes: int
+
+
+def measure(job_id: str, result_raw: bytes, profile_bytes: int) -> RetainedJob:
+    """Return the keys and bytes of a complete job, from its stored result.
+
+    The digits of a large integer are counted, but kept for as long as the
+    result cache refers to them.
+    """
+    keys = [constants.result_key_prefix + job_id, profile_key_prefix + job_id]
+    size = len(result_raw) + profile_bytes
+    (ref, blob_bytes) = (None, 0)
+    try:
+        result: Any = deserialize_result(result_raw).result
+    except Exception:  # pylint: disable=broad-except
+        result = None
+    if bigint.is_packed(result):
+        (ref, blob_bytes) = (result["ref"], result["bytes"])
+        size += blob_bytes
+    elif isinstance(result, dict) and {"chunks", "bytes"} <= set(result):
+        keys.extend(f"{range_key_prefix}{job_id}:{i}" for i in range(result["chunks"]))
+        size += result["bytes"]
+    return RetainedJob(keys=keys, bytes=size, ref=ref, blob_bytes=blob_bytes)
+
+
+class Compactor:
+    """Enforce the retention limits on complete jobs."""
+
+    def __init__(self, redis: Redis, settings: Optional[RetentionSettings] = None):
+        self._redis = redis
+        self._settings = get_retention_settings() if settings is None else settings
+        self._index = JobIndex(redis)
+
+    async def run(self) -> Dict[str, int]:
+        """Delete complete jobs over the limits and stale progress keys.
+
+        Return the number of jobs deleted and found expired, the bytes
+        reclaimed, and the number and bytes of the complete jobs kept.
+        """
+        (kept, kept_bytes, expired) = await self._measure_all()
+        cutoff_ms = timestamp_ms() - 1000 * self._settings.max_age
+        (deleted, reclaimed, skipped) = (0, 0, 0)
+        over = True
+        while over:
+            # Deleted jobs leave the index, jobs completed since they were
+            # measured stay.
+            entries = await self._index.oldest(
+                JobStatus.complete, skipped, self._settings.batch_size
+            )
+            sizes = await self._sizes([job_id for (job_id, _) in entries])
+            batch = []
+            for (job_id, score) in entries:
+                if job_id not in sizes:
+                    skipped += 1
+                    continue
+                if not (
+                    (self._settings.max_age >= 0 and score < cutoff_ms)
+                    or 0 <= self._settings.max_results < kept
+                    or 0 <= self._settings.max_bytes < kept_bytes
+                ):
+                    over = False
+                    break
+                batch.append(job_id)
+                kept -= 1
+                kept_bytes -= sizes[job_id]["bytes"]
+            reclaimed += await self._delete(batch, sizes)
+            deleted += len(batch)
+            if len(entries) < self._settings.batch_size:
+                break
+
+        reclaimed += await self._delete_stale_progress()
+
+        stats = {
+            "deleted": deleted,
+            "expired": expired,
+            "reclaimed_bytes": reclaimed,
+            "kept": kept,
+            "kept_bytes": kept_bytes,
+        }
+        pipe = self._redis.pipeline()
+        pipe.hincrby(retention_stats_key, "runs", 1)
+        for key in ("deleted", "expired", "reclaimed_bytes"):
+            pipe.hincrby(retention_stats_key, key, stats[key])
+        pipe.hmset_dict(
+            retention_stats_key, {"kept": stats["kept"], "kept_bytes": kept_bytes}
+        )
+        await pipe.execute()
+        metrics.RETENTION_DELETED.inc(deleted)
+        metrics.RETENTION_RECLAIMED.inc(reclaimed)
+        if deleted or reclaimed:
+            logger.info("Deleted %d jobs, reclaimed %d bytes", deleted, reclaimed)
+        return stats
+
+    async def _measure_all(self) -> Tuple[int, int, int]:
+        """Measure the complete jobs not seen before, a batch at a time.
+
+        Jobs whose result has expired are dropped from the index. Return the
+        number and bytes of the measured complete jobs, and the number of
+        expired ones.
+        """
+        (count, size, expired) = (0, 0, [])
+        start = 0
+        while entries := await self._index.oldest(
+            JobStatus.complete, start, self._settings.batch_size
+        ):
+            job_ids = [job_id for (job_id, _) in entries]
+            sizes = await self._sizes(job_ids)
+            expired.extend(
+                await self._measure(
+                    [job_id for job_id in job_ids if job_id not in sizes], sizes
+                )
+            )
+            count += len(sizes)
+            size += sum(job["bytes"] for job in sizes.values())
+            start += len(entries)
+        await self._index.remove(*expired)
+        return (count, size, len(expired))
+
+    async def _sizes(self, job_ids: Sequence[str]) -> Dict[str, RetainedJob]:
+        """Return the sizes of the measured jobs among `job_ids`."""
+        if not job_ids:
+            return {}
+        raws = await self._redis.hmget(retention_sizes_key, *job_ids)
+        return {
+            job_id: json.loads(raw)
+            for (job_id, raw) in zip(job_ids, raws)
+            if raw is not None
+        }
+
+    async def _measure(
+        self, job_ids: Sequence[str], sizes: Dict[str, RetainedJob]
+    ) -> List[str]:
+        """Measure complete jobs not seen before into `sizes`.
+
+        Return the jobs whose result has expired.
+        """
+        if not job_ids:
+            return []
+        pipe = self._redis.pipeline()
+        results = [
+            pipe.get(constants.result_key_prefix + job_id, encoding=None)
+            for job_id in job_ids
+        ]
+        profiles = [pipe.strlen(profile_key_prefix + job_id) for job_id in job_ids]
+        await pipe.execute()
+
+        (measured, expired) = ({}, [])
+        for (job_id, result, profile) in zip(job_ids, results, profiles):
+            if (result_raw := await result) is None:
+                expired.append(job_id)
+            else:
+                measured[job_id] = measure(job_id, result_raw, await profile)
+        if measured:
+            sizes.update(measured)
+            await self._redis.hmset_dict(
+                retention_sizes_key,
+                {job_id: json.dumps(job) for (job_id, job) in measured.items()},
+            )
+        return expired
+
+    async def _delete(
+        self, job_ids: Sequence[str], sizes: Dict[str, RetainedJob]
+    ) -> int:
+        """Delete complete jobs and return the bytes reclaimed."""
+        reclaimed = 0
+        for start in range(0, len(job_ids), self._settings.batch_size):
+            batch = job_ids[start : start + self._settings.batch_size]
+            pipe = self._redis.pipeline()
+            blobs = []
+            for job_id in batch:
+                job = sizes[job_id]
+                pipe.delete(*job["keys"])
+                reclaimed += job["bytes"] - job["blob_bytes"]
+                if job["ref"] is not None:
+                    blobs.append(
+                        (
+                            job["blob_bytes"],
+                            pipe.eval(
+                                _DELETE_BLOB_SCRIPT,
+                                keys=[
+                                    cache_key_prefix + job["ref"],
+                                    bigint_key_prefix + job["ref"],
+                                ],
+                            ),
+                        )
+                    )
+            pipe.hdel(retention_sizes_key, *batch)
+            await pipe.execute()
+            for (blob_bytes, blob_deleted) in blobs:
+                if await blob_deleted:
+                    reclaimed += blob_bytes
+            await self._index.remove(*batch)
+        return reclaimed
+
+    async def _delete_stale_progress(self) -> int:
+        """Delete the progress keys of jobs not in progress, returning the
+        bytes reclaimed.
+
+        A progress update flushed while its job finished may outlive the job.
+        The jobs with a progress key are found in the set the relay keeps.
+        """
+        job_ids = await self._redis.smembers(track_progress_jobs_key)
+        if not job_ids:
+            return 0
+        pipe = self._redis.pipeline()
+        running = [
+            pipe.exists(constants.in_progress_key_prefix + job_id) for job_id in job_ids
+        ]
+        lengths = [
+            pipe.strlen(track_progress_key_prefix + job_id) for job_id in job_ids
+        ]
+        await pipe.execute()
+
+        stale = [
+            (job_id, await length)
+            for (job_id, is_running, length) in zip(job_ids, running, lengths)
+            if not await is_running
+        ]
+        if stale:
+            pipe = self._redis.pipeline()
+            pipe.delete(*[track_progress_key_prefix + job_id for (job_id, _) in stale])
+            pipe.srem(track_progress_jobs_key, *[job_id for (job_id, _) in stale])
+            await pipe.execute()
+        return sum(length for (_, length) in stale)
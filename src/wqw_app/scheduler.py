@@ -0,0 +1,221 @@
+"""Size class scheduling module.
+
+Jobs are routed by their estimated cost to a queue per size class, so that
+small jobs never wait behind huge ones. A worker dedicated to a size class
+runs the jobs of its queue directly. A worker serving all size classes runs
+the default arq queue, which its dispatcher fills from the size class queues
+as its slots free up, picking size classes in proportion to their weights.
+"""
+import asyncio
+import logging
+from enum import Enum
+from typing import Callable, List, Optional
+
+from aioredis import Redis
+from arq import constants
+from arq.utils import timestamp_ms
+
+from wqw_app.settings import QueueSettings, get_queue_settings
+from wqw_app.utils import size_class_queue_prefix
+
+logger = logging.getLogger(__name__)
+
+# Move jobs that are due and not running from the size class queues
+# (KEYS[2:]) to the worker queue (KEYS[1]), keeping their score. The worker
+# queue is filled up to ARGV[3] jobs waiting to start. The size class with
+# the lowest pass (ARGV[5:5+n]) goes next, and its pass then advances by its
+# stride (ARGV[5+n:]). With ARGV[4] set, the job with the lowest score goes
+# next instead. Returns the size classes of the moved jobs and the size
+# classes left without jobs, by index.
+_DISPATCH_SCRIPT = """
+local classes = #KEYS - 1
+local free = tonumber(ARGV[3])
+for _, job_id in ipairs(redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])) do
+    if redis.call("EXISTS", ARGV[2] .. job_id) == 0 then
+        free = free - 1
+    end
+end
+
+local passes, offsets, heads, moved, idle = {}, {}, {}, {}, {}
+for i = 1, classes do
+    passes[i] = tonumber(ARGV[4 + i])
+    offsets[i] = 0
+end
+-- The next job of a size class, skipping those run by dedicated workers.
+local function head(i)
+    while true do
+        local entry = redis.call(
+            "ZRANGEBYSCORE", KEYS[i + 1], "-inf", ARGV[1],
+            "WITHSCORES", "LIMIT", offsets[i], 1
+        )
+        if #entry == 0 then
+            return false
+        end
+        if redis.call("EXISTS", ARGV[2] .. entry[1]) == 0 then
+            return entry
+        end
+        offsets[i] = offsets[i] + 1
+    end
+end
+
+while free > 0 do
+    local best = nil
+    for i = 1, classes do
+        if heads[i] == nil then
+            heads[i] = head(i)
+        end
+        if heads[i] and (
+            best == nil
+            or (ARGV[4] == "" and passes[i] < passes[best])
+            or (ARGV[4] ~= "" and tonumber(heads[i][2]) < tonumber(heads[best][2]))
+        ) then
+            best = i
+        end
+    end
+    if best == nil then
+        break
+    end
+    redis.call("ZREM", KEYS[best + 1], heads[best][1])
+    redis.call("ZADD", KEYS[1], heads[best][2], heads[best][1])
+    passes[best] = passes[best] + tonumber(ARGV[4 + classes + best])
+    heads[best] = nil
+    table.insert(moved, best)
+    free = free - 1
+end
+
+for i = 1, classes do
+    if heads[i] == false then
+        table.insert(idle, i)
+    end
+end
+return {moved, idle}
+"""
+
+
+class SizeClass(str, Enum):
+    """Size classes of jobs by estimated cost."""
+
+    small = "small"
+    medium = "medium"
+    large = "large"
+
+
+def size_class(cost: float, settings: Optional[QueueSettings] = None) -> SizeClass:
+    """Return the size class of a job expected to take `cost` seconds."""
+    settings = get_queue_settings() if settings is None else settings
+    if cost <= settings.small_max_cost:
+        return SizeClass.small
+    if cost <= settings.medium_max_cost:
+        return SizeClass.medium
+    return SizeClass.large
+
+
+def class_queue_name(cls: SizeClass) -> str:
+    """Return the queue of a size class."""
+    return size_class_queue_prefix + cls.value
+
+
+# Every queue a job can wait in.
+QUEUE_NAMES = [constants.default_queue_name] + [
+    class_queue_name(cls) for cls in SizeClass
+]
+
+
+def queue_for(cost: Optional[float], settings: Optional[QueueSettings] = None) -> str:
+    """Return the queue of a job expected to take `cost` seconds.
+
+    Jobs without an estimate go to the default queue.
+    """
+    settings = get_queue_settings() if settings is None else settings
+    if cost is None or not settings.size_classes:
+        return constants.default_queue_name
+    return class_queue_name(size_class(cost, settings))
+
+
+def score(
+    enqueue_time_ms: int,
+    cost: Optional[float],
+    settings: Optional[QueueSettings] = None,
+) -> int:
+    """Return the queue score of a job enqueued at `enqueue_time_ms`.
+
+    Shortest first, the score is moved back by up to the aging window, the
+    less the longer the job is expected to take.
+    """
+    settings = get_queue_settings() if settings is None else settings
+    if cost is None or not settings.shortest_first:
+        return enqueue_time_ms
+    return enqueue_time_ms - int(1000 * settings.aging_window / (1 + cost))
+
+
+def worker_queue_name(settings: Optional[QueueSettings] = None) -> str:
+    """Return the queue the worker runs jobs from."""
+    settings = get_queue_settings() if settings is None else settings
+    if settings.worker_class is None:
+        return constants.default_queue_name
+    return class_queue_name(SizeClass(settings.worker_class))
+
+
+class Dispatcher:
+    """Move jobs from the size class queues to the default queue.
+
+    Size classes are picked by stride scheduling: each has a pass that
+    advances by the inverse of its weight for every job moved, and the size
+    class with the lowest pass among those with jobs goes next. A size class
+    without jobs keeps up with the others, so it gets no burst of turns when
+    it has jobs again. Shortest first, the job with the lowest score across
+    size classes goes next instead.
+    """
+
+    def __init__(self, settings: Optional[QueueSettings] = None):
+        self._settings = get_queue_settings() if settings is None else settings
+        self._classes = [
+            cls for cls in SizeClass if self._settings.weights.get(cls.value, 0) > 0
+        ]
+        self._strides = [1 / self._settings.weights[cls.value] for cls in self._classes]
+        self._passes = [0.0] * len(self._classes)
+
+    async def dispatch(self, redis: Redis, free: int) -> List[SizeClass]:
+        """Fill the default queue up to `free` jobs waiting to start.
+
+        Return the size classes of the jobs moved.
+        """
+        if free <= 0 or not self._classes:
+            return []
+
+        (moved, idle) = await redis.eval(
+            _DISPATCH_SCRIPT,
+            keys=[constants.default_queue_name]
+            + [class_queue_name(cls) for cls in self._classes],
+            args=[
+                timestamp_ms(),
+                constants.in_progress_key_prefix,
+                free,
+                "1" if self._settings.shortest_first else "",
+            ]
+            + self._passes
+            + self._strides,
+        )
+        for i in moved:
+            self._passes[i - 1] += self._strides[i - 1]
+        if len(idle) < len(self._classes):
+            floor = min(
+                pass_
+                for (i, pass_) in enumerate(self._passes, start=1)
+                if i not in idle
+            )
+            self._passes = [max(pass_, floor) - floor for pass_ in self._passes]
+
+        return [self._classes[i - 1] for i in moved]
+
+    async def run(self, redis: Redis, free: Callable[[], int]) -> None:
+        """Dispatch every `dispatch_interval` seconds until cancelled.
+
+        `free` returns the number of jobs the worker can start.
+        """
+        while True:
+            await asyncio.sleep(self._settings.dispatch_interval)
+            try:
+                await self.dispatch(redis, free())
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to dispatch jobs")
@@ -1,5 +1,5 @@
 """App settings"""
-from typing import Optional
+from typing import Dict, Optional
 from functools import lru_cache
 
 from pydantic import BaseSettings
@@ -28,3 +28,348 @@ def get_redis_settings(_settings: Optional[_RedisSettings] = None) -> RedisSetti
     if _settings is None:
         return RedisSettings(**_RedisSettings().dict())
     return RedisSettings(**_settings.dict())
+
+
+# pylint: disable=too-few-public-methods
+class CacheSettings(BaseSettings):
+    """Result cache settings."""
+
+    enabled: bool = True
+    ttl: int = 86400
+    max_entries: int = 10000
+    in_flight_ttl: int = 3600
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "cache_"
+
+
+@lru_cache
+def get_cache_settings() -> CacheSettings:
+    """Result cache settings."""
+    return CacheSettings()
+
+
+# pylint: disable=too-few-public-methods
+class StreamSettings(BaseSettings):
+    """Progress streaming settings."""
+
+    # Minimum time between two events of the same stream, in seconds.
+    min_interval: float = 0.5
+    # Time between keepalive comments on an idle stream, in seconds.
+    keepalive: float = 15.0
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "stream_"
+
+
+@lru_cache
+def get_stream_settings() -> StreamSettings:
+    """Progress streaming settings."""
+    return StreamSettings()
+
+
+# pylint: disable=too-few-public-methods
+class ProgressSettings(BaseSettings):
+    """Worker progress relay settings."""
+
+    # Time between two batches of progress updates, in seconds.
+    interval: float = 0.5
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "progress_"
+
+
+@lru_cache
+def get_progress_settings() -> ProgressSettings:
+    """Worker progress relay settings."""
+    return ProgressSettings()
+
+
+# pylint: disable=too-few-public-methods
+class CheckpointSettings(BaseSettings):
+    """Computation checkpoint settings."""
+
+    enabled: bool = True
+    # Directory holding the checkpoints, should outlive worker restarts.
+    directory: str = "checkpoints"
+    # Wall time between two checkpoints of a computation, in seconds.
+    interval: float = 60.0
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "checkpoint_"
+
+
+@lru_cache
+def get_checkpoint_settings() -> CheckpointSettings:
+    """Computation checkpoint settings."""
+    return CheckpointSettings()
+
+
+# pylint: disable=too-few-public-methods
+class ApiSettings(BaseSettings):
+    """JSON API settings."""
+
+    # Maximum number of tasks in one batch submission.
+    max_batch_size: int = 1000
+    # Maximum number of values in one range computation.
+    max_range_size: int = 1_000_000
+    # Number of values computed and stored together in a range computation.
+    range_chunk_size: int = 1000
+    # Number of responses of complete tasks kept encoded, and for how many
+    # seconds, since they no longer change until their result expires.
+    finished_cache_size: int = 10_000
+    finished_cache_ttl: float = 60.0
+    # Tasks estimated to compute in at most this many seconds are computed
+    # by the web app and answered complete, without queueing. Negative for
+    # none.
+    inline_max_cost: float = 1e-4
+    # Maximum number of digits of n in a computation of F(n), or F(n) mod m.
+    max_number_digits: int = 100_000
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "api_"
+
+
+@lru_cache
+def get_api_settings() -> ApiSettings:
+    """JSON API settings."""
+    return ApiSettings()
+
+
+# pylint: disable=too-few-public-methods
+class BigIntSettings(BaseSettings):
+    """Large result storage settings."""
+
+    # Results with more decimal digits are stored apart from the job result.
+    # Below 4300 digits, results can be JSON encoded on Python 3.11 and up.
+    threshold_digits: int = 4000
+    # Number of leading and trailing digits shown with a stored result.
+    preview_digits: int = 20
+    compress: bool = False
+    compress_level: int = 6
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "bigint_"
+
+
+@lru_cache
+def get_bigint_settings() -> BigIntSettings:
+    """Large result storage settings."""
+    return BigIntSettings()
+
+
+# pylint: disable=too-few-public-methods
+class AdmissionSettings(BaseSettings):
+    """Admission control settings.
+
+    A negative limit is not enforced. A job whose estimated cost alone is over
+    a cost limit is refused outright. Any other job is admitted if nothing
+    else is queued.
+    """
+
+    enabled: bool = True
+    # Maximum number of jobs in the queue, deferred and running ones included.
+    max_queue_depth: int = 1000
+    # Maximum estimated seconds of computation queued.
+    max_queued_cost: float = 3600.0
+    # Maximum number of queued jobs and their estimated seconds per client.
+    client_max_jobs: int = 100
+    client_max_cost: float = 600.0
+    # Header identifying a client, e.g. set by a proxy. The client address
+    # is used if unset.
+    client_header: Optional[str] = None
+    # Number of computations running in parallel, to estimate how long the
+    # queue takes to drain. Defaults to the number of CPUs.
+    workers: Optional[int] = None
+    # Longest time in seconds a refused client is told to wait before retrying.
+    max_retry_after: int = 600
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "admission_"
+
+
+@lru_cache
+def get_admission_settings() -> AdmissionSettings:
+    """Admission control settings."""
+    return AdmissionSettings()
+
+
+# pylint: disable=too-few-public-methods
+class QueueSettings(BaseSettings):
+    """Size class queue settings."""
+
+    # Route jobs to a queue per size class by their estimated cost.
+    size_classes: bool = True
+    # Upper bounds of the estimated seconds of small and medium jobs.
+    small_max_cost: float = 1.0
+    medium_max_cost: float = 60.0
+    # Relative share of the jobs started from each size class by workers
+    # serving all of them.
+    weights: Dict[str, float] = {"small": 6.0, "medium": 3.0, "large": 1.0}
+    # Size class served exclusively by the worker, if set.
+    worker_class: Optional[str] = None
+    # Order the jobs of a size class shortest expected first. A job overtakes
+    # others enqueued up to `aging_window` seconds before it, less the longer
+    # it is expected to take, so no job waits forever.
+    shortest_first: bool = False
+    aging_window: float = 60.0
+    # Seconds between moving jobs from the size class queues to the worker.
+    dispatch_interval: float = 0.1
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "queue_"
+
+
+@lru_cache
+def get_queue_settings() -> QueueSettings:
+    """Size class queue settings."""
+    return QueueSettings()
+
+
+# pylint: disable=too-few-public-methods
+class MetricsSettings(BaseSettings):
+    """Metrics settings."""
+
+    # Serve the metrics of the process.
+    enabled: bool = True
+    # Address of the metrics exporter of the worker, disabled if no port.
+    worker_host: str = "0.0.0.0"
+    worker_port: Optional[int] = 9100
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "metrics_"
+
+
+@lru_cache
+def get_metrics_settings() -> MetricsSettings:
+    """Metrics settings."""
+    return MetricsSettings()
+
+
+# pylint: disable=too-few-public-methods
+class RetentionSettings(BaseSettings):
+    """Result retention settings.
+
+    Complete jobs are deleted oldest first while any limit is exceeded. A
+    negative limit is not enforced.
+    """
+
+    enabled: bool = True
+    # Maximum seconds since a complete job was enqueued.
+    max_age: float = 3600.0
+    # Maximum number of complete jobs kept.
+    max_results: int = 100_000
+    # Maximum bytes of results, large integers, range chunks and profiles.
+    max_bytes: int = 256 * 1024 * 1024
+    # Number of jobs measured or deleted per pipeline.
+    batch_size: int = 1000
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "retention_"
+
+
+@lru_cache
+def get_retention_settings() -> RetentionSettings:
+    """Result retention settings."""
+    return RetentionSettings()
+
+
+# pylint: disable=too-few-public-methods
+class PairSettings(BaseSettings):
+    """Fibonacci pair table settings."""
+
+    enabled: bool = True
+    # Directory holding the table, shared by the workers of a host and
+    # outliving their restarts.
+    directory: str = "pairs"
+    # Distance between two numbers with a pair. Pairs are found within half
+    # a stride of any number.
+    stride: int = 10_000
+    # Maximum bytes of pairs kept.
+    max_bytes: int = 256 * 1024 * 1024
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "pairs_"
+
+
+@lru_cache
+def get_pair_settings() -> PairSettings:
+    """Fibonacci pair table settings."""
+    return PairSettings()
+
+
+# pylint: disable=too-few-public-methods
+class ParallelSettings(BaseSettings):
+    """Parallel engine settings."""
+
+    # Products of smaller numbers, in bits, are computed in the worker, since
+    # moving them to a pool process takes longer.
+    min_bits: int = 2 ** 18
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "parallel_"
+
+
+@lru_cache
+def get_parallel_settings() -> ParallelSettings:
+    """Parallel engine settings."""
+    return ParallelSettings()
+
+
+# pylint: disable=too-few-public-methods
+class BackendSettings(BaseSettings):
+    """Backend settings."""
+
+    # Run jobs in the web app itself, in an in-process queue and process
+    # pool, instead of queueing them in Redis for workers. For a single node.
+    local: bool = False
+    # Processes of the pool of the in-process backend, or one per CPU.
+    processes: Optional[int] = None
+
+    class Config:
+        """Additional configuration."""
+
+        env_file: str = ".env"
+        env_prefix: str = "backend_"
+
+
+@lru_cache
+def get_backend_settings() -> BackendSettings:
+    """Backend settings."""
+    return BackendSettings()
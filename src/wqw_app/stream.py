@@ -0,0 +1,167 @@
+"""Progress streaming module."""
+import json
+import asyncio
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import aioredis
+from arq.connections import RedisSettings
+from arq.jobs import JobStatus
+
+from wqw_app.backend import backend, JobResultDict
+from wqw_app.settings import (
+    get_backend_settings,
+    get_redis_settings,
+    get_stream_settings,
+    StreamSettings,
+)
+from wqw_app.utils import progress_channel
+
+FINAL_STATUSES = (JobStatus.complete, JobStatus.not_found)
+
+
+class ProgressBroker:
+    """Fan out job progress published by workers to in-process subscribers.
+
+    The web process holds a single Redis subscription to the progress
+    channel, however many streams are open.
+    """
+
+    def __init__(
+        self,
+        redis_settings: Optional[RedisSettings] = None,
+        settings: Optional[StreamSettings] = None,
+    ):
+        self._redis_settings = (
+            get_redis_settings() if redis_settings is None else redis_settings
+        )
+        self._settings = get_stream_settings() if settings is None else settings
+        self._redis: Optional[aioredis.Redis] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    async def init(self):
+        """Subscribe to the progress channel.
+
+        The in-process backend hands its updates to `publish` itself.
+        """
+        if get_backend_settings().local:
+            backend.add_listener(self.publish)
+            return
+        self._redis = await aioredis.create_redis(
+            (self._redis_settings.host, self._redis_settings.port),
+            db=self._redis_settings.database,
+            password=self._redis_settings.password,
+        )
+        (channel,) = await self._redis.subscribe(progress_channel)
+        self._listener = asyncio.create_task(self._listen(channel))
+
+    async def close(self):
+        """Unsubscribe from the progress channel."""
+        if self._listener is not None:
+            self._listener.cancel()
+        if self._redis is not None:
+            self._redis.close()
+            await self._redis.wait_closed()
+
+    async def _listen(self, channel: aioredis.Channel) -> None:
+        """Hand every published update to the subscribers of its job."""
+        async for message in channel.iter():
+            self.publish(json.loads(message))
+
+    def publish(self, update: Dict[str, Any]) -> None:
+        """Hand an update to the subscribers of its job."""
+        for queue in self._subscribers.get(update["job_id"], ()):
+            queue.put_nowait(update)
+
+    def subscribe(self, job_ids: List[str]) -> asyncio.Queue:
+        """Return a queue receiving the updates of `job_ids`."""
+        queue: asyncio.Queue = asyncio.Queue()
+        for job_id in job_ids:
+            self._subscribers[job_id].add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue, job_ids: List[str]) -> None:
+        """Stop sending the updates of `job_ids` to `queue`."""
+        for job_id in job_ids:
+            self._subscribers[job_id].discard(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    async def watch(self, job_ids: List[str]) -> AsyncIterator[Optional[JobResultDict]]:
+        """Yield job info whenever the status or progress of a job changes.
+
+        The first event of each job and the events of finished jobs carry the
+        full job info; progress events only carry job id, status and progress.
+        Events are at least `min_interval` apart, with updates in between
+        merged. None is yielded as keepalive on an idle stream. The iterator
+        ends once all jobs are finished.
+        """
+        queue = self.subscribe(job_ids)
+        loop = asyncio.get_running_loop()
+        try:
+            sent: Dict[str, Tuple[str, Optional[float]]] = {}
+            changed = {
+                info["job_id"]: info for info in await backend.info_many(job_ids)
+            }
+            finishing: Set[str] = set()
+            while True:
+                for (job_id, info) in changed.items():
+                    state = (info["status"], info.get("progress"))
+                    if sent.get(job_id) != state:
+                        sent[job_id] = state
+                        yield info
+                last_sent = loop.time()
+                if all(status in FINAL_STATUSES for (status, _) in sent.values()):
+                    return
+
+                # Jobs reported as finished may not have their result written
+                # yet, so they are looked up again until they are.
+                changed = {}
+                recheck = set(finishing)
+                timeout = (
+                    self._settings.min_interval
+                    if finishing
+                    else self._settings.keepalive
+                )
+                try:
+                    updates = [await asyncio.wait_for(queue.get(), timeout)]
+                except asyncio.TimeoutError:
+                    updates = []
+                    if not finishing:
+                        yield None
+                        # Catch changes that are never published, e.g. jobs
+                        # aborted before they started.
+                        recheck = {
+                            job_id
+                            for (job_id, (status, _)) in sent.items()
+                            if status not in FINAL_STATUSES
+                        }
+                else:
+                    await asyncio.sleep(
+                        last_sent + self._settings.min_interval - loop.time()
+                    )
+                    while not queue.empty():
+                        updates.append(queue.get_nowait())
+
+                for update in updates:
+                    if sent[update["job_id"]][0] in FINAL_STATUSES:
+                        continue
+                    if update["status"] in FINAL_STATUSES:
+                        finishing.add(update["job_id"])
+                        recheck.add(update["job_id"])
+                    else:
+                        changed[update["job_id"]] = JobResultDict(**update)
+
+                if recheck:
+                    for info in await backend.info_many(list(recheck)):
+                        if info["status"] in FINAL_STATUSES:
+                            finishing.discard(info["job_id"])
+                            changed[info["job_id"]] = info
+                        elif info["job_id"] not in finishing:
+                            changed.setdefault(info["job_id"], info)
+        finally:
+            self.unsubscribe(queue, job_ids)
+
+
+broker = ProgressBroker()
@@ -1,5 +1,31 @@
 """Utility functions."""
-track_progress_key_prefix = "arq:track:"  # pylint: disable=invalid-name
+from typing import Optional
+
+from fastapi import Request
+
+# pylint: disable=invalid-name
+track_progress_key_prefix = "arq:track:"
+track_progress_jobs_key = "arq:track-jobs"
+progress_channel = "arq:progress"
+cache_key_prefix = "arq:cache:"
+cache_index_key = "arq:cache-index"
+cache_stats_key = "arq:cache-stats"
+in_flight_key_prefix = "arq:in-flight:"
+job_index_key = "arq:index"
+job_index_status_key_prefix = "arq:index:"
+range_key_prefix = "arq:range:"
+bigint_key_prefix = "arq:bigint:"
+abort_stats_key = "arq:abort-stats"
+admission_key = "arq:admission"
+admission_clients_key = "arq:admission:clients"
+admission_totals_key = "arq:admission:totals"
+admission_pruned_key = "arq:admission:pruned"
+size_class_queue_prefix = "arq:queue:"
+queue_wait_key_prefix = "arq:queue-wait:"
+profile_key_prefix = "arq:profile:"
+retention_sizes_key = "arq:retention:sizes"
+retention_stats_key = "arq:retention:stats"
+# pylint: enable=invalid-name
 
 
 def removeprefix(str_with_prefix: str, prefix: str) -> str:
@@ -9,3 +35,10 @@ def removeprefix(str_with_prefix: str, prefix: str) -> str:
         if str_with_prefix.startswith(prefix)
         else str_with_prefix
     )
+
+
+def client_id(request: Request, header: Optional[str] = None) -> str:
+    """Return the client of a request, by `header` if set or else by address."""
+    if header is not None and (value := request.headers.get(header)):
+        return value
+    return request.client.host if request.client else ""
@@ -1,18 +1,87 @@
 """
 Worker.
 """
+import os
+import sys
+import zlib
+import json
+import math
+import time
 import asyncio
-import pickle
-import itertools as it
-from typing import Optional, TypedDict, Union, Any, Iterator, Dict, cast
+import logging
+import argparse
+import contextlib
+from enum import Enum
+from typing import (
+    TYPE_CHECKING,
+    Optional,
+    TypedDict,
+    Union,
+    Any,
+    AsyncIterator,
+    Dict,
+    Callable,
+    Tuple,
+    List,
+    cast,
+)
 from concurrent import futures
 from datetime import datetime
 
-import redis
+from arq import cron
 from arq.connections import ArqRedis
-
-from wqw_app.backend import backend
-from wqw_app.settings import get_redis_settings
+from arq.jobs import JobStatus
+
+from wqw_app import (
+    bigint,
+    metrics,
+    modular,
+    pairs,
+    profiling,
+    progress,
+    scheduler,
+)
+from wqw_app.backend import KEEP_RESULT_S
+from wqw_app.bigint import BigIntInfo, to_decimal
+from wqw_app.cache import ResultCache
+from wqw_app.checkpoint import Checkpoint
+from wqw_app.index import JobIndex
+from wqw_app.pairs import fib_pair, Pair
+from wqw_app.progress import ProgressRelay
+from wqw_app.retention import Compactor
+from wqw_app.scheduler import Dispatcher
+from wqw_app.settings import (
+    get_redis_settings,
+    get_cache_settings,
+    get_checkpoint_settings,
+    get_pair_settings,
+    get_queue_settings,
+    get_retention_settings,
+)
+from wqw_app.utils import (
+    track_progress_key_prefix,
+    track_progress_jobs_key,
+    progress_channel,
+    range_key_prefix,
+    bigint_key_prefix,
+    abort_stats_key,
+    queue_wait_key_prefix,
+    profile_key_prefix,
+)
+
+if TYPE_CHECKING:
+    from wqw_app.parallel import Multiplier
+
+logger = logging.getLogger(__name__)
+
+# Count events, e.g. aborted computations, with total and maximum duration.
+_STATS_SCRIPT = """
+redis.call("HINCRBY", KEYS[1], "count", 1)
+redis.call("HINCRBYFLOAT", KEYS[1], "total_s", ARGV[1])
+if tonumber(ARGV[1]) > tonumber(redis.call("HGET", KEYS[1], "max_s") or "0") then
+    redis.call("HSET", KEYS[1], "max_s", ARGV[1])
+end
+"""
 
 PHI = (1 + 5 ** 0.5) / 2
 PSI = (1 - 5 ** 0.5) / 2
@@ -22,38 +91,66 @@ class WorkerContext(TypedDict):
     """Context for workers."""
 
     redis: ArqRedis
-    pool: futures.ProcessPoolExecutor
+    # Quoted, since evaluating it imports concurrent.futures.process and with
+    # it multiprocessing, which the web app, importing this module, does not
+    # load otherwise.
+    pool: "futures.ProcessPoolExecutor"
+    processes: int
+    cache: ResultCache
+    index: JobIndex
+    relay: ProgressRelay
+    relay_task: asyncio.Task
+    dispatcher_task: Optional[asyncio.Task]
+    exporter: Optional[asyncio.AbstractServer]
     job_id: str
     job_try: int
     enqueue_time: datetime
     score: int
 
 
+class Engine(str, Enum):
+    """Algorithms for computing Fibonacci numbers."""
+
+    naive = "naive"
+    iterative = "iterative"
+    fast_doubling = "fast_doubling"
+    matrix = "matrix"
+    parallel = "parallel"
+
+
 class FibonacciTracker:
-    """Class to track progress of calculating n:th Fibonacci number."""
+    """Class to track progress of calculating n:th Fibonacci number.
 
-    def __init__(self, number: int) -> None:
+    The unit of work depends on the engine: recursive calls for the naive
+    engine, additions for the iterative engine and bits of `number` for the
+    fast doubling and matrix engines.
+    """
+
+    def __init__(self, number: int, engine: Engine = Engine.naive) -> None:
         assert number > 0
 
         self.number = number
-        self.max_iter: int = int(binet(number))
-        self.counter: Iterator[int] = it.count(start=2)
+        self.engine = Engine(engine)
+        self.max_iter: int = max_iterations(number, self.engine)
+        self.current_iter: int = 0
         self.progress: float = 0.0
 
-    def __getstate__(self) -> Dict[str, Union[int, float]]:
+    def __getstate__(self) -> Dict[str, Union[str, int, float]]:
         """Called on the pickled state."""
         return {
             "number": self.number,
+            "engine": self.engine.value,
             "max_iter": self.max_iter,
-            "current_iter": next(self.counter) - 1,
+            "current_iter": self.current_iter,
             "progress": self.progress,
         }
 
-    def __setstate__(self, state: Dict[str, Union[int, float]]) -> None:
+    def __setstate__(self, state: Dict[str, Union[str, int, float]]) -> None:
         """Called with the unpickled state."""
         self.number = cast(int, state["number"])
+        self.engine = Engine(state.get("engine", Engine.naive))
         self.max_iter = cast(int, state["max_iter"])
-        self.counter = it.count(start=cast(int, state["current_iter"]))
+        self.current_iter = cast(int, state["current_iter"])
         self.progress = cast(float, state["progress"])
 
     def __repr__(self) -> str:
@@ -63,11 +160,18 @@ class FibonacciTracker:
             f"currently at {self.progress:.1%}>"
         )
 
+    @property
+    def report_every(self) -> int:
+        """Number of iterations between progress reports."""
+        if self.engine is Engine.naive:
+            return 10000
+        return max(1, self.max_iter // 1000)
+
     def countup(self) -> int:
         """Update the counter and return the current iteration number."""
-        current_iter = next(self.counter)
-        self.progress = current_iter / self.max_iter
-        return current_iter
+        self.current_iter += 1
+        self.progress = self.current_iter / self.max_iter
+        return self.current_iter
 
 
 def binet(number: int) -> int:
@@ -75,11 +179,279 @@ def binet(number: int) -> int:
     return int((PHI ** number - PSI ** number) / 5 ** 0.5)
 
 
+def max_iterations(number: int, engine: Engine) -> int:
+    """Number of tracked iterations `engine` needs for the number:th number."""
+    if engine is Engine.naive:
+        # Roughly one call per unit of the result.
+        return max(1, binet(number) - 1)
+    if engine is Engine.iterative:
+        return number
+    return number.bit_length()
+
+
+# Seconds per unit of work of each engine, measured on a single core. The
+# work is binet(n) calls for the naive engine, n² digit operations for the
+# iterative one, and n^1.585 for the Karatsuba-bound doubling engines. The
+# parallel engine does the work of fast doubling, spread over the pool.
+_COST_FACTORS = {
+    Engine.naive: 3.4e-7,
+    Engine.iterative: 1.5e-11,
+    Engine.fast_doubling: 3e-11,
+    Engine.matrix: 7e-11,
+    Engine.parallel: 3e-11,
+}
+
+# Seconds a job takes however small the number, for queueing and results.
+_JOB_OVERHEAD_S = 1e-3
+
+
+def estimate_compute_cost(number: int, engine: Engine) -> float:
+    """Estimated seconds `engine` computes the number:th number in, outside a
+    job.
+
+    The estimate is taken in log space, since the work of numbers beyond
+    about 10^308 overflows a float, and is infinite if the seconds do. It is
+    zero for numbers below one.
+    """
+    if number < 1:
+        return 0.0
+    if engine is Engine.naive:
+        # PHI ** number overflows a float beyond 1474.
+        log_work = min(number, 1400) * math.log(PHI)
+    elif engine is Engine.iterative:
+        log_work = 2 * math.log(number)
+    else:
+        log_work = 1.585 * math.log(number)
+    try:
+        return math.exp(math.log(_COST_FACTORS[engine]) + log_work)
+    except OverflowError:
+        return math.inf
+
+
+def estimate_cost(number: int, engine: Engine) -> float:
+    """Estimated seconds a job computing the number:th number takes."""
+    return _JOB_OVERHEAD_S + estimate_compute_cost(number, engine)
+
+
+def estimate_range_cost(start: int, stop: int) -> float:
+    """Estimated seconds a range computation takes.
+
+    Every value costs an addition and a conversion to decimal, which is
+    bounded by about three multiplications of its size.
+    """
+    per_value = 3 * estimate_compute_cost(stop, Engine.fast_doubling)
+    if math.isinf(per_value):
+        return math.inf
+    return (stop - start + 1) * (_JOB_OVERHEAD_S / 100 + per_value)
+
+
+class ComputationAborted(Exception):
+    """The job of a computation was aborted."""
+
+
+def _check_aborted(ctx: Dict[str, Any]) -> None:
+    """Stop a computation whose job was aborted."""
+    if "slot" in ctx and progress.aborted(ctx["slot"]):
+        raise ComputationAborted()
+
+
+def _report_progress(ctx: Dict[str, Any], tracker: FibonacciTracker) -> None:
+    """Report the progress of a tracked computation."""
+    if "slot" in ctx:
+        progress.report(ctx["slot"], tracker.progress)
+    print(f"{tracker}", end="\r")
+
+
+def _save_checkpoint(
+    ctx: Dict[str, Any], tracker: FibonacciTracker, state: Tuple[int, ...]
+) -> None:
+    """Save the state of a computation if a checkpoint is due."""
+    checkpoint: Optional[Checkpoint] = ctx.get("checkpoint")
+    if checkpoint is not None and checkpoint.due:
+        checkpoint.save(tracker.__getstate__(), state)
+
+
+def _fib_naive(
+    number: int,
+    ctx: Dict[str, Any],
+    tracker: FibonacciTracker,
+    state: Optional[Tuple[int, ...]] = None,  # pylint: disable=unused-argument
+) -> int:
+    """Double recursion, O(phi^n) calls. Cannot be resumed."""
+    if number < 3:
+        return 1
+
+    if tracker.countup() % tracker.report_every == 0:
+        _report_progress(ctx, tracker)
+        _check_aborted(ctx)
+
+    return _fib_naive(number - 1, ctx, tracker) + _fib_naive(number - 2, ctx, tracker)
+
+
+def _iterative_pair(
+    number: int,
+    ctx: Dict[str, Any],
+    tracker: FibonacciTracker,
+    state: Optional[Tuple[int, ...]] = None,
+) -> Pair:
+    """Sum up the sequence, O(n) additions, to (F(n), F(n+1)).
+
+    The state is (F(k), F(k+1)) after k = `tracker.current_iter` additions.
+    """
+    f_k, f_k1 = (0, 1) if state is None else state
+    for _ in range(tracker.current_iter, number):
+        f_k, f_k1 = f_k1, f_k + f_k1
+        _check_aborted(ctx)
+        if tracker.countup() % tracker.report_every == 0:
+            _report_progress(ctx, tracker)
+            _save_checkpoint(ctx, tracker, (f_k, f_k1))
+
+    return f_k, f_k1
+
+
+def _fib_iterative(
+    number: int,
+    ctx: Dict[str, Any],
+    tracker: FibonacciTracker,
+    state: Optional[Tuple[int, ...]] = None,
+) -> int:
+    """Sum up the sequence, O(n) additions."""
+    return _iterative_pair(number, ctx, tracker, state)[0]
+
+
+def _fast_doubling_pair(
+    number: int,
+    ctx: Dict[str, Any],
+    tracker: FibonacciTracker,
+    state: Optional[Tuple[int, ...]] = None,
+) -> Pair:
+    """Fast doubling, O(log n) multiplications, to (F(n), F(n+1)).
+
+    Walks the bits of `number` from the most significant end, keeping
+    (F(k), F(k+1)) for the prefix k seen so far and using
+
+        F(2k) = F(k) * (2 * F(k+1) - F(k))
+        F(2k+1) = F(k)^2 + F(k+1)^2
+
+    The state is (F(k), F(k+1)) after `tracker.current_iter` bits.
+    """
+    f_k, f_k1 = (0, 1) if state is None else state
+    for shift in reversed(range(number.bit_length() - tracker.current_iter)):
+        f_2k = f_k * ((f_k1 << 1) - f_k)
+        f_2k1 = f_k * f_k + f_k1 * f_k1
+        if (number >> shift) & 1:
+            f_k, f_k1 = f_2k1, f_2k + f_2k1
+        else:
+            f_k, f_k1 = f_2k, f_2k1
+        _check_aborted(ctx)
+        if tracker.countup() % tracker.report_every == 0:
+            _report_progress(ctx, tracker)
+            _save_checkpoint(ctx, tracker, (f_k, f_k1))
+
+    return f_k, f_k1
+
+
+def _fib_fast_doubling(
+    number: int,
+    ctx: Dict[str, Any],
+    tracker: FibonacciTracker,
+    state: Optional[Tuple[int, ...]] = None,
+) -> int:
+    """Fast doubling, O(log n) multiplications."""
+    return _fast_doubling_pair(number, ctx, tracker, state)[0]
+
+
+def _fib_matrix(
+    number: int,
+    ctx: Dict[str, Any],
+    tracker: FibonacciTracker,
+    state: Optional[Tuple[int, ...]] = None,
+) -> int:
+    """Binary exponentiation of [[1, 1], [1, 0]], O(log n) multiplications.
+
+    The power [[F(k+1), F(k)], [F(k), F(k-1)]] is symmetric, so only three
+    entries are kept. The state is (F(k+1), F(k), F(k-1)) after
+    `tracker.current_iter` bits.
+    """
+    f_k1, f_k, f_km1 = (1, 0, 1) if state is None else state
+    for shift in reversed(range(number.bit_length() - tracker.current_iter)):
+        f_k1, f_k, f_km1 = (
+            f_k1 * f_k1 + f_k * f_k,
+            f_k * (f_k1 + f_km1),
+            f_k * f_k + f_km1 * f_km1,
+        )
+        if (number >> shift) & 1:
+            f_k1, f_k, f_km1 = f_k1 + f_k, f_k1, f_k
+        _check_aborted(ctx)
+        if tracker.countup() % tracker.report_every == 0:
+            _report_progress(ctx, tracker)
+            _save_checkpoint(ctx, tracker, (f_k1, f_k, f_km1))
+
+    return f_k
+
+
+ENGINES: Dict[Engine, Callable[..., int]] = {
+    Engine.naive: _fib_naive,
+    Engine.iterative: _fib_iterative,
+    Engine.fast_doubling: _fib_fast_doubling,
+    Engine.matrix: _fib_matrix,
+    # Within a single process, the parallel engine is fast doubling.
+    Engine.parallel: _fib_fast_doubling,
+}
+
+# Engines that can continue from a saved state. The parallel engine neither
+# saves checkpoints nor starts from the pair table.
+RESUMABLE_ENGINES = (Engine.iterative, Engine.fast_doubling, Engine.matrix)
+
+
+# Engines that compute the pair (F(n), F(n+1)) on the way, and so can start
+# from and add to the pair table.
+PAIR_ENGINES: Dict[Engine, Callable[..., Pair]] = {
+    Engine.iterative: _iterative_pair,
+    Engine.fast_doubling: _fast_doubling_pair,
+}
+
+
+def _fib_with_pairs(
+    number: int,
+    ctx: Dict[str, Any],
+    tracker: FibonacciTracker,
+    engine: Engine,
+    state: Optional[Tuple[int, ...]] = None,
+) -> int:
+    """Compute the number:th Fibonacci number with the pair table.
+
+    Unless resumed from a checkpoint, the iterative engine starts from the
+    largest pair below `number`, and fast doubling combines the pair within
+    half a stride of `number` with the small pair in between. A pair computed
+    from scratch is moved to the nearest multiple of the stride and added to
+    the table.
+    """
+    table = pairs.get_table()
+    nearest = table.nearest_key(number)
+    near = number >= table.stride // 2
+    if state is None:
+        if engine is Engine.iterative and (k := table.floor(number)) is not None:
+            state = table.get(k)
+            tracker.current_iter = k
+        elif near and (stored := table.get(nearest)) is not None:
+            result = pairs.add_pairs(stored, pairs.offset_pair(number - nearest))[0]
+            tracker.current_iter = tracker.max_iter - 1
+            tracker.countup()
+            _report_progress(ctx, tracker)
+            return result
+
+    pair = PAIR_ENGINES[engine](number, ctx, tracker, state)
+    if near and nearest not in table:
+        table.add(nearest, pairs.add_pairs(pair, pairs.offset_pair(nearest - number)))
+    return pair[0]
+
+
 def fib(
     number: int,
     ctx: Optional[Dict[str, Any]] = None,
     tracker: Optional[FibonacciTracker] = None,
-    redis_client: Optional[redis.Redis] = None,
+    engine: Engine = Engine.fast_doubling,
 ) -> int:
     """Fibonacci example function
 
@@ -87,8 +459,15 @@ def fib(
     ----------
     number : integer
         Compute the number:th Fibonacci number.
+    ctx: Optional[Dict[str, Any]], default=None
+        Context of the computation. Progress is written to the shared
+        progress slot `ctx["slot"]` if present. With a `ctx["checkpoint"]`,
+        the computation resumes from and periodically saves a checkpoint.
+        With `ctx["pairs"]` set, it starts from and adds to the pair table.
     tracker: Optional[FibonacciTracker], default=None
-        Tracker to report progress of the recursive computation.
+        Tracker to report progress of the computation.
+    engine: Engine, default=Engine.fast_doubling
+        Algorithm used for the computation.
 
     Returns
     -------
@@ -96,64 +475,515 @@ def fib(
     """
     assert number > 0
 
+    engine = Engine(engine)
     if ctx is None:
         ctx = {}
     if tracker is None:
-        tracker = FibonacciTracker(number=number)
-    if redis_client is None:
-        redis_client = redis.Redis(
-            host=cast(str, backend.redis_settings.host),
-            port=backend.redis_settings.port,
-            db=backend.redis_settings.database,
+        tracker = FibonacciTracker(number=number, engine=engine)
+
+    state = None
+    checkpoint: Optional[Checkpoint] = ctx.get("checkpoint")
+    if checkpoint is not None and (saved := checkpoint.load()) is not None:
+        tracker_state, state = saved
+        tracker.__setstate__(tracker_state)
+    print(tracker, end="\r")
+
+    if ctx.get("pairs") and engine in PAIR_ENGINES:
+        result = _fib_with_pairs(number, ctx, tracker, engine, state)
+    else:
+        result = ENGINES[engine](number, ctx, tracker, state)
+    if checkpoint is not None:
+        checkpoint.clear()
+    return result
+
+
+async def publish_status(
+    ctx: WorkerContext, status: JobStatus, progress: Optional[float] = None
+) -> None:
+    """Tell progress stream subscribers that the status of a job changed."""
+    update = {"job_id": ctx["job_id"], "status": status.value}
+    if progress is not None:
+        update["progress"] = progress
+    await ctx["redis"].publish(progress_channel, json.dumps(update))
+
+
+@contextlib.asynccontextmanager
+async def _running(
+    ctx: WorkerContext, cache_key: str, cost: float, labels: Tuple[str, str, str]
+) -> AsyncIterator[int]:
+    """Mark a job as in progress while it runs, yielding its progress slot.
+
+    The time the job waited is counted for its size class, on its first try.
+    The time it runs is observed by function, engine and magnitude of n, the
+    `labels`, and how it ended.
+    """
+    if ctx["job_try"] == 1:
+        wait = max(0.0, time.time() - ctx["enqueue_time"].timestamp())
+        cls = scheduler.size_class(cost).value
+        await ctx["redis"].eval(
+            _STATS_SCRIPT, keys=[queue_wait_key_prefix + cls], args=[wait]
+        )
+        metrics.JOB_WAIT.labels(cls).observe(wait)
+    await ctx["index"].move(ctx["job_id"], JobStatus.in_progress)
+    await publish_status(ctx, JobStatus.in_progress, progress=0.0)
+    slot = await ctx["relay"].acquire(ctx["job_id"])
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        yield slot
+        status = "complete"
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        metrics.JOB_DURATION.labels(*labels, status).observe(
+            time.perf_counter() - start
         )
-        print(tracker, end="\r")
+        ctx["relay"].release(slot)
+        pipe = ctx["redis"].pipeline()
+        pipe.delete(track_progress_key_prefix + ctx["job_id"])
+        pipe.srem(track_progress_jobs_key, ctx["job_id"])
+        await pipe.execute()
+        await ctx["cache"].release(cache_key, ctx["job_id"])
+        await ctx["index"].move(ctx["job_id"], JobStatus.complete)
+        await publish_status(ctx, JobStatus.complete)
+
+
+class JobContext:
+    """What the body of a running job needs from where it runs.
+
+    The job holds a progress `slot` of `relay`, computes in `pool` of
+    `processes` processes and stores what it leaves behind next to its
+    result. The arq worker stores in Redis, the in-process backend in memory.
+    """
 
-    if number < 3:
-        return 1
+    def __init__(
+        self,
+        job_id: str,
+        slot: int,
+        pool: "futures.Executor",
+        processes: int,
+        relay: ProgressRelay,
+        enqueue_time: datetime,
+    ):
+        self.job_id = job_id
+        self.slot = slot
+        self.pool = pool
+        self.processes = processes
+        self.relay = relay
+        self.enqueue_time = enqueue_time
+
+    async def store_blob(self, ref: str, blob: bytes) -> None:
+        """Store the binary form of a large result under `ref`."""
+        raise NotImplementedError
+
+    async def store_chunk(self, index: int, blob: bytes) -> None:
+        """Store a chunk of a range computation."""
+        raise NotImplementedError
+
+    async def store_profile(self, summary: str) -> None:
+        """Store the profile summary of the job."""
+        raise NotImplementedError
+
+    async def cache_result(self, key: str, result: Any) -> None:
+        """Keep the result of a call in the result cache, if there is one."""
+
+    async def count_abort(self, latency: float) -> None:
+        """Count the seconds an aborted computation took to stop."""
+        raise NotImplementedError
+
+
+class _WorkerJob(JobContext):
+    """A job run by the arq worker, storing in Redis."""
+
+    def __init__(self, ctx: WorkerContext, slot: int):
+        super().__init__(
+            ctx["job_id"],
+            slot,
+            ctx["pool"],
+            ctx["processes"],
+            ctx["relay"],
+            ctx["enqueue_time"],
+        )
+        self._ctx = ctx
+
+    async def store_blob(self, ref: str, blob: bytes) -> None:
+        # Cached metadata must not outlive the digits it refers to.
+        await self._ctx["redis"].set(
+            bigint_key_prefix + ref,
+            blob,
+            expire=max(KEEP_RESULT_S, get_cache_settings().ttl),
+        )
+
+    async def store_chunk(self, index: int, blob: bytes) -> None:
+        await self._ctx["redis"].set(
+            f"{range_key_prefix}{self.job_id}:{index}", blob, expire=KEEP_RESULT_S
+        )
 
-    if tracker.countup() % 10000 == 0:
-        redis_client.set(
-            f"arq:track:{ctx['job_id']}",
-            pickle.dumps(
-                {
-                    "job_id": ctx["job_id"],
-                    "timestamp": datetime.now().strftime("%c"),
-                    "progress": round(tracker.progress, ndigits=3),
-                }
-            ),
+    async def store_profile(self, summary: str) -> None:
+        await self._ctx["redis"].set(
+            profile_key_prefix + self.job_id, summary, expire=KEEP_RESULT_S
         )
-        print(f"{tracker}", end="\r")
 
-    return fib(number - 1, ctx, tracker, redis_client) + fib(
-        number - 2, ctx, tracker, redis_client
+    async def cache_result(self, key: str, result: Any) -> None:
+        if self._ctx["cache"].enabled:
+            await self._ctx["cache"].set(key, result)
+
+    async def count_abort(self, latency: float) -> None:
+        await self._ctx["redis"].eval(
+            _STATS_SCRIPT, keys=[abort_stats_key], args=[latency]
+        )
+
+
+async def _in_pool(job: JobContext, func: Callable[..., Any], *args: Any) -> Any:
+    """Run `func` in the process pool of `job`.
+
+    If the job is cancelled, e.g. aborted, the computation is told to stop
+    and waited for, so that its pool process is free when the job ends.
+    """
+    return await _until_stopped(
+        job, asyncio.get_running_loop().run_in_executor(job.pool, func, *args)
     )
 
 
-async def async_fib(ctx: WorkerContext, number: int) -> int:
-    """Async wrapper around blocking fib function."""
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(
-        ctx["pool"], fib, number, {"job_id": ctx["job_id"]}
+async def _in_thread(job: JobContext, func: Callable[..., Any], *args: Any) -> Any:
+    """Run `func` in a thread for `job`, like `_in_pool` does in the pool."""
+    return await _until_stopped(
+        job, asyncio.get_running_loop().run_in_executor(None, func, *args)
+    )
+
+
+async def _until_stopped(job: JobContext, future: "asyncio.Future[Any]") -> Any:
+    """Wait for the computation of `job`, and for it to stop if the job is
+    cancelled."""
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        job.relay.abort(job.slot)
+        start = time.monotonic()
+        with contextlib.suppress(Exception):
+            await future
+        latency = time.monotonic() - start
+        logger.info("%s stopped %.3fs after abort", job.job_id, latency)
+        await job.count_abort(latency)
+        metrics.ABORT_LATENCY.observe(latency)
+        raise
+
+
+def fib_packed(
+    number: int, ctx: Dict[str, Any], engine: Engine, ref: str
+) -> Union[int, Tuple[BigIntInfo, bytes]]:
+    """Compute the number:th Fibonacci number, packing it if it is large.
+
+    Large results are returned as metadata and binary form, so that they
+    never have to be pickled or converted to decimal as a whole.
+    """
+    result = fib(number, ctx, engine=engine)
+    if bigint.is_large(result):
+        return bigint.pack(result, ref)
+    return result
+
+
+def fib_parallel_packed(
+    number: int, multiplier: "Multiplier", relay: ProgressRelay, slot: int, ref: str
+) -> Union[int, Tuple[BigIntInfo, bytes]]:
+    """Compute the number:th Fibonacci number with the products spread over
+    the pool by `multiplier`, packing it if it is large.
+
+    It drives the computation from a thread of the worker, reporting the
+    progress to `relay` and stopping after a step once aborted.
+    """
+    # pylint: disable=import-outside-toplevel
+    from wqw_app import parallel
+
+    def report(done: float) -> None:
+        relay.set(slot, done)
+        if relay.aborts[slot]:
+            raise ComputationAborted()
+
+    (result, _) = parallel.fib_pair(number, multiplier, report)
+    if bigint.is_large(result):
+        return bigint.pack(result, ref)
+    return result
+
+
+def fib_cache_key(number: int, engine: str, profile: bool = False) -> str:
+    """Return the result cache key of a call of `async_fib`."""
+    kwargs: Dict[str, Any] = {"engine": engine}
+    if profile:
+        kwargs["profile"] = True
+    return ResultCache.key(async_fib.__name__, (number,), kwargs)
+
+
+async def compute_fib(
+    job: JobContext,
+    number: int,
+    engine: str = Engine.fast_doubling.value,
+    profile: bool = False,
+) -> Union[int, BigIntInfo]:
+    """Compute the number:th Fibonacci number for `job`, the body of
+    `async_fib`."""
+    ref = fib_cache_key(number, engine, profile)
+    fib_ctx: Dict[str, Any] = {"slot": job.slot, "pairs": get_pair_settings().enabled}
+    if get_checkpoint_settings().enabled and Engine(engine) in RESUMABLE_ENGINES:
+        fib_ctx["checkpoint"] = Checkpoint(number, engine)
+    call = (fib_packed, number, fib_ctx, Engine(engine), ref)
+    start = time.perf_counter()
+    if Engine(engine) is Engine.parallel and not profile:
+        # pylint: disable=import-outside-toplevel
+        from wqw_app import parallel
+
+        multiplier = parallel.Multiplier(job.pool, job.processes)
+        result = await _in_thread(
+            job, fib_parallel_packed, number, multiplier, job.relay, job.slot, ref
+        )
+    elif profile:
+        (result, summary) = await _in_pool(job, profiling.profile_call, *call)
+        summary["wait_s"] = max(0.0, time.time() - job.enqueue_time.timestamp())
+        summary["transfer_s"] = time.perf_counter() - start - summary["wall_s"]
+        start = time.perf_counter()
+    else:
+        result = await _in_pool(job, *call)
+    if isinstance(result, tuple):
+        (result, blob) = result
+        await job.store_blob(result["ref"], blob)
+    if profile:
+        summary["store_s"] = time.perf_counter() - start
+        await job.store_profile(json.dumps(summary))
+    else:
+        await job.cache_result(ref, result)
+
+    return result
+
+
+async def async_fib(
+    ctx: WorkerContext,
+    number: int,
+    engine: str = Engine.fast_doubling.value,
+    profile: bool = False,
+) -> Union[int, BigIntInfo]:
+    """Async wrapper around blocking fib function.
+
+    Large results are stored apart, under a key derived from the call, and
+    the job result is their metadata. A job to `profile` runs under the
+    profilers and stores their summary next to its result, bypassing the
+    result cache. The parallel engine spreads the multiplications of the
+    computation over the whole pool, unless profiled, driven from a thread.
+    """
+    cost = estimate_cost(number, Engine(engine))
+    labels = (async_fib.__name__, engine, metrics.magnitude(number))
+    cache_key = fib_cache_key(number, engine, profile)
+    async with _running(ctx, cache_key, cost, labels) as slot:
+        return await compute_fib(_WorkerJob(ctx, slot), number, engine, profile)
+
+
+def fib_range_chunk(
+    first: int, last: int, ctx: Optional[Dict[str, Any]] = None
+) -> bytes:
+    """Compute F(first), ..., F(last) as zlib compressed NDJSON lines.
+
+    The chunk is seeded with (F(first), F(first+1)), from the pair table with
+    `ctx["pairs"]` set or else by fast doubling, and continued by additions.
+    """
+    ctx = {} if ctx is None else ctx
+    f_k, f_k1 = pairs.get_table().pair(first) if ctx.get("pairs") else fib_pair(first)
+    compressor = zlib.compressobj()
+    blob = []
+    for number in range(first, last + 1):
+        _check_aborted(ctx)
+        line = f'{{"n": {number}, "value": {to_decimal(f_k)}}}\n'
+        blob.append(compressor.compress(line.encode()))
+        f_k, f_k1 = f_k1, f_k + f_k1
+    blob.append(compressor.flush())
+
+    return b"".join(blob)
+
+
+async def compute_fib_range(
+    job: JobContext, start: int, stop: int, chunk_size: int = 1000
+) -> Dict[str, int]:
+    """Compute F(start), ..., F(stop) in chunks across the process pool for
+    `job`, the body of `async_fib_range`."""
+    assert 0 < start <= stop and chunk_size > 0
+
+    bounds = [
+        (first, min(first + chunk_size - 1, stop))
+        for first in range(start, stop + 1, chunk_size)
+    ]
+    stored = []
+
+    async def compute(index: int, first: int, last: int) -> None:
+        blob = await _in_pool(
+            job,
+            fib_range_chunk,
+            first,
+            last,
+            {"slot": job.slot, "pairs": get_pair_settings().enabled},
+        )
+        await job.store_chunk(index, blob)
+        stored.append(len(blob))
+        job.relay.set(job.slot, len(stored) / len(bounds))
+
+    await asyncio.gather(*[compute(i, *chunk) for (i, chunk) in enumerate(bounds)])
+
+    return {
+        "start": start,
+        "stop": stop,
+        "chunk_size": chunk_size,
+        "chunks": len(bounds),
+        "bytes": sum(stored),
+    }
+
+
+async def async_fib_range(
+    ctx: WorkerContext, start: int, stop: int, chunk_size: int = 1000
+) -> Dict[str, int]:
+    """Compute F(start), ..., F(stop) in chunks across the process pool.
+
+    Every chunk is stored as soon as it is done, under its index, and the
+    job result only describes the chunks.
+    """
+    cache_key = ResultCache.key(
+        async_fib_range.__name__, (start, stop), {"chunk_size": chunk_size}
     )
+    cost = estimate_range_cost(start, stop)
+    labels = (async_fib_range.__name__, "", metrics.magnitude(stop))
+    async with _running(ctx, cache_key, cost, labels) as slot:
+        return await compute_fib_range(_WorkerJob(ctx, slot), start, stop, chunk_size)
+
+
+async def async_fib_mod(
+    ctx: Union[WorkerContext, JobContext], number: str, modulus: int
+) -> int:
+    """Compute F(number) mod `modulus`, for a number given by its digits.
+
+    It takes milliseconds for moduli up to `modular.PISANO_MAX_MODULUS`, the
+    largest the API accepts, so it runs in the worker, not in the pool. It
+    uses no context, so the in-process backend runs it as is, with a job
+    context.
+    """
+    # pylint: disable=unused-argument
+    return modular.fib_mod(number, modulus)
+
+
+async def compact(ctx: WorkerContext) -> Dict[str, int]:
+    """Enforce the retention limits on complete jobs."""
+    return await Compactor(ctx["redis"]).run()
+
+
+def warm_up() -> None:
+    """Prepare a pool process for its first computation.
+
+    Loads the profilers and maps the pair table, which would otherwise be
+    left to the first job that needs them.
+    """
+    profiling.profile_call(fib_pair, 1000)
+    if get_pair_settings().enabled:
+        pairs.get_table().floor(0)
 
 
 async def startup(ctx: WorkerContext) -> None:
     """Startup logic goes here."""
-    ctx["pool"] = futures.ProcessPoolExecutor()
+    # pylint: disable=import-outside-toplevel
+    from multiprocessing import resource_tracker
+
+    # One progress slot per job the worker can run at a time.
+    ctx["relay"] = ProgressRelay(WorkerSettings.max_jobs)
+    processes = os.cpu_count() or 1
+    # Pool processes share the tracker of the shared memory blocks of the
+    # parallel engine only if forked after it started.
+    resource_tracker.ensure_running()
+    ctx["processes"] = processes
+    ctx["pool"] = futures.ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=progress.init_process,
+        initargs=(ctx["relay"].slots, ctx["relay"].aborts),
+    )
+    # Start the pool processes now rather than with the first job.
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(
+        *[loop.run_in_executor(ctx["pool"], warm_up) for _ in range(processes)]
+    )
+    ctx["relay_task"] = asyncio.create_task(ctx["relay"].run(ctx["redis"]))
+
+    def free() -> int:
+        # Computations beyond the pool size wait in its queue in the order
+        # they came, so jobs are only taken on as pool processes free up.
+        running = WorkerSettings.max_jobs - ctx["relay"].free
+        return min(ctx["relay"].free, processes - running)
+
+    # Workers not dedicated to a size class serve all of them.
+    ctx["dispatcher_task"] = None
+    if get_queue_settings().worker_class is None:
+        ctx["dispatcher_task"] = asyncio.create_task(
+            Dispatcher().run(ctx["redis"], free)
+        )
+    ctx["cache"] = ResultCache(ctx["redis"])
+    ctx["index"] = JobIndex(ctx["redis"])
+
+    metrics.POOL_PROCESSES.set(processes)
+    metrics.JOBS_RUNNING.set_function(
+        lambda: {(): WorkerSettings.max_jobs - ctx["relay"].free}
+    )
+    ctx["exporter"] = await metrics.start_exporter()
 
 
 async def shutdown(ctx: WorkerContext) -> None:
     """Startup logic goes here."""
-    ctx["pool"].shutdown()
+    if ctx["exporter"] is not None:
+        ctx["exporter"].close()
+        await ctx["exporter"].wait_closed()
+    ctx["relay_task"].cancel()
+    if ctx["dispatcher_task"] is not None:
+        ctx["dispatcher_task"].cancel()
+    # Jobs are cancelled by now and resume from their checkpoints when run
+    # again. Computations still running in the pool are told to stop at
+    # their next check, and those not started yet are dropped, from Python
+    # 3.9 on.
+    ctx["relay"].abort_all()
+    if sys.version_info >= (3, 9):
+        ctx["pool"].shutdown(wait=False, cancel_futures=True)
+    else:
+        ctx["pool"].shutdown(wait=False)
 
 
 # pylint: disable=too-few-public-methods
 class WorkerSettings:
     """Settings for the worker."""
 
-    functions = [async_fib]
-    retry_jobs = False
+    functions = [async_fib, async_fib_mod, async_fib_range]
+    # Every minute, by one worker at a time.
+    cron_jobs = (
+        [cron(compact, second=0, run_at_startup=True, unique=True)]
+        if get_retention_settings().enabled
+        else []
+    )
+    # Jobs cancelled by a worker shutdown run again, resuming from their
+    # checkpoint. Aborted jobs are not retried.
+    retry_jobs = True
     redis_settings = get_redis_settings()
     allow_abort_jobs = True
+    max_jobs = 10
+    # The size class queue of a dedicated worker, or else the default queue.
+    queue_name = scheduler.worker_queue_name()
     on_startup = startup
     on_shutdown = shutdown
+
+
+def main(args: List[str]) -> None:
+    """Print the n:th Fibonacci number, e.g. `python -m wqw_app.worker 7`."""
+    parser = argparse.ArgumentParser(description="Compute a Fibonacci number.")
+    parser.add_argument("number", type=int, help="compute the number:th number")
+    parser.add_argument(
+        "--engine",
+        choices=[engine.value for engine in Engine],
+        default=Engine.fast_doubling.value,
+    )
+    parsed = parser.parse_args(args)
+
+    result = fib(parsed.number, engine=Engine(parsed.engine))
+    print(f"The {parsed.number}-th Fibonacci number is {to_decimal(result)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
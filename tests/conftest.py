@@ -1,10 +1,51 @@
 """
-    Dummy conftest.py for wqw_app.
+    Fixtures for wqw_app.
 
-    If you don't know what this is for, just leave it empty.
-    Read more about conftest.py under:
-    - https://docs.pytest.org/en/stable/fixture.html
-    - https://docs.pytest.org/en/stable/writing_plugins.html
+    Tests needing Redis run against a throwaway redis-server started by
+    redislite, so that the Lua scripts run as they do in production. They
+    are skipped if redislite is not installed.
 """
+import socket
+import asyncio
 
-# import pytest
+import pytest
+from arq.connections import create_pool, RedisSettings
+
+
+@pytest.fixture(scope="session")
+def redis_server():
+    """Start a redis-server on a free port for the test session."""
+    redislite = pytest.importorskip("redislite")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = redislite.Redis(serverconfig={"port": str(port)})
+    yield (server, RedisSettings(host="127.0.0.1", port=port))
+    server.shutdown()
+
+
+@pytest.fixture
+def redis_settings(redis_server):
+    """Return the settings of an empty Redis database."""
+    (server, settings) = redis_server
+    server.flushall()
+    return settings
+
+
+@pytest.fixture
+def with_redis(redis_settings):
+    """Return a function running a coroutine function on a connection to an
+    empty Redis database."""
+
+    def run(func):
+        async def main():
+            redis = await create_pool(redis_settings)
+            try:
+                return await func(redis)
+            finally:
+                redis.close()
+                await redis.wait_closed()
+
+        return asyncio.run(main())
+
+    return run
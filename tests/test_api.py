@@ -0,0 +1,500 @@
+import re
+import sys
+import json
+import asyncio
+import importlib
+import subprocess
+from pathlib import Path
+from unittest.mock import ANY
+
+import httpx
+import pytest
+
+from wqw_app import api, bigint, modular
+from wqw_app.backend import backend
+from wqw_app.settings import AdmissionSettings, ApiSettings, StreamSettings
+from wqw_app.stream import broker
+from wqw_app.bigint import to_decimal
+from wqw_app.utils import (
+    bigint_key_prefix,
+    profile_key_prefix,
+    progress_channel,
+    range_key_prefix,
+)
+from wqw_app.worker import fib, fib_range_chunk
+
+__author__ = "Erik G. Brandt"
+__copyright__ = "Erik G. Brandt"
+__license__ = "MIT"
+
+
+@pytest.fixture
+def call_api(redis_settings, tmp_path, monkeypatch):
+    """Return a function running a coroutine function on a client of the web
+    app, whose backend uses an empty Redis database."""
+    # The app serves static files and templates from the working directory.
+    (tmp_path / "static").mkdir()
+    (tmp_path / "templates").symlink_to(Path(__file__).parents[1] / "templates")
+    monkeypatch.chdir(tmp_path)
+    app = importlib.import_module("wqw_app.app").app
+    monkeypatch.setattr(backend, "_redis_settings", redis_settings)
+    monkeypatch.setattr(broker, "_redis_settings", redis_settings)
+    monkeypatch.setattr(api, "finished_responses", api._FinishedResponses())
+
+    def run(func):
+        async def main():
+            await app.router.startup()
+            try:
+                async with httpx.AsyncClient(
+                    app=app, base_url="http://test/api"
+                ) as client:
+                    return await func(client)
+            finally:
+                await app.router.shutdown()
+
+        return asyncio.run(main())
+
+    return run
+
+
+def test_results_by_ids(call_api):
+    """Tasks asked for by id come in the order asked for, within limits."""
+
+    async def check(client):
+        task_ids = [
+            (
+                await client.post(f"/compute/{number}", params={"engine": "naive"})
+            ).json()["task_id"]
+            for number in (30, 31)
+        ]
+        response = await client.get(
+            "/results", params={"ids": [task_ids[1], "missing", task_ids[0]]}
+        )
+        assert [(task["job_id"], task["status"]) for task in response.json()] == [
+            (task_ids[1], "queued"),
+            ("missing", "not_found"),
+            (task_ids[0], "queued"),
+        ]
+
+        response = await client.get(
+            "/results", params={"ids": ["x"] * (api.MAX_RESULTS + 1)}
+        )
+        assert response.status_code == 400
+        response = await client.get("/results", params={"cursor": "not-a-cursor"})
+        assert (response.status_code, response.json()) == (
+            400,
+            {"error": "Invalid cursor."},
+        )
+
+    call_api(check)
+
+
+def test_batch_item_errors(call_api):
+    """Numbers of a batch that cannot be queued get their own error."""
+
+    async def check(client):
+        response = await client.post(
+            "/compute/batch",
+            json={"numbers": [30, 0, 31, 32], "task_ids": [None, None, "t", "t"]},
+        )
+        assert response.status_code == 202
+        tasks = response.json()["tasks"]
+        assert "task_id" in tasks[0] and "submitted_at" in tasks[0]
+        assert tasks[1] == {"number": 0, "error": "Number must be positive."}
+        assert tasks[2]["task_id"] == "t"
+        assert tasks[3]["error"] == "Duplicate task id."
+
+        response = await client.post(
+            "/compute/batch", json={"numbers": [33], "task_ids": ["t"]}
+        )
+        assert response.json()["tasks"][0]["error"] == "Task id already exists."
+        response = await client.post(
+            "/compute/batch", json={"numbers": [1, 2], "task_ids": ["a"]}
+        )
+        assert response.status_code == 400
+
+    call_api(check)
+
+
+def test_not_modified(call_api):
+    """Pollers sending the entity tag back get 304 until the task changes."""
+
+    async def check(client):
+        task_id = (await client.post("/compute/30", params={"engine": "naive"})).json()[
+            "task_id"
+        ]
+        response = await client.get(f"/results/{task_id}")
+        etag = response.headers["etag"]
+        for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+            response = await client.get(
+                f"/results/{task_id}", headers={"If-None-Match": if_none_match}
+            )
+            assert (response.status_code, response.content) == (304, b"")
+            assert response.headers["etag"] == etag
+        response = await client.get(
+            f"/results/{task_id}", headers={"If-None-Match": '"other"'}
+        )
+        assert response.status_code == 200
+
+        # A complete task is answered from its encoded response.
+        await backend.record_job("done", "async_fib", (10,), {}, 55)
+        response = await client.get("/results/done")
+        assert response.json()["result"] == 55
+        assert api.finished_responses.get("done") == (
+            response.content,
+            response.headers["etag"],
+        )
+        response = await client.get(
+            "/results/done", headers={"If-None-Match": response.headers["etag"]}
+        )
+        assert response.status_code == 304
+
+        response = await client.get("/results")
+        response = await client.get(
+            "/results", headers={"If-None-Match": response.headers["etag"]}
+        )
+        assert response.status_code == 304
+
+        # A task deleted by the compactor is no longer answered.
+        await backend.redis_arq.delete("arq:result:done")
+        response = await client.get("/results/done")
+        assert response.json()["status"] == "not_found"
+        assert api.finished_responses.get("done") is None
+
+    call_api(check)
+
+
+def test_inline_tasks(call_api):
+    """Cheap tasks are answered complete, without queueing a job."""
+
+    async def check(client):
+        response = await client.post("/compute/10", params={"task_id": "ten"})
+        assert response.status_code == 200
+        task = response.json()
+        assert (task["job_id"], task["status"], task["result"]) == (
+            "ten",
+            "complete",
+            55,
+        )
+        response = await client.post("/compute/100", params={"mod": 7})
+        assert response.status_code == 200
+        assert response.json()["result"] == 354224848179261915075 % 7
+
+        assert (await client.get("/results/ten")).json()["result"] == 55
+        queues = await backend.queue_stats()
+        assert all(queue["queued"] == 0 for queue in queues.values())
+
+        # A task too costly for the request is queued as usual.
+        response = await client.post("/compute/30", params={"engine": "naive"})
+        assert response.status_code == 202
+
+    call_api(check)
+
+
+def test_range_values(call_api, monkeypatch):
+    """Values of a range task are sent chunk by chunk as they are stored, and
+    only for range tasks."""
+    monkeypatch.setattr(
+        api, "get_api_settings", lambda: ApiSettings(range_chunk_size=10)
+    )
+
+    async def check(client):
+        assert (await client.get("/results/missing/values")).status_code == 404
+        await backend.record_job("done", "async_fib", (10,), {}, 55)
+        assert (await client.get("/results/done/values")).status_code == 404
+
+        task_id = (
+            await client.post("/compute/range", params={"start": 1, "stop": 25})
+        ).json()["task_id"]
+        values = asyncio.create_task(client.get(f"/results/{task_id}/values"))
+        while task_id not in broker._subscribers:
+            await asyncio.sleep(0.01)
+        for (index, (first, last)) in enumerate([(1, 10), (11, 20), (21, 25)]):
+            await backend.redis_arq.set(
+                f"{range_key_prefix}{task_id}:{index}", fib_range_chunk(first, last)
+            )
+            await backend.redis_arq.publish(
+                progress_channel,
+                json.dumps(
+                    {"job_id": task_id, "status": "in_progress", "progress": last / 25}
+                ),
+            )
+        response = await asyncio.wait_for(values, 5)
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["n"] for line in lines] == list(range(1, 26))
+        assert lines[-1]["value"] == 75025
+
+        # A task that finished without storing its chunks ends the download.
+        await backend.record_job(
+            "empty", "async_fib_range", (1, 25), {"chunk_size": 10}, {}
+        )
+        response = await client.get("/results/empty/values")
+        assert (response.status_code, response.content) == (200, b"")
+
+    call_api(check)
+
+
+def test_digits(call_api):
+    """Digits of a complete result are sent in base 10 or 16, small results
+    and large ones stored apart alike."""
+
+    async def check(client):
+        assert (await client.get("/results/missing/digits")).status_code == 404
+        task_id = (await client.post("/compute/30", params={"engine": "naive"})).json()[
+            "task_id"
+        ]
+        assert (await client.get(f"/results/{task_id}/digits")).status_code == 404
+        response = await client.get(f"/results/{task_id}/digits", params={"base": 8})
+        assert response.status_code == 400
+
+        await backend.record_job("small", "async_fib", (10,), {}, 55)
+        response = await client.get("/results/small/digits")
+        assert (response.headers["content-type"], response.text) == (
+            "text/plain; charset=utf-8",
+            "55",
+        )
+        response = await client.get("/results/small/digits", params={"base": 16})
+        assert response.text == "37"
+
+        value = fib(100_000)
+        (info, blob) = bigint.pack(value, "ref")
+        await backend.record_job("large", "async_fib", (100_000,), {}, info)
+        assert (await client.get("/results/large/digits")).status_code == 404
+        await backend.redis_arq.set(bigint_key_prefix + "ref", blob)
+        response = await client.get("/results/large/digits")
+        assert response.text == to_decimal(value)
+        response = await client.get("/results/large/digits", params={"base": 16})
+        assert response.text == f"{value:x}"
+
+    call_api(check)
+
+
+def test_profile(call_api):
+    """A profiled task links to its profile summary, there once it is done."""
+
+    async def check(client):
+        response = await client.post("/compute/10", params={"profile": True})
+        assert response.status_code == 202
+        task_id = response.json()["task_id"]
+        task = (await client.get(f"/results/{task_id}")).json()
+        assert task["profile_url"] == f"/api/results/{task_id}/profile"
+        profile_url = "http://test" + task["profile_url"]
+        response = await client.get(profile_url)
+        assert (response.status_code, response.json()) == (
+            404,
+            {"error": "No such profile."},
+        )
+
+        summary = {"wall_s": 0.5, "cpu_s": 0.4, "peak_bytes": 1024}
+        await backend.redis_arq.set(profile_key_prefix + task_id, json.dumps(summary))
+        response = await client.get(profile_url)
+        assert (response.status_code, response.json()) == (200, summary)
+
+        # Tasks computed without the profilers have no profile.
+        response = await client.post("/compute/10", params={"task_id": "plain"})
+        assert "profile_url" not in (await client.get("/results/plain")).json()
+        assert (await client.get("/results/plain/profile")).status_code == 404
+
+    call_api(check)
+
+
+def test_mod_limit(call_api):
+    """Moduli beyond those with a known Pisano period are refused."""
+
+    async def check(client):
+        response = await client.post(
+            "/compute/1" + "0" * 1000, params={"mod": modular.PISANO_MAX_MODULUS}
+        )
+        assert response.status_code == 200
+        response = await client.post(
+            "/compute/10", params={"mod": modular.PISANO_MAX_MODULUS + 1}
+        )
+        assert response.status_code == 422
+
+    call_api(check)
+
+
+def test_huge_numbers(call_api):
+    """Numbers whose cost overflows a float are refused as too costly, unless
+    computed modulo a number."""
+
+    async def check(client):
+        number = "1" + "0" * 400
+        response = await client.post(f"/compute/{number}")
+        assert response.status_code == 400
+        assert "error" in response.json()
+        response = await client.post(f"/compute/{number}", params={"mod": 10})
+        assert response.status_code == 200
+        assert response.json()["result"] == modular.fib_mod(number, 10)
+
+        response = await client.post(
+            "/compute/range", params={"start": 1, "stop": number}
+        )
+        assert response.status_code == 400
+
+    call_api(check)
+
+
+def test_frontend_add_refuses_non_positive(call_api):
+    """The page gets an error component for numbers below one, unqueued."""
+
+    async def check(client):
+        for number in ("-5", "0"):
+            response = await client.post(
+                "http://test/frontend/add", data={"number": number}
+            )
+            assert response.status_code == 200
+            assert "number must be positive" in response.text
+        queues = await backend.queue_stats()
+        assert all(queue["queued"] == 0 for queue in queues.values())
+
+    call_api(check)
+
+
+def test_frontend_add(call_api, monkeypatch):
+    """The page gets the components of an added task as it progresses, and
+    an error component for a task over an admission limit."""
+    monkeypatch.setattr(
+        backend, "_admission_settings", AdmissionSettings(client_max_jobs=1)
+    )
+
+    async def check(client):
+        response = await client.post("http://test/frontend/add", data={"number": 30})
+        assert response.status_code == 200
+        assert 'hx-post="/frontend/add"' in response.text
+        task_id = re.search(r'id="task-(\w+)"', response.text).group(1)
+        assert (await backend.info(task_id))["args"] == (30,)
+
+        response = await client.get(f"http://test/frontend/status/{task_id}")
+        assert f'hx-sse="connect:/frontend/stream/{task_id}"' in response.text
+        await backend.redis_arq.delete(f"arq:job:{task_id}")
+        await backend.record_job(task_id, "async_fib", (30,), {}, 832040)
+        response = await client.get(f"http://test/frontend/status/{task_id}")
+        assert "<strong>832040</strong>" in response.text
+        response = await client.get("http://test/frontend/status/missing")
+        assert "not found" in response.text
+
+        # The client already has a queued task.
+        await client.post("http://test/frontend/add", data={"number": 31})
+        response = await client.post("http://test/frontend/add", data={"number": 32})
+        assert re.search(r"queue is full, retry in \d+ s", response.text)
+        response = await client.post(
+            "http://test/frontend/add", data={"number": 10 ** 9}
+        )
+        assert "too costly to compute" in response.text
+
+    call_api(check)
+
+
+def _sse_events(body: bytes):
+    """Return the (event, data) pairs of a server-sent events body."""
+    events = []
+    for block in body.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_stream_fan_out(call_api, monkeypatch):
+    """Watchers of a task share one subscription, and get its progress and
+    completion in order, even after another watcher left."""
+    monkeypatch.setattr(broker, "_settings", StreamSettings(min_interval=0.01))
+    app = importlib.import_module("wqw_app.app").app
+
+    async def watch_until(task_id, received, leave):
+        """Watch a task on a raw connection, setting `received` on the first
+        event, closed once `leave` is set."""
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": f"/api/stream/{task_id}",
+            "raw_path": f"/api/stream/{task_id}".encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"test")],
+            "client": ("127.0.0.1", 1234),
+            "server": ("test", 80),
+        }
+        bodies = []
+
+        async def receive():
+            await leave.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                bodies.append(message["body"])
+                received.set()
+
+        await app(scope, receive, send)
+        return b"".join(bodies)
+
+    async def check(client):
+        task_id = (await client.post("/compute/30", params={"engine": "naive"})).json()[
+            "task_id"
+        ]
+        (received, leave) = (asyncio.Event(), asyncio.Event())
+        staying = asyncio.create_task(client.get(f"/stream/{task_id}"))
+        leaving = asyncio.create_task(watch_until(task_id, received, leave))
+        while len(broker._subscribers.get(task_id, ())) < 2:
+            await asyncio.sleep(0.01)
+        assert await backend.redis_arq.pubsub_numsub(progress_channel) == {
+            progress_channel: 1
+        }
+
+        # The watcher leaving unsubscribes, the other one keeps watching.
+        await asyncio.wait_for(received.wait(), 5)
+        leave.set()
+        assert _sse_events(await asyncio.wait_for(leaving, 5)) == [("queued", ANY)]
+        assert len(broker._subscribers[task_id]) == 1
+
+        for progress in (0.25, 0.5):
+            await backend.redis_arq.publish(
+                progress_channel,
+                json.dumps(
+                    {"job_id": task_id, "status": "in_progress", "progress": progress}
+                ),
+            )
+            await asyncio.sleep(0.05)
+        await backend.redis_arq.delete(f"arq:job:{task_id}")
+        await backend.record_job(task_id, "async_fib", (30,), {}, 832040)
+        await backend.redis_arq.publish(
+            progress_channel, json.dumps({"job_id": task_id, "status": "complete"})
+        )
+
+        response = await asyncio.wait_for(staying, 5)
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _sse_events(response.content)
+        assert [(event, data.get("progress")) for (event, data) in events] == [
+            ("queued", None),
+            ("in_progress", 0.25),
+            ("in_progress", 0.5),
+            ("complete", None),
+        ]
+        assert events[-1][1]["result"] == 832040
+        assert task_id not in broker._subscribers
+
+    call_api(check)
+
+
+def test_app_import_is_light(tmp_path):
+    """The web app does not load multiprocessing, used by workers only, nor
+    Jinja, until a page is rendered."""
+    (tmp_path / "static").mkdir()
+    code = (
+        "import sys, wqw_app.app; "
+        "print('multiprocessing' in sys.modules or 'jinja2' in sys.modules)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.strip() == "False"
@@ -0,0 +1,221 @@
+import asyncio
+
+import pytest
+from arq import constants
+from arq.jobs import JobStatus
+
+from wqw_app.backend import Backend, AdmissionRejected
+from wqw_app.cache import ResultCache
+from wqw_app.index import JobIndex
+from wqw_app.settings import AdmissionSettings, CacheSettings
+from wqw_app.utils import admission_pruned_key, admission_totals_key
+from wqw_app.worker import async_fib
+
+__author__ = "Erik G. Brandt"
+__copyright__ = "Erik G. Brandt"
+__license__ = "MIT"
+
+
+def run_backend(redis_settings, func, **kwargs):
+    """Run a coroutine function on a Backend connected to Redis."""
+
+    async def main():
+        backend = Backend(redis_settings, **kwargs)
+        await backend.init()
+        try:
+            return await func(backend)
+        finally:
+            await backend.close()
+
+    return asyncio.run(main())
+
+
+def test_cache_hit_on_resubmit(redis_settings):
+    """A call computed before is answered with a new, complete job."""
+
+    async def check(backend):
+        job = await backend.enqueue_job(async_fib, 10, engine="iterative")
+        key = backend.cache.key("async_fib", (10,), {"engine": "iterative"})
+        await backend.cache.set(key, 55)
+        await backend.cache.release(key, job.job_id)
+
+        again = await backend.enqueue_job(async_fib, 10, engine="iterative")
+        assert again.job_id != job.job_id
+        info = await backend.info(again.job_id)
+        assert (info["status"], info["result"]) == (JobStatus.complete, 55)
+        assert (await backend.cache_stats())["hits"] == 1
+
+    run_backend(redis_settings, check)
+
+
+def test_cache_coalesces_in_flight(redis_settings):
+    """Identical calls submitted together share the job in flight."""
+
+    async def check(backend):
+        jobs = await asyncio.gather(
+            *[backend.enqueue_job(async_fib, 11, engine="iterative") for _ in range(3)]
+        )
+        assert len({job.job_id for job in jobs}) == 1
+
+        batch = await backend.enqueue_jobs(
+            async_fib, [((12,), {"engine": "iterative"})] * 2 + [((11,), {})]
+        )
+        assert batch[0].job_id == batch[1].job_id != batch[2].job_id
+        # An explicit job id is never attached to another job.
+        own = await backend.enqueue_job(async_fib, 11, engine="iterative", _job_id="x")
+        assert own.job_id == "x"
+
+    run_backend(redis_settings, check)
+
+
+def test_cache_release_by_owner(with_redis):
+    """Only the job holding the in-flight marker releases it."""
+
+    async def check(redis):
+        cache = ResultCache(redis)
+        assert await cache.claim("call", "a") is None
+        assert await cache.claim("call", "b") == "a"
+        await cache.release("call", "b")
+        assert await cache.claim_many(["call", "other"], ["c", "c"]) == ["a", None]
+        await cache.release("call", "a")
+        assert await cache.claim("call", "b") is None
+
+    with_redis(check)
+
+
+def test_cache_eviction(with_redis):
+    """The oldest entries are evicted beyond `max_entries`."""
+
+    async def check(redis):
+        cache = ResultCache(redis, CacheSettings(max_entries=2))
+        for (i, key) in enumerate(("a", "b", "c")):
+            await cache.set(key, i)
+        assert await cache.get_many(["a", "b", "c"]) == [
+            (False, None),
+            (True, 1),
+            (True, 2),
+        ]
+        assert (await cache.stats())["entries"] == 2
+
+    with_redis(check)
+
+
+def test_index_pages_ties(with_redis):
+    """Pages of jobs with equal enqueue times neither skip nor repeat jobs."""
+
+    async def check(redis):
+        index = JobIndex(redis)
+        await index.add_many(
+            [(f"job{i}", 1000 if i < 5 else 2000) for i in range(7)], JobStatus.queued
+        )
+        (seen, cursor) = await index.page(limit=3)
+        while cursor is not None:
+            (page, cursor) = await index.page(cursor=cursor, limit=3)
+            seen.extend(page)
+        assert seen == ["job6", "job5", "job4", "job3", "job2", "job1", "job0"]
+
+    with_redis(check)
+
+
+def test_index_move(with_redis):
+    """A job moves across the status indexes and keeps its enqueue time."""
+
+    async def check(redis):
+        index = JobIndex(redis)
+        await index.add("a", 1000, JobStatus.queued)
+        await index.add("b", 2000, JobStatus.queued)
+        await index.move("a", JobStatus.in_progress)
+        assert (await index.page(JobStatus.queued))[0] == ["b"]
+        assert (await index.page(JobStatus.in_progress))[0] == ["a"]
+        await index.move("a", JobStatus.complete)
+        await index.move("b", JobStatus.deferred)
+        assert await index.oldest(JobStatus.complete) == [("a", 1000)]
+        assert (await index.page(JobStatus.in_progress))[0] == []
+        assert (await index.page(JobStatus.queued))[0] == ["b"]
+        # Jobs no longer indexed are not added back.
+        await index.remove("a")
+        await index.move("a", JobStatus.queued)
+        assert (await index.page())[0] == ["b"]
+
+    with_redis(check)
+
+
+def admission(**limits):
+    """Return admission settings with no limits but `limits`."""
+    return AdmissionSettings(
+        **{
+            "max_queue_depth": -1,
+            "max_queued_cost": -1,
+            "client_max_jobs": -1,
+            "client_max_cost": -1,
+            "workers": 1,
+            **limits,
+        }
+    )
+
+
+def test_admission_rejects(redis_settings):
+    """Jobs over a limit are refused, and told to retry when it has room."""
+
+    async def check(backend):
+        await backend.enqueue_job(async_fib, 1, _cost=6.0)
+        with pytest.raises(AdmissionRejected) as error:
+            await backend.enqueue_job(async_fib, 2, _cost=6.0)
+        assert (error.value.limit, error.value.retry_after) == ("queued_cost", 2)
+        # A job over a limit on its own is never admitted.
+        with pytest.raises(AdmissionRejected) as error:
+            await backend.enqueue_job(async_fib, 3, _cost=1e202)
+        assert (error.value.limit, error.value.retry_after) == ("job_cost", None)
+        (job,) = await backend.enqueue_jobs(async_fib, [((4,), {})], costs=[11.0])
+        assert job.limit == "job_cost"
+
+        await backend.enqueue_job(async_fib, 5, _cost=1.0, _client="c")
+        with pytest.raises(AdmissionRejected) as error:
+            await backend.enqueue_job(async_fib, 6, _cost=1.0, _client="c")
+        assert (error.value.limit, error.value.retry_after) == ("client_jobs", 1)
+        jobs = await backend.enqueue_jobs(
+            async_fib, [((7,), {}), ((8,), {})], costs=[1.0, 1.0], client="d"
+        )
+        assert isinstance(jobs[1], AdmissionRejected)
+
+    run_backend(
+        redis_settings,
+        check,
+        admission_settings=admission(max_queued_cost=10.0, client_max_jobs=1),
+    )
+
+
+def test_admission_retry_after_bounded(redis_settings):
+    """The time to retry is bounded, however costly the queued jobs are."""
+
+    async def check(backend):
+        await backend.enqueue_job(async_fib, 1, _cost=1e202)
+        totals = await backend.redis_arq.hgetall(admission_totals_key)
+        assert float(totals["cost"]) == 1e9
+        with pytest.raises(AdmissionRejected) as error:
+            await backend.enqueue_job(async_fib, 2, _cost=1.0)
+        assert (error.value.limit, error.value.retry_after) == ("queue_depth", 600)
+
+    run_backend(redis_settings, check, admission_settings=admission(max_queue_depth=1))
+
+
+def test_admission_prunes(redis_settings):
+    """The cost of jobs that are gone no longer counts against the limits."""
+
+    async def check(backend):
+        job = await backend.enqueue_job(async_fib, 1, _cost=6.0, _client="c")
+        await backend.enqueue_job(async_fib, 2, _cost=2.0, _client="c")
+        await backend.redis_arq.delete(
+            constants.job_key_prefix + job.job_id, admission_pruned_key
+        )
+        await backend.enqueue_job(async_fib, 3, _cost=6.0, _client="c")
+        totals = await backend.redis_arq.hgetall(admission_totals_key)
+        assert {key: float(val) for (key, val) in totals.items()} == {
+            "cost": 8.0,
+            "jobs:c": 2.0,
+            "cost:c": 8.0,
+        }
+
+    run_backend(
+        redis_settings, check, admission_settings=admission(max_queued_cost=10.0)
+    )
@@ -1,6 +1,60 @@
+import os
+import json
+import asyncio
+import time
+import zlib
+import tracemalloc
+from concurrent import futures
+
 import pytest
+from arq import constants
+from arq.jobs import JobStatus, serialize_result
 
-from wqw_app.worker import fib, main
+from wqw_app.backend import Backend
+from wqw_app.cache import ResultCache
+from wqw_app.checkpoint import Checkpoint
+from wqw_app.index import JobIndex
+from wqw_app.settings import (
+    BackendSettings,
+    BigIntSettings,
+    CheckpointSettings,
+    PairSettings,
+    ParallelSettings,
+    ProgressSettings,
+    QueueSettings,
+    RetentionSettings,
+)
+from wqw_app import (
+    bigint,
+    local,
+    metrics,
+    modular,
+    pairs,
+    parallel,
+    profiling,
+    progress,
+    retention,
+    scheduler,
+)
+from wqw_app.bigint import to_decimal
+from wqw_app.utils import (
+    abort_stats_key,
+    track_progress_jobs_key,
+    track_progress_key_prefix,
+)
+from wqw_app.worker import (
+    async_fib,
+    async_fib_range,
+    fib,
+    main,
+    fib_parallel_packed,
+    fib_range_chunk,
+    estimate_cost,
+    ComputationAborted,
+    Engine,
+    FibonacciTracker,
+    RESUMABLE_ENGINES,
+)
 
 __author__ = "Erik G. Brandt"
 __copyright__ = "Erik G. Brandt"
@@ -16,6 +70,454 @@ def test_fib():
         fib(-10)
 
 
+@pytest.mark.parametrize("engine", list(Engine))
+def test_fib_engines(engine):
+    """All engines agree with the reference sequence."""
+    reference = [1, 1]
+    while len(reference) < 30:
+        reference.append(reference[-1] + reference[-2])
+
+    for number, expected in enumerate(reference, start=1):
+        assert fib(number, engine=engine) == expected
+
+
+def test_fib_large():
+    """The O(log n) engines handle n far beyond the recursion limit."""
+    expected = fib(5000, engine=Engine.iterative)
+    assert fib(5000, engine=Engine.fast_doubling) == expected
+    assert fib(5000, engine=Engine.matrix) == expected
+
+
+@pytest.mark.parametrize("engine", [Engine.fast_doubling, Engine.matrix])
+def test_tracker_bits(engine):
+    """Logarithmic engines report progress per bit of n."""
+    tracker = FibonacciTracker(number=1_000_000, engine=engine)
+    fib(1_000_000, tracker=tracker, engine=engine)
+    assert tracker.max_iter == (1_000_000).bit_length()
+    assert tracker.progress == 1.0
+
+
+@pytest.mark.parametrize("engine", list(Engine))
+def test_estimate_cost(engine):
+    """Estimated cost grows with the number, is finite for any number a float
+    holds, and never overflows."""
+    costs = [estimate_cost(number, engine) for number in (10, 30, 10 ** 6, 10 ** 9)]
+    assert costs == sorted(costs)
+    assert 0 < costs[0] < 0.01
+    assert costs[-1] < float("inf")
+    assert estimate_cost(10 ** 400, engine) >= costs[-1]
+    assert estimate_cost(-5, engine) == estimate_cost(0, engine) < costs[0]
+
+
+def test_size_class_queues():
+    """Jobs go to the queue of their size class, shortest first if enabled."""
+    settings = QueueSettings(shortest_first=True, aging_window=10)
+    assert scheduler.queue_for(None, settings) == "arq:queue"
+    assert scheduler.queue_for(0.5, settings) == "arq:queue:small"
+    assert scheduler.queue_for(estimate_cost(10 ** 9, Engine.matrix)) == (
+        "arq:queue:large"
+    )
+    assert scheduler.score(100_000, 0, settings) == 90_000
+    assert scheduler.score(100_000, 9, settings) == 99_000
+    assert scheduler.score(100_000, None, settings) == 100_000
+
+
+def test_dispatch(with_redis):
+    """The dispatcher moves jobs by stride, skipping those already running."""
+
+    async def check(redis):
+        settings = QueueSettings(weights={"small": 2.0, "medium": 1.0})
+        (small, medium) = ("arq:queue:small", "arq:queue:medium")
+        await redis.zadd(small, 1000, "s1")
+        await redis.zadd(small, 2000, "s2")
+        await redis.zadd(small, 3000, "s3")
+        await redis.zadd(small, 4000, "s4")
+        await redis.zadd(medium, 1000, "m1")
+        await redis.zadd(medium, 2000, "m2")
+        # A job run by a worker dedicated to its size class.
+        await redis.set(constants.in_progress_key_prefix + "s1", b"1")
+
+        dispatcher = scheduler.Dispatcher(settings)
+        assert await dispatcher.dispatch(redis, 3) == [
+            scheduler.SizeClass.small,
+            scheduler.SizeClass.medium,
+            scheduler.SizeClass.small,
+        ]
+        assert await redis.zrange("arq:queue", withscores=True) == [
+            ("m1", 1000),
+            ("s2", 2000),
+            ("s3", 3000),
+        ]
+        # Jobs waiting to start count against the free slots.
+        assert await dispatcher.dispatch(redis, 3) == []
+        assert await dispatcher.dispatch(redis, 5) == [
+            scheduler.SizeClass.small,
+            scheduler.SizeClass.medium,
+        ]
+        assert await redis.zrange(small) == ["s1"]
+
+        # Size classes without jobs to move are reported idle.
+        (moved, idle) = await redis.eval(
+            scheduler._DISPATCH_SCRIPT,  # pylint: disable=protected-access
+            keys=["arq:queue", small, medium],
+            args=[4000, constants.in_progress_key_prefix, 10, "", 0, 0, 0.5, 1],
+        )
+        assert (moved, idle) == ([], [1, 2])
+
+        # Shortest first, the job with the lowest score goes next.
+        await redis.delete("arq:queue")
+        await redis.zadd(small, 2000, "s5")
+        await redis.zadd(medium, 1000, "m3")
+        dispatcher = scheduler.Dispatcher(
+            QueueSettings(weights=settings.weights, shortest_first=True)
+        )
+        assert await dispatcher.dispatch(redis, 1) == [scheduler.SizeClass.medium]
+
+    with_redis(check)
+
+
+def test_fib_range_chunk():
+    """A range chunk holds one NDJSON line per number, seeded mid-sequence."""
+    lines = zlib.decompress(fib_range_chunk(5000, 5010)).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"n": number, "value": fib(number)} for number in range(5000, 5011)
+    ]
+
+
+def test_to_decimal():
+    """Decimal conversion is exact beyond the int to str conversion limit."""
+    assert to_decimal(0) == "0"
+    assert to_decimal(-12345) == "-12345"
+    assert to_decimal(10 ** 20000) == "1" + "0" * 20000
+    assert to_decimal(10 ** 20000 - 1) == "9" * 20000
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_bigint_pack(compress):
+    """Large results round-trip through their compact form."""
+    value = fib(100_000)
+    settings = BigIntSettings(compress=compress)
+    assert bigint.is_large(value, settings)
+
+    info, blob = bigint.pack(value, "ref", settings)
+    assert bigint.is_packed(info)
+    assert bigint.unpack(info, blob) == value
+    assert "".join(bigint.iter_hex(info, blob)) == f"{value:x}"
+
+    digits = "".join(bigint.iter_decimal(value))
+    assert digits == to_decimal(value)
+    assert info["digits"] == len(digits) == 20899
+    assert digits.startswith(info["leading"]) and digits.endswith(info["trailing"])
+
+
+class InterruptedTracker(FibonacciTracker):
+    """Tracker counting its iterations and failing after `stop_at` of them."""
+
+    stop_at = None
+    calls = 0
+
+    def countup(self):
+        self.calls += 1
+        if self.calls == self.stop_at:
+            raise RuntimeError("interrupted")
+        return super().countup()
+
+
+@pytest.mark.parametrize("engine", RESUMABLE_ENGINES)
+def test_fib_resume(engine, tmp_path):
+    """An interrupted computation resumes from its checkpoint."""
+    number = 100_000
+    settings = CheckpointSettings(directory=str(tmp_path), interval=0)
+
+    tracker = InterruptedTracker(number=number, engine=engine)
+    tracker.stop_at = tracker.max_iter // 2
+    ctx = {"checkpoint": Checkpoint(number, engine.value, settings)}
+    with pytest.raises(RuntimeError):
+        fib(number, ctx, tracker=tracker, engine=engine)
+    assert ctx["checkpoint"].path.exists()
+
+    tracker = InterruptedTracker(number=number, engine=engine)
+    result = fib(number, ctx, tracker=tracker, engine=engine)
+    assert result == fib(number, engine=Engine.fast_doubling)
+    assert tracker.calls < tracker.max_iter
+    assert tracker.progress == 1.0
+    assert not ctx["checkpoint"].path.exists()
+
+
+# Upper bound on the time from an abort until the pool process is free.
+ABORT_BOUND_S = float(os.environ.get("ABORT_BOUND_S", "1.0"))
+
+
+@pytest.mark.parametrize("engine", [Engine.naive, Engine.iterative])
+def test_abort_frees_pool(engine):
+    """An aborted computation stops and frees its pool process promptly."""
+    relay = progress.ProgressRelay(1)
+    with futures.ProcessPoolExecutor(
+        1, initializer=progress.init_process, initargs=(relay.slots, relay.aborts)
+    ) as pool:
+        number = 100 if engine is Engine.naive else 10_000_000
+        future = pool.submit(fib, number, {"slot": 0}, engine=engine)
+        time.sleep(0.5)
+        assert future.running()
+
+        relay.abort(0)
+        start = time.monotonic()
+        with pytest.raises(ComputationAborted):
+            future.result(timeout=10 * ABORT_BOUND_S)
+        assert time.monotonic() - start < ABORT_BOUND_S
+        assert pool.submit(fib, 7).result(timeout=ABORT_BOUND_S) == 13
+
+
+def test_job_progress_and_abort(redis_settings, tmp_path, monkeypatch):
+    """Progress written in a pool process reaches the job info through the
+    relay, and aborting the job stops its computation and clears the flag
+    for the next job in the slot."""
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        arq_backend = Backend(redis_settings)
+        await arq_backend.init()
+        redis = arq_backend.redis_arq
+        relay = progress.ProgressRelay(1, ProgressSettings(interval=0.05))
+        pool = futures.ProcessPoolExecutor(
+            1, initializer=progress.init_process, initargs=(relay.slots, relay.aborts)
+        )
+        relay_task = asyncio.create_task(relay.run(redis))
+        ctx = {
+            "redis": redis,
+            "relay": relay,
+            "pool": pool,
+            "processes": 1,
+            "cache": ResultCache(redis),
+            "index": JobIndex(redis),
+            "job_try": 1,
+        }
+
+        async def start(job_id, number):
+            """Run an iterative job as the arq worker would."""
+            job = await arq_backend.enqueue_job(
+                async_fib, number, engine="iterative", _job_id=job_id
+            )
+            await redis.set(constants.in_progress_key_prefix + job_id, b"1")
+            info = await job.info()
+            ctx.update(job_id=job_id, enqueue_time=info.enqueue_time)
+            return asyncio.create_task(async_fib(dict(ctx), number, engine="iterative"))
+
+        try:
+            task = await start("slow", 10_000_000)
+            while not 0 < (await arq_backend.info("slow")).get("progress", 0) < 1:
+                await asyncio.sleep(0.05)
+            assert await redis.sismember(track_progress_jobs_key, "slow")
+
+            task.cancel()
+            start_time = time.monotonic()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert time.monotonic() - start_time < ABORT_BOUND_S
+            assert relay.free == 1
+            assert not await redis.exists(track_progress_key_prefix + "slow")
+            assert (await redis.hgetall(abort_stats_key))["count"] == "1"
+
+            task = await start("next", 10_000)
+            assert await task == fib(10_000)
+            assert not relay.aborts[0]
+        finally:
+            relay_task.cancel()
+            pool.shutdown()
+            await arq_backend.close()
+
+    asyncio.run(run())
+
+
+def test_metrics_render():
+    """Histograms render cumulative buckets in the Prometheus text format."""
+    registry = metrics.Registry()
+    histogram = metrics.Histogram(
+        "wait_seconds", "Wait.", ["queue"], buckets=[1, 10], registry=registry
+    )
+    for value in (0.5, 5, 50):
+        histogram.labels('a"b').observe(value)
+    lines = registry.render().splitlines()
+    assert lines[1] == "# TYPE wait_seconds histogram"
+    assert lines[2:] == [
+        'wait_seconds_bucket{queue="a\\"b",le="1"} 1',
+        'wait_seconds_bucket{queue="a\\"b",le="10"} 2',
+        'wait_seconds_bucket{queue="a\\"b",le="+Inf"} 3',
+        'wait_seconds_sum{queue="a\\"b"} 55.5',
+        'wait_seconds_count{queue="a\\"b"} 3',
+    ]
+    assert metrics.magnitude(1234) == "1e3"
+
+
+@pytest.mark.parametrize(
+    ("tracing", "reset_peak"), [(False, True), (True, True), (True, False)]
+)
+def test_profile_call(tracing, reset_peak, monkeypatch):
+    """A profiled call returns its result and where its time went, whether
+    memory was traced before or not, and also without
+    tracemalloc.reset_peak, as on Python 3.8."""
+    if not reset_peak:
+        monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    if tracing:
+        tracemalloc.start()
+    (result, summary) = profiling.profile_call(fib, 10_000, engine=Engine.iterative)
+    assert result == fib(10_000)
+    assert summary["wall_s"] >= summary["functions"][0]["self_s"] > 0
+    assert summary["peak_bytes"] > 0
+    assert any(stats["function"].startswith("fib ") for stats in summary["functions"])
+    assert tracemalloc.is_tracing() == tracing
+    tracemalloc.stop()
+
+
+def test_retention_measure():
+    """Complete jobs are measured with the large integers and chunks they hold."""
+    (info, blob) = bigint.pack(fib(100_000), "ref")
+    raw = serialize_result("async_fib", (1,), {}, 1, 0, True, info, 0, 0, "x", "q")
+    job = retention.measure("job", raw, 10)
+    assert job["bytes"] == len(raw) + 10 + len(blob)
+    assert (job["ref"], job["blob_bytes"]) == ("ref", len(blob))
+
+    chunks = {"start": 1, "stop": 20, "chunk_size": 10, "chunks": 2, "bytes": 99}
+    raw = serialize_result(
+        "async_fib_range", (1, 20), {}, 1, 0, True, chunks, 0, 0, "x", "q"
+    )
+    job = retention.measure("job", raw, 0)
+    assert job["bytes"] == len(raw) + 99
+    assert job["keys"][-2:] == ["arq:range:job:0", "arq:range:job:1"]
+
+
+def test_compactor(with_redis):
+    """Complete jobs are deleted oldest first, a batch at a time, and the
+    progress keys of jobs no longer running with them."""
+
+    async def check(redis):
+        index = JobIndex(redis)
+        raw = serialize_result("async_fib", (1,), {}, 1, 0, True, 1, 0, 0, "x", "q")
+        for i in range(5):
+            await index.add(f"job{i}", i, JobStatus.complete)
+            # The result of one job has expired.
+            if i != 1:
+                await redis.set(constants.result_key_prefix + f"job{i}", raw)
+        await redis.sadd("arq:track-jobs", "job4", "running")
+        await redis.set("arq:track:job4", b"1")
+        await redis.set("arq:track:running", b"1")
+        await redis.set(constants.in_progress_key_prefix + "running", b"1")
+
+        compactor = retention.Compactor(
+            redis,
+            RetentionSettings(max_age=-1, max_results=2, max_bytes=-1, batch_size=2),
+        )
+        stats = await compactor.run()
+        assert (stats["deleted"], stats["expired"], stats["kept"]) == (2, 1, 2)
+        assert stats["kept_bytes"] == 2 * len(raw)
+        assert stats["reclaimed_bytes"] == 2 * len(raw) + 1
+        assert await index.oldest(JobStatus.complete) == [("job3", 3), ("job4", 4)]
+        assert await redis.exists(constants.result_key_prefix + "job2") == 0
+        assert await redis.smembers("arq:track-jobs") == ["running"]
+        assert await redis.exists("arq:track:job4", "arq:track:running") == 1
+
+        stats = await compactor.run()
+        assert (stats["deleted"], stats["kept"]) == (0, 2)
+
+    with_redis(check)
+
+
+def test_pair_table(tmp_path, monkeypatch):
+    """Computations start from and add to the pair table, and agree with
+    those from scratch."""
+    table = pairs.PairTable(PairSettings(directory=str(tmp_path), stride=100))
+    monkeypatch.setattr(pairs, "_table", table)
+    for number in (1234, 1250, 1190, 5000):
+        for engine in (Engine.iterative, Engine.fast_doubling):
+            expected = fib(number, engine=engine)
+            assert fib(number, {"pairs": True}, engine=engine) == expected
+    assert table.keys == [1200, 1300, 5000]
+    assert fib_range_chunk(1195, 1205, {"pairs": True}) == fib_range_chunk(1195, 1205)
+
+    table = pairs.PairTable(
+        PairSettings(directory=str(tmp_path / "small"), stride=100, max_bytes=100)
+    )
+    assert table.add(100, pairs.fib_pair(100))
+    assert not table.add(1000, pairs.fib_pair(1000))
+    assert table.keys == [100]
+
+
+def test_parallel_fib_pair():
+    """Products split across pool processes give the same numbers."""
+
+    numbers = (1, 2, 100, 12345, 50001)
+    with futures.ProcessPoolExecutor(2) as pool:
+        for processes in (1, 9):
+            multiplier = parallel.Multiplier(
+                pool, processes, ParallelSettings(min_bits=1000)
+            )
+            assert [parallel.fib_pair(number, multiplier) for number in numbers] == [
+                pairs.fib_pair(number) for number in numbers
+            ]
+
+        # The worker drives it from a thread, reporting progress and stopping
+        # once aborted.
+        relay = progress.ProgressRelay(1)
+        assert fib_parallel_packed(50001, multiplier, relay, 0, "ref") == (
+            bigint.pack(fib(50001), "ref")
+        )
+        assert relay.slots[0] == 1.0
+        relay.abort(0)
+        with pytest.raises(ComputationAborted):
+            fib_parallel_packed(50001, multiplier, relay, 0, "ref")
+
+
+def test_fib_mod():
+    """F(n) mod m agrees with F(n), reduced by the Pisano period or not."""
+    assert [modular.pisano_period(m) for m in (1, 2, 3, 10, 1000)] == [
+        1,
+        3,
+        8,
+        60,
+        1500,
+    ]
+    for modulus in (1, 7, 1000, 10 ** 9 + 7, 2 ** 64):
+        for number in (0, 1, 2, 1234, 5000):
+            expected = fib(number) % modulus if number else 0
+            assert modular.fib_mod(str(number), modulus) == expected
+    number = "9" * 5000
+    assert (
+        modular.fib_mod(number, 2 ** 61 - 1)
+        == modular.fib_mod_pair(modular.reduce_decimal(number), 2 ** 61 - 1)[0]
+    )
+
+
+def test_local_backend(tmp_path, monkeypatch):
+    """The in-process backend runs jobs in its pool and aborts queued ones."""
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        backend = local.LocalBackend(BackendSettings(local=True, processes=1))
+        await backend.init()
+        try:
+            job = await backend.enqueue_job(async_fib, 100_000, _job_id="big")
+            assert await backend.enqueue_job(async_fib, 1, _job_id="big") is None
+            waiting = await backend.enqueue_job(async_fib, 50, engine="naive")
+            assert await backend.abort(waiting.job_id, timeout=1)
+            info = await job.result(timeout=10)
+            blob = await backend.bigint_blob(info["ref"])
+            assert bigint.unpack(info, blob) == fib(100_000)
+
+            job = await backend.enqueue_job(async_fib_range, 1, 20, chunk_size=10)
+            assert (await job.result(timeout=10))["chunks"] == 2
+            chunk = zlib.decompress(await backend.range_chunk(job.job_id, 1))
+            assert json.loads(chunk.splitlines()[-1]) == {"n": 20, "value": 6765}
+
+            (page, cursor) = await backend.info_page(limit=2)
+            assert [info["status"] for info in page] == ["complete"] * 2
+            (page, _) = await backend.info_page(cursor=cursor)
+            assert [info["job_id"] for info in page] == ["big"]
+        finally:
+            await backend.close()
+
+    asyncio.run(run())
+
+
 def test_main(capsys):
     """CLI Tests"""
     # capsys is a pytest fixture that allows asserts agains stdout/stderr